@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# benchmarks.py micro benchmarks of immoKrabbler on synthetic corpora
+# Copyright © 2019 Henrik Lindgren (henrikprojekt at googlemail dot com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import sys
+import time
+import tracemalloc
+import immoKrabbler
+import fixtures
+
+def fixture_entries():
+    """:returns: list of the raw resultlistEntries of all fixture pages"""
+    entries = []
+    for name in sorted(fixtures.expected()):
+        entries.extend(immoKrabbler.result_entries(immoKrabbler.extract_result_model(fixtures.read(name))))
+    return entries
+
+def corpus(n):
+    """synthetic corpus of n raw entries, the fixture entries repeated with unique ids
+    :returns: list of dicts"""
+    templates = fixture_entries()
+    entries = []
+    for i in range(n):
+        entry = dict(templates[i % len(templates)])
+        entry['@id'] = str(200000000 + i)
+        entry['search_url'] = 'https://www.immobilienscout24.de/Suche/S-T/Wohnung-Miete/Thueringen/Gotha'
+        entries.append(entry)
+    return entries
+
+def measure(func, *args):
+    """runs func once for its time and once under tracemalloc for its peak memory
+    :returns: tuple (seconds, peak MiB)"""
+    start = time.perf_counter()
+    func(*args)
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak / 2 ** 20
+
+def bench_normalize(n=100000):
+    """normalize against the json round trip of Immo_scraper._jsn2immobilie"""
+    entries = corpus(n)
+    # the legacy function is an instance method but uses no scraper state
+    scraper = immoKrabbler.Immo_scraper.__new__(immoKrabbler.Immo_scraper)
+    scraper.debug = False
+    results = {}
+    for name, func in (('_jsn2immobilie', scraper._jsn2immobilie), ('normalize', immoKrabbler.normalize)):
+        results[name] = measure(func, entries)
+        print('{0:>16}: {1:8.3f}s {2:8.1f} MiB peak for {3} entries'.format(name, *results[name], n))
+    print('{0:>16}: {1:8.1f}x faster'.format('speedup', results['_jsn2immobilie'][0] / results['normalize'][0]))
+    return {'normalize entries/s': n / results['normalize'][0], 'normalize MiB': results['normalize'][1]}
+
+def bench_records(n=1000000):
+    """memory of n listings held as the dicts of normalize against Immo_scraper.Immobilie records"""
+    templates = immoKrabbler.normalize(fixture_entries())
+    record = immoKrabbler.Immo_scraper.Immobilie
+
+    def dicts():
+        return [dict(templates[i % len(templates)], id=i) for i in range(n)]
+
+    def records():
+        immobilien = [record.fromdict(templates[i % len(templates)]) for i in range(n)]
+        for i, immo in enumerate(immobilien):
+            immo.id = i
+        return immobilien
+
+    results = {}
+    for name, func in (('dicts', dicts), ('records', records)):
+        results[name] = measure(func)
+        print('{0:>16}: {1:8.3f}s {2:8.1f} MiB peak for {3} listings'.format(name, *results[name], n))
+    immobilien = records()
+    # the conversion database.insertimmobilie does before its executemany
+    start = time.perf_counter()
+    for immo in immobilien:
+        immo.asdict()
+    asdict = time.perf_counter() - start
+    print('{0:>16}: {1:8.3f}s'.format('asdict', asdict))
+    print('{0:>16}: {1:8.1f}x less memory'.format('records', results['dicts'][1] / results['records'][1]))
+    return {'records MiB': results['records'][1], 'asdict records/s': n / asdict}
+
+def bench_near(n=1000000):
+    """database.near on n listings spread over germany against a scan of the whole table"""
+    import random
+    import tempfile
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = immoKrabbler.database(db_uri='sqlite:///{0}/near.db'.format(tmp))
+        positions = [(random.uniform(47.3, 55.0), random.uniform(5.9, 15.0)) for i in range(n)]
+        start = time.perf_counter()
+        for i in range(0, n, 50000):
+            with db.conn.begin():
+                db.conn.execute(db.immobilien.insert(), [
+                    {'id': iid, 'latitude': lat, 'longitude': lon, 'geohash': immoKrabbler.geohash(lat, lon)}
+                    for iid, (lat, lon) in enumerate(positions[i:i + 50000], i)])
+        print('{0:>16}: {1:8.3f}s for {2} listings'.format('insert', time.perf_counter() - start, n))
+        centers = positions[:20]
+        metrics = {}
+        for km in (1, 3, 10):
+            start = time.perf_counter()
+            found = [len(db.near(lat, lon, km)) for lat, lon in centers]
+            seconds = (time.perf_counter() - start) / len(centers)
+            metrics['near {0} km queries/s'.format(km)] = 1 / seconds
+            print('{0:>16}: {1:8.4f}s per query, {2:.0f} hits on average'.format(
+                'near {0} km'.format(km), seconds, sum(found) / len(found)))
+        start = time.perf_counter()
+        lat, lon = centers[0]
+        scanned = sum(1 for la, lo in db.conn.execute(
+            immoKrabbler.select([db.immobilien.c.latitude, db.immobilien.c.longitude]))
+            if immoKrabbler.haversine(lat, lon, la, lo) <= 3)
+        print('{0:>16}: {1:8.4f}s per query, {2} hits'.format('scan 3 km', time.perf_counter() - start, scanned))
+        db.conn.close()
+    return metrics
+
+def bench_dedup(n=1000000):
+    """Deduplicator on n listings with 5% planted re-posts, reports precision and recall"""
+    import random
+    import tempfile
+    random.seed(0)
+    words = ['Helle', 'Ruhige', 'Sanierte', 'Große', 'Moderne', 'Wohnung', 'Balkon', 'Garten', 'Altbau', 'Lage',
+             'Zentrum', 'zentraler', 'im', 'mit', 'Grünen', 'Neubau', 'Dachgeschoss', 'Maisonette']
+    streets = ['Haupt', 'Bahnhof', 'Garten', 'Schul', 'Berg', 'Wald', 'Linden', 'Mozart', 'Goethe', 'Schiller']
+    with tempfile.TemporaryDirectory() as tmp:
+        db = immoKrabbler.database(db_uri='sqlite:///{0}/dedup.db'.format(tmp))
+        rows = []
+        truth = {}  # id of a re-post: id of the original
+        for iid in range(n):
+            if iid > 0 and random.random() < 0.05:
+                original = rows[random.randrange(max(0, len(rows) - 1000), len(rows))]
+                row = dict(original, id=iid, kaltmiete=round(original['kaltmiete'] * random.uniform(0.97, 1.03), 2),
+                           title=' '.join(random.sample(original['title'].split(), 3)) + ' provisionsfrei',
+                           address=original['address'].replace('straße', 'str.'))
+                truth[iid] = truth.get(original['id'], original['id'])
+            else:
+                zipcode = 10000 + random.randrange(2000)
+                area = round(random.uniform(25, 160), 2)
+                row = {'id': iid, 'zip': zipcode, 'zimmer': random.choice([1, 1.5, 2, 2.5, 3, 3.5, 4, 5]),
+                       'wohnfläche': area, 'kaltmiete': round(area * random.uniform(6, 16), 2),
+                       'title': ' '.join(random.sample(words, 4)),
+                       'address': '{0}straße {1}, {2} Stadt'.format(random.choice(streets), random.randrange(1, 120),
+                                                                    zipcode)}
+            rows.append(row)
+        for i in range(0, n, 50000):
+            with db.conn.begin():
+                db.conn.execute(db.immobilien.insert(), rows[i:i + 50000])
+        del rows
+        deduplicator = immoKrabbler.Deduplicator(db)
+        start = time.perf_counter()
+        listings, clusters = deduplicator.run()
+        seconds = time.perf_counter() - start
+        found = dict(db.conn.execute(immoKrabbler.select([db.immobilien.c.id, db.immobilien.c.cluster_id])).fetchall())
+        hits = sum(1 for iid, original in truth.items() if found[iid] == found[original])
+        planted = sum(1 for iid, cluster in found.items() if cluster != iid)
+        print('{0:>16}: {1:8.3f}s for {2} listings, {3} pairs compared instead of {4}'.format(
+            'dedup', seconds, n, deduplicator.compared, n * (n - 1) // 2))
+        print('{0:>16}: {1} listings in {2} clusters'.format('found', listings, clusters))
+        recall, precision = hits / max(len(truth), 1), min(hits, planted) / max(planted, 1)
+        print('{0:>16}: {1:.3f} recall, {2:.3f} precision'.format('quality', recall, precision))
+        db.conn.close()
+    return {'dedup listings/s': n / seconds, 'dedup recall': recall, 'dedup precision': precision}
+
+def bench_writes(n=100000):
+    """insertstream throughput with the driver defaults against the tuned database, on a sqlite file and
+    on postgres if BENCH_POSTGRES holds a connection string, e.g. postgresql://localhost/immokrabbler_bench"""
+    import tempfile
+    immobilien = immoKrabbler.normalize(corpus(n))
+    metrics = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = [('sqlite', 'sqlite:///{0}/{{0}}.db'.format(tmp))]
+        if os.environ.get('BENCH_POSTGRES'):
+            backends.append(('postgres', os.environ['BENCH_POSTGRES']))
+        for backend, uri in backends:
+            for tuned in (False, True):
+                name = '{0} {1}'.format(backend, 'tuned' if tuned else 'default')
+                db = immoKrabbler.database(db_uri=uri.format(name.replace(' ', '_')), tuned=tuned)
+                start = time.perf_counter()
+                inserted, updated = db.insertstream(iter(immobilien))
+                seconds = time.perf_counter() - start
+                print('{0:>16}: {1:8.3f}s {2:8.0f} immobilien/s for {3} immobilien in batches of {4}'.format(
+                    name, seconds, inserted / seconds, inserted, db.batch_size))
+                metrics['insert {0} rows/s'.format(name)] = inserted / seconds
+                db.conn.close()
+                if backend == 'postgres':
+                    db.metadata.drop_all()
+                db.engine.dispose()
+    return metrics
+
+def bench_parse(n=2000):
+    """result pages per second through extract_result_model, result_entries and normalize,
+    n pages cycling through the fixtures"""
+    pages = [fixtures.read(name) for name in sorted(fixtures.expected())]
+    entries = 0
+    start = time.perf_counter()
+    for i in range(n):
+        entries += len(immoKrabbler.normalize(immoKrabbler.result_entries(
+            immoKrabbler.extract_result_model(pages[i % len(pages)]))))
+    seconds = time.perf_counter() - start
+    print('{0:>16}: {1:8.3f}s {2:8.0f} pages/s {3:8.0f} entries/s for {4} pages'.format(
+        'parse', seconds, n / seconds, entries / seconds, n))
+    return {'parse pages/s': n / seconds, 'parse entries/s': entries / seconds}
+
+def synthetic_search(cache, url, pages):
+    """replays a search of pages result pages, the entries of the fixtures with unique ids, into cache
+    :cache: Http_cache
+    :url: search url
+    :returns: nr of entries"""
+    model = immoKrabbler.extract_result_model(fixtures.read('gotha_wohnung_miete_p1.html'))
+    entries = corpus(20 * pages)
+    for page in range(1, pages + 1):
+        model['resultlist.resultlist']['paging'].update(pageNumber=page, numberOfPages=pages)
+        model['resultlist.resultlist']['resultlistEntries'][0]['resultlistEntry'] = entries[20 * (page - 1):20 * page]
+        html = '<script>IS24.resultList = {{resultListModel: {{searchResponseModel: {0}}}}};</script>'.format(
+            json.dumps(model, ensure_ascii=False))
+        cache.put(immoKrabbler.page_url(url, page), {'content-type': 'text/html; charset=utf-8'}, html.encode('utf-8'))
+    return len(entries)
+
+def bench_crawl(n=500):
+    """end to end crawl of a search of n result pages replayed from an offline cache into a sqlite db,
+    paging, parsing, the frontier, analytics and the batched writes of insertstream"""
+    import tempfile
+    url = 'https://www.immobilienscout24.de/Suche/S-T/Wohnung-Miete/Thueringen/Gotha'
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = immoKrabbler.Http_cache(os.path.join(tmp, 'cache'), offline=True)
+        synthetic_search(cache, url, n)
+        db = immoKrabbler.database(db_uri='sqlite:///{0}/crawl.db'.format(tmp))
+        analytics = immoKrabbler.Analytics(db)
+        scraper = immoKrabbler.Immo_scraper(engine='http', cache=cache, frontier=db, analytics=analytics)
+        start = time.perf_counter()
+        inserted, _ = db.insertstream(scraper.iter_immobilien([url]), on_commit=scraper.checkpoint)
+        analytics.medians()
+        seconds = time.perf_counter() - start
+        print('{0:>16}: {1:8.3f}s {2:8.1f} pages/s {3:8.0f} immobilien/s for {4} pages'.format(
+            'crawl', seconds, n / seconds, inserted / seconds, n))
+        db.conn.close()
+    return {'crawl pages/s': n / seconds, 'crawl immobilien/s': inserted / seconds}
+
+EXPOSE = ('<html><body><dl><dd class="is24qa-etage grid-item">{0} von 5</dd></dl>'
+          '<dl><dd class="is24qa-baujahr grid-item">{1}</dd></dl>'
+          '<dl><dd class="is24qa-hausgeld grid-item">{2},50 &euro;</dd></dl>'
+          '<dl><dd class="is24qa-endenergiebedarf grid-item">117,2 kWh/(m&sup2;*a)</dd></dl>'
+          '<dl><dd class="is24qa-heizungsart grid-item">Zentralheizung</dd></dl></body></html>')
+
+def bench_enrich(n=5000):
+    """Enricher on n listings with synthetic exposés in an offline cache, the first run fetches,
+    parses and records all of them, the second finds nothing new and only selects"""
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        db = immoKrabbler.database(db_uri='sqlite:///{0}/enrich.db'.format(tmp))
+        db.insertstream(immoKrabbler.normalize(corpus(n)))
+        cache = immoKrabbler.Http_cache(os.path.join(tmp, 'cache'), offline=True)
+        for iid, _ in db.selectUnenriched():
+            cache.put(immoKrabbler.EXPOSE_URL.format(iid), {'content-type': 'text/html; charset=utf-8'},
+                      EXPOSE.format(iid % 6, 1900 + iid % 120, iid % 400).encode('utf-8'))
+        enricher = immoKrabbler.Enricher(db, pool=immoKrabbler.Connection_pool(cache=cache), interval=0)
+        metrics = {}
+        for run in ('first', 'again'):
+            start = time.perf_counter()
+            enriched, failed = enricher.run(limit=n)
+            seconds = time.perf_counter() - start
+            print('{0:>16}: {1:8.3f}s {2:8.0f} listings/s, {3} enriched, {4} failed'.format(
+                'enrich ' + run, seconds, n / seconds, enriched, failed))
+            metrics['enrich {0} listings/s'.format(run)] = n / seconds
+        db.conn.close()
+    return metrics
+
+def bench_alerts(n=50000, watchlists=10000, sample=500):
+    """Alerts matching n new listings against watchlists spread over 2000 zips and 200 cities, 1% of
+    them anywhere, the index against testing every watchlist on a sample of the listings, and the insert batches of
+    insertstream with the alerts queued in the outbox against without"""
+    import random
+    import tempfile
+    random.seed(0)
+    zips, cities = list(range(10000, 12000)), ['Stadt {0}'.format(i) for i in range(200)]
+    attributes = ['balcony', 'garden', 'builtInKitchen', 'cellar', 'lift', 'guestToilet']
+
+    def listing(iid):
+        rent = random.random() < 0.7
+        area = round(random.uniform(25, 160), 2)
+        return {'id': iid, 'zip': random.choice(zips), 'city': random.choice(cities), 'title': 'Wohnung',
+                'wohnfläche': area, 'zimmer': random.choice([1, 1.5, 2, 2.5, 3, 4, 5]),
+                'kaltmiete': round(area * random.uniform(6, 16), 2) if rent else None,
+                'kaufpreis': None if rent else round(area * random.uniform(1500, 5000), -3),
+                'checkedattributes': random.sample(attributes, random.randrange(4))}
+
+    def watchlist():
+        criteria = [['kaltmiete', '<=', random.randrange(300, 2000, 50)] if random.random() < 0.7 else
+                    ['kaufpreis', '<', random.randrange(100000, 800000, 10000)]]
+        where = random.random()
+        if where < 0.7:
+            criteria.append(['zip', '=', random.sample(zips, random.randrange(1, 6))])
+        elif where < 0.99:
+            criteria.append(['city', '=', random.sample(cities, random.randrange(1, 3))])
+        # a search anywhere is a narrow one
+        anywhere = len(criteria) == 1
+        if anywhere or random.random() < 0.5:
+            criteria.append(['wohnfläche', '>', random.randrange(30, 120, 5)])
+        if anywhere or random.random() < 0.3:
+            criteria.append(['checkedattributes', '=', random.sample(attributes, random.randrange(1, 3))])
+        return criteria
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = immoKrabbler.database(db_uri='sqlite:///{0}/alerts.db'.format(tmp))
+        alerts = immoKrabbler.Alerts(db)
+        db.conn.execute(alerts.watchlists.insert(), [{'name': str(i), 'criteria': watchlist(), 'unixtimestamp': 0}
+                                                     for i in range(watchlists)])
+        immobilien = [listing(iid) for iid in range(n)]
+        start = time.perf_counter()
+        alerts._compiled()
+        print('{0:>16}: {1:8.3f}s for {2} watchlists'.format('compile', time.perf_counter() - start, watchlists))
+        start = time.perf_counter()
+        matches = alerts.match(immobilien)
+        indexed = time.perf_counter() - start
+        print('{0:>16}: {1:8.3f}s {2:8.0f} listings/s, {3} matches'.format('index', indexed, n / indexed,
+                                                                           len(matches)))
+        predicates = list(alerts._predicates.items())
+        start = time.perf_counter()
+        naive = []
+        for immo in immobilien[:sample]:
+            values = dict((column, None if immo.get(column) is None else normalizer(immo[column]))
+                          for column, normalizer in alerts._columns.items())
+            naive.extend((wid, immo['id']) for wid, predicate in predicates
+                         if all(values[c] is not None and test(values[c], v) for c, test, v in predicate))
+        scan = (time.perf_counter() - start) / sample
+        assert sorted(naive) == sorted(m for m in matches if m[1] < sample), 'index and scan disagree'
+        print('{0:>16}: {1:8.3f}s {2:8.0f} listings/s, {3:.0f}x slower, extrapolated from {4}'.format(
+            'scan', scan * n, 1 / scan, scan * n / indexed, sample))
+        metrics = {'alerts index listings/s': n / indexed, 'alerts scan listings/s': 1 / scan}
+        for name, hooks in (('insert', []), ('insert alerts', [alerts.queue])):
+            db.on_insert = hooks
+            start = time.perf_counter()
+            db.insertstream(iter([dict(immo, id=immo['id'] + (n if hooks else 0)) for immo in immobilien]))
+            seconds = time.perf_counter() - start
+            print('{0:>16}: {1:8.3f}s {2:8.0f} listings/s'.format(name, seconds, n / seconds))
+            metrics['{0} listings/s'.format(name)] = n / seconds
+        db.conn.close()
+    return metrics
+
+def bench_startup(n=10):
+    """wall time of fresh interpreters running --help and a db only --report, as script and as module
+    from the cached bytecode, the best of n runs each"""
+    import subprocess
+    import tempfile
+    here = os.path.dirname(os.path.abspath(__file__))
+    script = os.path.join(here, 'immoKrabbler.py')
+    metrics = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        uri = 'sqlite:///{0}/startup.db'.format(tmp)
+        immoKrabbler.database(db_uri=uri).conn.close()
+        commands = [('help', [script, '--help']), ('help module', ['-m', 'immoKrabbler', '--help']),
+                    ('report', [script, '--database', uri, '--report', 'city']),
+                    ('report module', ['-m', 'immoKrabbler', '--database', uri, '--report', 'city'])]
+        for name, args in commands:
+            best = float('inf')
+            for _ in range(n):
+                start = time.perf_counter()
+                subprocess.run([sys.executable, '-W', 'ignore'] + args, cwd=here, check=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                best = min(best, time.perf_counter() - start)
+            print('{0:>16}: {1:8.1f}ms {2:8.1f} starts/s best of {3}'.format(name, best * 1000, 1 / best, n))
+            metrics['{0} starts/s'.format(name)] = 1 / best
+    return metrics
+
+def higher_is_better(metric):
+    """:returns: True for rates and quality metrics, False for sizes"""
+    return metric.endswith('/s') or metric.endswith(' recall') or metric.endswith(' precision')
+
+def regressions(metrics, baseline, threshold):
+    """
+    :metrics: dict benchmark: dict metric: value of this run
+    :baseline: the same of a saved run
+    :threshold: fraction a metric may get worse by, e.g. 0.2
+    :returns: list of tuples (benchmark, metric, baseline value, value) worse than threshold
+    """
+    worse = []
+    for name, values in metrics.items():
+        for metric, value in values.items():
+            base = baseline.get(name, {}).get(metric)
+            if base is None:
+                continue
+            if (value < base * (1 - threshold)) if higher_is_better(metric) else (value > base * (1 + threshold)):
+                worse.append((name, metric, base, value))
+    return worse
+
+BENCHMARKS = {'normalize': bench_normalize, 'records': bench_records, 'near': bench_near, 'dedup': bench_dedup,
+              'writes': bench_writes, 'parse': bench_parse, 'crawl': bench_crawl, 'startup': bench_startup,
+              'enrich': bench_enrich, 'alerts': bench_alerts}
+
+def main():
+    """main"""
+    import argparse
+    parser = argparse.ArgumentParser(description='immoKrabbler micro benchmarks')
+    parser.add_argument('benchmarks', nargs='*', help='benchmarks to run out of {0}, defaults to all'.format(
+        ', '.join(sorted(BENCHMARKS))))
+    parser.add_argument('-n', type=int, dest='n', required=False, help='corpus size')
+    parser.add_argument('--save', dest='save', required=False,
+                        help='save the metrics as baseline to this json file, merged with the ones in it')
+    parser.add_argument('--baseline', dest='baseline', required=False,
+                        help='compare the metrics with a saved baseline, exits 1 on a regression, 2 without the file')
+    parser.add_argument('--threshold', type=float, default=0.2, dest='threshold', required=False,
+                        help='fraction a metric may get worse by against the baseline, defaults to 0.2')
+    results = parser.parse_args()
+    unknown = set(results.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error('unknown benchmarks: {0}'.format(', '.join(sorted(unknown))))
+    if results.baseline and not os.path.isfile(results.baseline):
+        # timings only compare on the machine they were taken on, so no baseline is shipped, but
+        # a check without one must not pass
+        parser.error('no baseline in {0}, save one on this machine with --save {0}'.format(results.baseline))
+    metrics = {}
+    for name in results.benchmarks or sorted(BENCHMARKS):
+        print(name)
+        if results.n:
+            metrics[name] = BENCHMARKS[name](results.n)
+        else:
+            metrics[name] = BENCHMARKS[name]()
+    if results.save:
+        saved = {}
+        if os.path.isfile(results.save):
+            with open(results.save) as baseline:
+                saved = json.load(baseline)
+        saved.update(metrics)
+        with open(results.save, 'w') as baseline:
+            json.dump(saved, baseline, indent=2, sort_keys=True)
+        print('saved baseline to', results.save)
+    if results.baseline:
+        with open(results.baseline) as baseline:
+            worse = regressions(metrics, json.load(baseline), results.threshold)
+        for name, metric, base, value in worse:
+            print('regression {0}: {1} {2:.4g} against {3:.4g} in the baseline'.format(name, metric, value, base))
+        if worse:
+            sys.exit(1)
+        print('no regression beyond {0:.0%} against {1}'.format(results.threshold, results.baseline))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# fixtures.py records result pages into fixtures/resultlist and replays them to immoKrabbler
+# Copyright © 2019 Henrik Lindgren (henrikprojekt at googlemail dot com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import re
+import sys
+import immoKrabbler
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'resultlist')
+EXPECTED = os.path.join(FIXTURES, 'expected.json')
+PICTURES = 'https://pictures.immobilienscout24.de/'
+
+def expected():
+    """:returns: dict file name: dict with entries, next, numberOfPages, pageNumber and url of the page"""
+    with open(EXPECTED, encoding='utf-8') as store:
+        return json.load(store)
+
+def read(name):
+    """:returns: page source of the fixture name"""
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as page:
+        return page.read()
+
+def fixture_name(url, page):
+    """file name of a recorded page, alike gotha_wohnung_miete_p1.html for
+    https://www.immobilienscout24.de/Suche/S-T/Wohnung-Miete/Thueringen/Gotha"""
+    segments = [s for s in re.sub(r'/P-\d+/', '/', url.split('?')[0]).split('/') if s]
+    kind = segments[segments.index('S-T') + 1] if 'S-T' in segments[:-1] else 'suche'
+    return '{0}_{1}_p{2}.html'.format(segments[-1], kind, page).lower().replace('-', '_')
+
+def record(urls, max_pages=None, debug=False):
+    """fetches the result pages of search urls and stores each as html, its resultlistEntries as
+    json next to it and what the parser makes of it in expected.json
+    :urls: search urls
+    :max_pages: record at most this many pages per url
+    :returns: list of file names recorded
+    """
+    store = expected()
+    pool = immoKrabbler.Connection_pool(immoKrabbler.Immo_scraper(engine='http').headers, debug=debug)
+    recorded = []
+    for url in urls:
+        immoKrabbler.validate_url(url)
+        page, pages = 1, 1
+        while page <= pages:
+            status, _, body, _ = pool.request(immoKrabbler.page_url(url, page))
+            if status != 200:
+                sys.exit('GET {0} returned HTTP {1}'.format(immoKrabbler.page_url(url, page), status))
+            html = body.decode('utf-8', 'replace')
+            model = immoKrabbler.extract_result_model(html)
+            number, pages = immoKrabbler.paging_info(model)
+            if max_pages is not None:
+                pages = min(pages, max_pages)
+            name = fixture_name(url, page)
+            with open(os.path.join(FIXTURES, name), 'w', encoding='utf-8') as out:
+                out.write(html)
+            with open(os.path.join(FIXTURES, name[:-len('.html')] + '.json'), 'w', encoding='utf-8') as out:
+                json.dump(immoKrabbler.result_entries(model), out, ensure_ascii=False, indent=1, sort_keys=True)
+            store[name] = {'url': immoKrabbler.page_url(url, page), 'entries': len(immoKrabbler.result_entries(model)),
+                           'pageNumber': number, 'numberOfPages': immoKrabbler.paging_info(model)[1],
+                           'next': immoKrabbler.page_url(url, page + 1) if page < pages else None}
+            recorded.append(name)
+            page += 1
+    pool.close()
+    with open(EXPECTED, 'w', encoding='utf-8') as out:
+        json.dump(store, out, indent=2, sort_keys=True)
+        out.write('\n')
+    return recorded
+
+def check():
+    """parses every fixture and compares it with expected.json and, where recorded, its resultlistEntries
+    :returns: list of the file names failing"""
+    failed = []
+    for name, page in sorted(expected().items()):
+        model = immoKrabbler.extract_result_model(read(name))
+        entries = immoKrabbler.result_entries(model)
+        ok = len(entries) == page['entries'] and \
+            immoKrabbler.paging_info(model) == (page['pageNumber'], page['numberOfPages'])
+        recorded = os.path.join(FIXTURES, name[:-len('.html')] + '.json')
+        if ok and os.path.isfile(recorded):
+            with open(recorded, encoding='utf-8') as store:
+                ok = json.load(store) == entries
+        if not ok:
+            failed.append(name)
+    return failed
+
+def replay(cache):
+    """puts every fixture into cache under its url, an offline Http_cache serves them to the scraper
+    without a network, e.g. immoKrabbler.py --offline --cache DIR --engine http --url URL
+    :cache: Http_cache
+    :returns: list of urls replayed"""
+    urls = []
+    for name, page in sorted(expected().items()):
+        cache.put(page['url'], {'content-type': 'text/html; charset=utf-8'}, read(name).encode('utf-8'))
+        urls.append(page['url'])
+    return urls
+
+class Stub_server(object):
+    """serves the fixtures by the path of their url from http.server on a free port of 127.0.0.1
+    in a thread, and the gallery pictures in them from /pic/, so a scrape runs over real http
+    without the site. records the paths requested and the max nr of requests in flight at once"""
+
+    def __init__(self, delay=0.0):
+        """
+        :delay: seconds every response is held back, to see requests overlap
+        """
+        import http.server
+        import threading
+        import urllib.parse
+        self.delay = delay
+        self.routes = dict((urllib.parse.urlsplit(fixture['url']).path, name)
+                           for name, fixture in expected().items())
+        self.failing = set()  # paths answered with HTTP 500
+        self.requests = []
+        self.in_flight = self.max_in_flight = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                import time
+                with stub._lock:
+                    stub.requests.append(self.path)
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                try:
+                    time.sleep(stub.delay)
+                    status, body = stub.response(self.path)
+                finally:
+                    with stub._lock:
+                        stub.in_flight -= 1
+                self.send_response(status)
+                self.send_header('Content-Type', 'image/jpeg' if self.path.startswith('/pic/') else
+                                 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base = 'http://127.0.0.1:{0}'.format(self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def response(self, path):
+        """:returns: tuple (http status, body) of path"""
+        path = path.split('?')[0]
+        if path in self.failing:
+            return 500, b''
+        if path.startswith('/pic/'):
+            return 200, b'JPEG' + path.encode()
+        if path not in self.routes:
+            return 404, b''
+        # the pictures of the page are served by the stub too
+        return 200, read(self.routes[path]).replace(PICTURES, self.base + '/pic/').encode('utf-8')
+
+    def url(self, name):
+        """:returns: url of the fixture name on the stub"""
+        import urllib.parse
+        return self.base + urllib.parse.urlsplit(expected()[name]['url']).path
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def main():
+    """main"""
+    import argparse
+    parser = argparse.ArgumentParser(description='immoKrabbler result page fixtures')
+    parser.add_argument('command', choices=['record', 'check', 'replay'],
+                        help='record search urls, check the parser against the fixtures or '
+                        'replay them into a cache dir')
+    parser.add_argument('urls', nargs='*', help='search urls to record')
+    parser.add_argument('--max-pages', type=int, dest='max_pages', required=False,
+                        help='record at most this many pages per url')
+    parser.add_argument('--cache', default='immoCache', dest='cache', required=False,
+                        help='cache dir to replay into, defaults to immoCache')
+    parser.add_argument('--debug', action="store_true", required=False, help='debugging')
+    results = parser.parse_args()
+    if results.command == 'record':
+        if len(results.urls) == 0:
+            parser.error('record needs search urls')
+        for name in record(results.urls, max_pages=results.max_pages, debug=results.debug):
+            print('recorded', name)
+    elif results.command == 'check':
+        failed = check()
+        print('fixtures failed:', failed) if failed else print('fixtures ok')
+        sys.exit(1 if failed else 0)
+    else:
+        for url in replay(immoKrabbler.Http_cache(results.cache, debug=results.debug)):
+            print('replayed', url)
+
+if __name__ == "__main__":
+    main()
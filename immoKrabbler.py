@@ -17,20 +17,57 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-
-from sqlalchemy import create_engine
-from sqlalchemy import MetaData
-from sqlalchemy import Table
-from sqlalchemy import Column
-from sqlalchemy import Integer, String, Boolean, Numeric, ForeignKey, select, DateTime
-from sqlalchemy_utils import JSONType  # , CurrencyType, Currency as EUR
 import re
+import bisect
 import datetime
 import json
-import demjson
+import collections
+import contextlib
+import decimal
+import operator
 import sys
 import os
 
+# bound by _import_sqlalchemy, runs without a db, e.g. --help or a scrape to csv, never import sqlalchemy
+_SQLALCHEMY_NAMES = ('create_engine', 'MetaData', 'Table', 'Column', 'Integer', 'String', 'Boolean', 'Numeric',
+                     'Float', 'ForeignKey', 'select', 'Date', 'Index', 'UniqueConstraint', 'or_', 'and_', 'JSONType')
+
+def _import_sqlalchemy():
+    """imports sqlalchemy and binds the names of _SQLALCHEMY_NAMES the db classes use"""
+    global create_engine, MetaData, Table, Column, Integer, String, Boolean, Numeric, Float, ForeignKey, select, \
+        Date, Index, UniqueConstraint, or_, and_, JSONType
+    from sqlalchemy import create_engine, MetaData, Table, Column
+    from sqlalchemy import Integer, String, Boolean, Numeric, Float, ForeignKey, select, Date
+    from sqlalchemy import Index, UniqueConstraint, or_, and_, types
+
+    class JSONType(types.TypeDecorator):
+        """json on postgres, json serialized text elsewhere, as sqlalchemy_utils.JSONType without its import
+        cost"""
+        impl = types.UnicodeText
+
+        def load_dialect_impl(self, dialect):
+            if dialect.name == 'postgresql':
+                from sqlalchemy.dialects.postgresql import JSON
+                return dialect.type_descriptor(JSON())
+            return dialect.type_descriptor(self.impl)
+
+        def process_bind_param(self, value, dialect):
+            if dialect.name == 'postgresql' or value is None:
+                return value
+            return json.dumps(value)
+
+        def process_result_value(self, value, dialect):
+            if dialect.name == 'postgresql' or value is None:
+                return value
+            return json.loads(value)
+
+def __getattr__(name):
+    """the sqlalchemy names of the module, e.g. immoKrabbler.select, imported on first access"""
+    if name in _SQLALCHEMY_NAMES:
+        _import_sqlalchemy()
+        return globals()[name]
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
 def uniqDicts(listOfDicts, debug=False):
     """returns unique list of dicts"""
     if debug:
@@ -41,6 +78,16 @@ def uniqDicts(listOfDicts, debug=False):
     else:
         return list({dic['id']: dic for dic in listOfDicts}.values())
 
+def fingerprint(entry, ignore=('search_url', 'distanceInKm', 'hasNewFlag')):
+    """content hash of a raw resultlistEntry, changes whenever the portal changes the listing
+    :entry: dict as scraped
+    :ignore: keys depending on the search or on the day of the scrape
+    :returns: hex sha1
+    """
+    import hashlib
+    content = dict((k, v) for k, v in entry.items() if k not in ignore)
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+
 def validate_url(url):
     """validates a baseurl, this is the url of the search result on the immobilienscout page
     :url: alike 'https://www.immobilienscout24.de/Suche/S-T/Wohnung-Miete/Umkreissuche/Gotha/99867/48730/2334359/
@@ -55,21 +102,183 @@ def validate_url(url):
         https://www.immobilienscout24.de/Suche/S-T/Wohnung-Miete/Umkreissuche/Gotha/99867/48730/2334359/
         -/-/5?enteredFrom=one_step_search""" % url
 
+# search urls --update-db starts from, the pages P-2, P-3.. of a search are reached by paging
+_SEED_URL = re.compile(r'.+[A-Z]-[A-Z]\/(?![A-Z][-][0-9]).+')
+_URL_CATEGORY = re.compile(r'/[A-Z]-[A-Z]/(?:[A-Z]-[0-9]+/)?([^/?#]+)')
+
+def url_category(url):
+    """classifies a search url once when it is stored in database.url
+    :url: search url, e.g. https://www.immobilienscout24.de/Suche/S-T/Wohnung-Miete/Thueringen/Gotha
+    :returns: dict with seed, whether --update-db starts from the url, and category, the real estate
+        type of the search, e.g. Wohnung-Miete, or None
+    """
+    match = _URL_CATEGORY.search(url)
+    return {'seed': _SEED_URL.match(url) is not None, 'category': match.group(1)[:50] if match else None}
+
+class Metrics(object):
+    """per stage counters and latency histograms of a run, off until enabled, written as a json run
+    summary or in the prometheus text format. with profile the timed stages also run under cProfile"""
+
+    # upper bounds in seconds of the histogram buckets
+    buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+    def __init__(self, enabled=False, profile=False):
+        import threading
+        self.enabled = enabled or profile
+        self.profile = profile
+        self.started = datetime.datetime.now(datetime.timezone.utc).timestamp()
+        self.counters = collections.Counter()
+        self.histograms = {}  # name: [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profiles = []
+
+    def count(self, name, n=1):
+        """adds n to the counter name"""
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += n
+
+    def observe(self, name, seconds):
+        """records a latency in the histogram name"""
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[i] += 1
+                    break
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    @contextlib.contextmanager
+    def _timed(self, name):
+        import time
+        profiler = None
+        if self.profile:
+            profiler = getattr(self._local, 'profiler', None)
+            if profiler is None:
+                import cProfile
+                profiler = self._local.profiler = cProfile.Profile()
+                with self._lock:
+                    self._profiles.append(profiler)
+            # nested stages keep the profiler of the outermost one running
+            self._local.depth = getattr(self._local, 'depth', 0) + 1
+            if self._local.depth == 1:
+                profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+            if profiler is not None:
+                self._local.depth -= 1
+                if self._local.depth == 0:
+                    profiler.disable()
+
+    def timer(self, name):
+        """:returns: context manager recording the time spent in it in the histogram name"""
+        if not self.enabled:
+            return _UNTIMED
+        return self._timed(name)
+
+    def summary(self):
+        """:returns: dict of the run: started, seconds, counters and per histogram count, sum,
+        mean and the cumulative bucket counts as list of [upper bound, count]"""
+        with self._lock:
+            histograms = dict((name, {
+                'count': histogram[-1], 'sum': histogram[-2], 'mean': histogram[-2] / max(histogram[-1], 1),
+                'buckets': [[str(bound), sum(histogram[:i + 1])] for i, bound in enumerate(self.buckets)] +
+                           [['+Inf', histogram[-1]]]})
+                for name, histogram in self.histograms.items())
+            return {'started': self.started,
+                    'seconds': datetime.datetime.now(datetime.timezone.utc).timestamp() - self.started,
+                    'counters': dict(self.counters), 'histograms': histograms}
+
+    def tojson(self, out):
+        """:out: text file the run summary is written to"""
+        json.dump(self.summary(), out, indent=2, sort_keys=True)
+        out.write('\n')
+
+    def toprometheus(self, out, prefix='immokrabbler_'):
+        """:out: text file the metrics are written to in the prometheus text format, e.g. for the
+        textfile collector of the node exporter"""
+        summary = self.summary()
+        for name, value in sorted(summary['counters'].items()):
+            out.write('# TYPE {0}{1} counter\n{0}{1} {2}\n'.format(prefix, name, value))
+        for name, histogram in sorted(summary['histograms'].items()):
+            out.write('# TYPE {0}{1} histogram\n'.format(prefix, name))
+            for bound, count in histogram['buckets']:
+                out.write('{0}{1}_bucket{{le="{2}"}} {3}\n'.format(prefix, name, bound, count))
+            out.write('{0}{1}_sum {2}\n{0}{1}_count {3}\n'.format(prefix, name, histogram['sum'], histogram['count']))
+        out.write('# TYPE {0}run_seconds gauge\n{0}run_seconds {1}\n'.format(prefix, summary['seconds']))
+
+    def dump_profile(self, path):
+        """writes the cProfile stats of all threads, read them with python3 -m pstats path"""
+        import pstats
+        with self._lock:
+            profiles = list(self._profiles)
+        if len(profiles) > 0:
+            pstats.Stats(*profiles).dump_stats(path)
+
+_UNTIMED = contextlib.nullcontext()
+# instrumentation of the fetch, parse, insert and photo stages, see main --metrics
+metrics = Metrics()
+
 class database(object):
     """class immobilien db"""
+    # run on every new sqlite connection: WAL lets readers, e.g. a --report, work while a scrape writes,
+    # NORMAL only syncs at checkpoints and a negative cache_size is in KiB
+    sqlite_pragmas = (('journal_mode', 'WAL'), ('synchronous', 'NORMAL'), ('cache_size', -65536),
+                      ('temp_store', 'MEMORY'))
 
-    def __init__(self, db_uri='sqlite:///immobilien.db', debug=False):
-        """constructor """
+    # schema changes applied in order by migrate, schema_version records the ones a db got,
+    # a new db is created with the schema of the last one
+    migrations = ((1, 'drop the unused url table of old dbs, its url column is an Integer', '_migrateUrlTable'),
+                  (2, 'create missing tables, columns and indexes', '_migrateTables'),
+                  (3, 'one immobilienAttributes row per listing and attribute instead of per attribute',
+                   '_migrateAttributeLinks'),
+                  (4, 'search urls of the listings moved to the url table', '_migrateSearchUrls'),
+                  (5, 'geohashes of the listings with a position', '_migrateGeohashes'),
+                  (6, 'crawl interval and next crawl of the search urls for the daemon', '_migrateTables'),
+                  (7, 'exposé details of the listings in immobilien_expose', '_migrateTables'),
+                  (8, 'watchlists and the alert outbox', '_migrateTables'),
+                  (9, 'running sums of the analytics aggregates, city, zip and district indexes',
+                   '_migrateAnalytics'),
+                  (10, 'a first history row of the listings older than immobilien_history', '_migrateHistory'))
+
+    def __init__(self, db_uri='sqlite:///immobilien.db', debug=False, batch_size=500, tuned=True, migrate=False,
+                 **pool):
+        """constructor, creates the schema in an empty db
+        :batch_size: nr of immobilien written per transaction by insertstream, also the page size
+            of the values batching on postgres
+        :tuned: apply sqlite_pragmas on sqlite and batch executemany on postgres, False leaves the
+            driver defaults, e.g. to compare against
+        :migrate: bring the schema of a db created by an older version up to date, without it
+            such a db raises a RuntimeError
+        :pool: pool_size, max_overflow, pool_timeout or pool_recycle of the sqlalchemy connection pool
+        """
+        _import_sqlalchemy()
         self.debug = debug
         self.db_uri = db_uri
-        self.engine = create_engine(db_uri, echo=self.debug)
+        self.batch_size = batch_size
+        self.engine = create_engine(db_uri, echo=self.debug, **self._engine_options(db_uri, tuned, pool))
+        # an in memory sqlite db belongs to the connection of the thread that opened it, other
+        # threads connect to an empty one of their own, see selectKnownIds
+        self.in_memory = self.engine.dialect.name == 'sqlite' and self.engine.url.database in (None, '', ':memory:')
+        if tuned and self.engine.dialect.name == 'sqlite':
+            from sqlalchemy import event
+            event.listen(self.engine, 'connect', self._set_pragmas)
         self.metadata = MetaData(self.engine)
         #  self.encoding =
         self.immobilien = Table('immobilien', self.metadata,
                                 Column('id', Integer(), primary_key=True),
-                                Column('search_url', String(2000)),
+                                # the search url the listing was found by, see inserturls
+                                Column('url_fk', Integer(), ForeignKey('url.id')),
+                                # a callable, evaluated per insert and not once per database
                                 Column('unixtimestamp', Integer(),
-                                       default=datetime.datetime.now(datetime.timezone.utc).timestamp()),
+                                       default=lambda: int(datetime.datetime.now(datetime.timezone.utc).timestamp())),
                                 Column('cwid', String()),
                                 Column('shortlisted', String()),
                                 Column('privateoffer', String()),
@@ -78,7 +287,7 @@ class database(object):
                                 Column('district', String(255)),
                                 Column('city', String(255)),
                                 Column('zip', Integer()),
-                                Column('distanceinkm', Integer()),
+                                Column('distanceinkm', Numeric()),
                                 Column('hasnewflag', String()),
                                 Column('hasfloorplan', String()),
                                 Column('hasvaluation', String()),
@@ -89,13 +298,25 @@ class database(object):
                                 Column('kaufpreis', Numeric()),
                                 Column('wohnfläche', Numeric()),
                                 Column('grundstück', Integer()),
-                                Column('zimmer', Integer()),
+                                Column('zimmer', Numeric()),
                                 Column('idtohide', Integer()),
                                 Column('listingsize', String(3)),
                                 Column('latitude', Numeric()),
                                 Column('longitude', Numeric()),
                                 Column('checkedattributes', JSONType()),
-                                Column('gallerypictures', JSONType()))
+                                Column('gallerypictures', JSONType()),
+                                Column('fingerprint', String(40)),
+                                # filled from latitude and longitude on insert, see near
+                                Column('geohash', String(12)),
+                                # smallest id of the listings found to be the same property, see Deduplicator
+                                Column('cluster_id', Integer()),
+                                Index('ix_immobilien_url_fk', 'url_fk'),
+                                Index('ix_immobilien_geohash', 'geohash'),
+                                Index('ix_immobilien_cluster_id', 'cluster_id'),
+                                # groups of Analytics
+                                Index('ix_immobilien_city', 'city'),
+                                Index('ix_immobilien_zip', 'zip'),
+                                Index('ix_immobilien_district', 'district'))
 
         self.checkedAttributes = Table('checkedAttributes', self.metadata,
                                        Column('id', Integer(), primary_key=True),
@@ -104,21 +325,287 @@ class database(object):
         self.immobilienAttributes = Table('immobilienAttributes', self.metadata,
                                           Column('id', Integer(), primary_key=True),
                                           Column('immobilie_fk', Integer(), ForeignKey('immobilien.id')),
-                                          Column('checkedAttributes_fk', Integer(), ForeignKey('immobilien.id'), unique=True))
+                                          Column('checkedAttributes_fk', Integer(), ForeignKey('checkedAttributes.id')),
+                                          UniqueConstraint('immobilie_fk', 'checkedAttributes_fk'))
+        # attribute: checkedAttributes.id, kept across batches
+        self._attributeIds = {}
 
+        # crawl frontier, the state of the last crawl of every search url
         self.url = Table('url', self.metadata,
                          Column('id', Integer(), primary_key=True),
-                         Column('url', Integer()))
+                         Column('url', String(2000), unique=True),
+                         Column('last_page', Integer()),
+                         Column('pages', Integer()),
+                         Column('unixtimestamp', Integer()),
+                         Column('status', String(10)),
+                         # computed by url_category on insert
+                         Column('seed', Boolean()),
+                         Column('category', String(50)),
+                         # seconds between two crawls of a seed url, its next one and the nr of new ids
+                         # the last one found, see Scheduler
+                         Column('crawl_interval', Integer()),
+                         Column('next_crawl', Integer()),
+                         Column('new_ids', Integer()),
+                         Index('ix_url_seed_category', 'seed', 'category'))
+        # url: url.id, kept across batches
+        self._urlIds = {}
+
+        # one row per listing and observed change of the tracked columns
+        self.immobilienHistory = Table('immobilien_history', self.metadata,
+                                       Column('id', Integer(), ForeignKey('immobilien.id'),
+                                              primary_key=True, autoincrement=False),
+                                       Column('unixtimestamp', Integer(), primary_key=True, autoincrement=False),
+                                       Column('kaltmiete', Numeric()),
+                                       Column('kaufpreis', Numeric()),
+                                       Column('wohnfläche', Numeric()),
+                                       Index('ix_immobilien_history_unixtimestamp', 'unixtimestamp'))
+        self.historyColumns = ('kaltmiete', 'kaufpreis', 'wohnfläche')
+
+        # photo manifest, the gallery pictures of a listing by their sha1 in the photo store
+        self.photos = Table('immobilien_photos', self.metadata,
+                            Column('immobilie_fk', Integer(), ForeignKey('immobilien.id'),
+                                   primary_key=True, autoincrement=False),
+                            Column('position', Integer(), primary_key=True, autoincrement=False),
+                            Column('url', String(2000)),
+                            Column('hash', String(40)),
+                            Index('ix_immobilien_photos_url', 'url'),
+                            Index('ix_immobilien_photos_hash', 'hash'))
+
+        # details of the exposé page of a listing the result list lacks, see Enricher. fingerprint is the
+        # one of the listing when it was enriched, None after a failed fetch so it is tried again
+        self.expose = Table('immobilien_expose', self.metadata,
+                            Column('id', Integer(), ForeignKey('immobilien.id'), primary_key=True, autoincrement=False),
+                            Column('fingerprint', String(40)),
+                            Column('status', Integer()),
+                            Column('unixtimestamp', Integer()),
+                            Column('baujahr', Integer()),
+                            Column('etage', Integer()),
+                            Column('etagen', Integer()),
+                            Column('hausgeld', Numeric()),
+                            Column('nebenkosten', Numeric()),
+                            Column('heizkosten', Numeric()),
+                            Column('endenergiebedarf', Numeric()),
+                            Column('energieeffizienzklasse', String(4)),
+                            Column('heizungsart', String(255)),
+                            Column('energietraeger', String(255)),
+                            Column('objektzustand', String(255)),
+                            # every criterion of the page as text, by the is24qa- class of its dd element
+                            Column('criteria', JSONType()))
+
+        self.schemaVersion = Table('schema_version', self.metadata,
+                                   Column('version', Integer(), primary_key=True, autoincrement=False),
+                                   Column('description', String(255)),
+                                   Column('unixtimestamp', Integer()))
 
-        self.metadata.create_all()
         self.conn = self.engine.connect()
+        # ids of the transaction in flight by cache, see _cacheIds
+        self._stagedIds = {}
+        from sqlalchemy import event
+        event.listen(self.conn, 'commit', self._commitIds)
+        event.listen(self.conn, 'rollback', self._rollbackIds)
+        # per connection scratch table a scrape batch is diffed against, not part of the schema,
+        # created on first use
+        self.historyBatch = Table('immobilien_batch', MetaData(),
+                                  Column('id', Integer(), primary_key=True, autoincrement=False),
+                                  *[Column(c, Numeric()) for c in self.historyColumns],
+                                  prefixes=['TEMPORARY'])
+        self._historyBatchCreated = False
+        # a rollback takes back its CREATE on postgres and sqlite
+        event.listen(self.conn, 'rollback', self._rollbackHistoryBatch)
+        # callables run with the list of new immobilien of every batch insertimmobilie or upsertimmobilie
+        # writes, inside its transaction, e.g. Alerts.queue
+        self.on_insert = []
+        version = self.selectSchemaVersion()
+        if version is None or (migrate and version < self.migrations[-1][0]):
+            self.migrate()
+        elif version < self.migrations[-1][0]:
+            raise RuntimeError('the schema of {0} is at version {1} of {2}, migrate it with '
+                               'immoKrabbler.py --database {0} --migrate'.format(db_uri, version,
+                                                                                 self.migrations[-1][0]))
+
+    def selectSchemaVersion(self):
+        """:returns: version of the schema, None for an empty db, 0 for a db older than schema_version"""
+        from sqlalchemy import func
+        if not self.engine.dialect.has_table(self.conn, 'schema_version'):
+            return 0 if self.engine.dialect.has_table(self.conn, 'immobilien') else None
+        return self.conn.execute(select([func.max(self.schemaVersion.c.version)])).scalar() or 0
+
+    def migrate(self):
+        """applies the migrations a db is missing, an empty db is created at the last one
+        :returns: list of the versions applied
+        """
+        # the tables of Analytics and Alerts are part of the schema
+        Analytics(self)
+        Alerts(self)
+        version = self.selectSchemaVersion()
+        applied = []
+        if version is None:
+            self.metadata.create_all(self.conn)
+            applied = [migration[0] for migration in self.migrations]
+        else:
+            self.schemaVersion.create(self.conn, checkfirst=True)
+        now = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+        for number, description, method in self.migrations:
+            if version is not None and number > version:
+                if self.debug:
+                    print('migrating to version {0}: {1}'.format(number, description))
+                getattr(self, method)()
+                applied.append(number)
+            if number in applied:
+                # recorded one by one, an interrupted migration resumes where it stopped
+                self.conn.execute(self.schemaVersion.insert(), {'version': number, 'description': description,
+                                                                'unixtimestamp': now})
+        return applied
+
+    def _migrateUrlTable(self):
+        from sqlalchemy import inspect
+        if not self.engine.dialect.has_table(self.conn, 'url'):
+            return
+        columns = dict((column['name'], column['type']) for column in inspect(self.conn).get_columns('url'))
+        if isinstance(columns.get('url'), Integer):
+            if self.conn.execute(select([self.url.c.id]).limit(1)).first() is not None:
+                raise RuntimeError('the old url table is not empty, empty or drop it to migrate')
+            self.url.drop(self.conn)
+
+    def _migrateTables(self):
+        from sqlalchemy import inspect
+        self.metadata.create_all(self.conn)
+        inspector = inspect(self.conn)
+        preparer = self.engine.dialect.identifier_preparer
+        for table in self.metadata.sorted_tables:
+            existing = dict((column['name'], column['type']) for column in inspector.get_columns(table.name))
+            for column in table.columns:
+                if column.name not in existing:
+                    self.conn.execute('ALTER TABLE {0} ADD COLUMN {1} {2}'.format(
+                        preparer.format_table(table), preparer.format_column(column),
+                        column.type.compile(self.engine.dialect)))
+                elif self.engine.dialect.name == 'postgresql' and isinstance(column.type, Numeric) and \
+                        isinstance(existing[column.name], Integer):
+                    # zimmer and distanceinkm used to be Integer, sqlite keeps the decimals in them anyway
+                    self.conn.execute('ALTER TABLE {0} ALTER COLUMN {1} TYPE NUMERIC'.format(
+                        preparer.format_table(table), preparer.format_column(column)))
+            indexes = set(index['name'] for index in inspector.get_indexes(table.name))
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(self.conn)
+
+    def _migrateAttributeLinks(self):
+        from sqlalchemy import inspect
+        unique = inspect(self.conn).get_unique_constraints('immobilienAttributes')
+        if not any(constraint['column_names'] == ['checkedAttributes_fk'] for constraint in unique):
+            return
+        # the old table only allowed an attribute once, it is small enough to be rebuilt
+        links = self.conn.execute(select([self.immobilienAttributes.c.immobilie_fk,
+                                          self.immobilienAttributes.c.checkedAttributes_fk]).distinct()).fetchall()
+        self.immobilienAttributes.drop(self.conn)
+        self.immobilienAttributes.create(self.conn)
+        if len(links) > 0:
+            self.conn.execute(self.immobilienAttributes.insert(),
+                              [{'immobilie_fk': iid, 'checkedAttributes_fk': aid} for iid, aid in links])
+
+    def _migrateSearchUrls(self):
+        from sqlalchemy import inspect, bindparam
+        from sqlalchemy.sql import table, column
+        if 'search_url' not in [c['name'] for c in inspect(self.conn).get_columns('immobilien')]:
+            return
+        # the old column stays, sqlite can't drop it
+        old = table('immobilien', column('search_url'), column('url_fk'))
+        urls = [url for url, in self.conn.execute(select([old.c.search_url]).distinct().where(and_(
+            old.c.search_url.isnot(None), old.c.url_fk.is_(None))))]
+        if len(urls) > 0:
+            with self.conn.begin():
+                urlIds = self.inserturls(urls)
+                self.conn.execute(old.update().where(old.c.search_url == bindparam('b_url')).values(
+                    url_fk=bindparam('b_id')), [{'b_url': url, 'b_id': urlIds[url]} for url in urls])
+
+    def _migrateGeohashes(self):
+        self.updateGeohashes()
+
+    def _migrateAnalytics(self):
+        self._migrateTables()
+        # today's aggregates are recounted once, so the listings counted before have a contribution
+        analytics = Analytics(self)
+        day, start = analytics._day(datetime.datetime.now(datetime.timezone.utc).timestamp())
+        ids = [iid for iid, in self.conn.execute(select([analytics.seen.c.id]).where(or_(
+            analytics.seen.c.lastseen >= start, analytics.seen.c.removed >= start)))]
+        with self.conn.begin():
+            self.conn.execute(analytics.stats.delete().where(analytics.stats.c.day == day))
+            for i in range(0, len(ids), self.batch_size):
+                analytics.refresh(ids[i:i + self.batch_size], start)
+
+    def _migrateHistory(self):
+        from sqlalchemy import exists, func
+        # without a row to compare with the first price change of such a listing is no drop
+        history = self.immobilienHistory.c
+        self.conn.execute(self.immobilienHistory.insert().from_select(
+            ['id', 'unixtimestamp'] + list(self.historyColumns),
+            select([self.immobilien.c.id, func.coalesce(self.immobilien.c.unixtimestamp, 0)] +
+                   [self.immobilien.c[c] for c in self.historyColumns]).where(
+                ~exists().where(history.id == self.immobilien.c.id))))
+
+    def _cacheIds(self, cache, ids):
+        """adds ids read or written inside a transaction to the cache only once it is committed,
+        a rolled back row would leave its id cached and the next batch pointing to nothing
+        :cache: name of the dict attribute, e.g. _attributeIds
+        :ids: iterable of (key, id) pairs
+        """
+        if self.conn.in_transaction():
+            self._stagedIds.setdefault(cache, {}).update(ids)
+        else:
+            getattr(self, cache).update(ids)
+
+    def _cachedIds(self, cache):
+        """:returns: mapping of the ids of cache, those of the transaction in flight included"""
+        return collections.ChainMap(self._stagedIds.setdefault(cache, {}), getattr(self, cache))
+
+    def _commitIds(self, conn):
+        for cache, ids in self._stagedIds.items():
+            getattr(self, cache).update(ids)
+        self._stagedIds = {}
+
+    def _rollbackIds(self, conn):
+        self._stagedIds = {}
+
+    def _rollbackHistoryBatch(self, conn):
+        self._historyBatchCreated = False
+
+    def _engine_options(self, db_uri, tuned, pool):
+        """:returns: dict of create_engine keyword arguments for the backend of db_uri"""
+        from sqlalchemy.engine.url import make_url
+        url = make_url(db_uri)
+        options = dict((key, value) for key, value in pool.items() if value is not None)
+        if url.get_backend_name() == 'sqlite':
+            if url.database in (None, '', ':memory:'):
+                # an in memory db lives and dies with its one connection
+                if self.debug and len(options) > 0:
+                    print('ignoring pool options for in memory sqlite', options)
+                return {}
+            if len(options) > 0:
+                # sqlite file dbs default to a NullPool, which takes no pool options
+                from sqlalchemy.pool import QueuePool
+                options.update(poolclass=QueuePool, connect_args={'check_same_thread': False})
+        elif tuned and url.get_driver_name() == 'psycopg2':
+            # one INSERT .. VALUES (..), (..) per page instead of a round trip per row, sqlalchemy 1.3.7 and later
+            options.update(executemany_mode='values', executemany_values_page_size=self.batch_size,
+                           executemany_batch_page_size=self.batch_size)
+        return options
+
+    def _set_pragmas(self, dbapi_connection, connection_record):
+        """connect event applying sqlite_pragmas"""
+        cursor = dbapi_connection.cursor()
+        for pragma, value in self.sqlite_pragmas:
+            cursor.execute('PRAGMA {0} = {1}'.format(pragma, value))
+        if self.debug:
+            print('sqlite journal mode', cursor.execute('PRAGMA journal_mode').fetchone()[0])
+        cursor.close()
 
     def insertimmobilie(self, immobilienList):
         """
-        :immobilienList: list of dicts containing immobilien to insert
+        :immobilienList: list of dicts or Immo_scraper.Immobilie records containing immobilien to insert
         :returns: list of inserted ids
         """
         assert isinstance(immobilienList, list), "immobilienList is not a list: %r" % immobilienList
+        immobilienList = self._addUrlIds(self._addGeohashes(self._asdicts(immobilienList)))
         # grab all scraped id's
         ids = set(int(immo['id']) for immo in immobilienList)
         #  print(ids, [print(imm['id']) for imm in immobilienList])
@@ -132,142 +619,2208 @@ class database(object):
                 self.immobilien.c.id.in_(ids)))
         db_immobilieIDs = [int(iid[0]) for iid in db_immobilieIDs]
         if self.debug:
-            if len(db_immobilieIDs) is not 0:
+            if len(db_immobilieIDs) != 0:
                 print('id''s already in db', db_immobilieIDs)
         insertList = [ immo for immo in immobilienList if int(immo['id']) not in db_immobilieIDs ]
         #  for immo in immobilienList:
         #  if int(immo['id']) not in db_immobilieIDs:
         #  insertList.append(immo)
+        # one transaction for all statements instead of a commit per executemany,
+        # joins the transaction of the caller, e.g. insertstream
+        with metrics.timer('insert_seconds'), self.conn.begin():
+            # keep price changes of known immobilien as history instead of dropping them
+            changedList = self.selectChangedimmobilien(
+                [immo for immo in immobilienList if int(immo['id']) in db_immobilieIDs])
+            metrics.count('rows_inserted_total', len(insertList))
+            metrics.count('rows_changed_total', len(changedList))
+            metrics.count('rows_skipped_total', len(db_immobilieIDs) - len(changedList))
+            self.inserthistory(insertList + changedList)
+            if len(changedList) > 0:
+                self._updatehistoryColumns(changedList)
 
-        if len(insertList) is not 0:
-            if self.debug:
-                print('inserting immos with id: ', [immo['id'] for immo in insertList])
-            return self.conn.execute(self.immobilien.insert(), insertList)
-        else:
+            if len(insertList) != 0:
+                if self.debug:
+                    print('inserting immos with id: ', [immo['id'] for immo in insertList])
+                inserted = self.conn.execute(self.immobilien.insert(), insertList)
+                self.insertimmobilienAttributes(insertList)
+                for hook in self.on_insert:
+                    hook(insertList)
+                return inserted
+        if self.debug:
+            print('no objects to insert ')
+        return ()
+
+    @staticmethod
+    def _asdicts(immobilienList):
+        """:returns: immobilienList with the Immo_scraper.Immobilie records turned into dicts"""
+        return [immo.asdict() if isinstance(immo, Immo_scraper.Immobilie) else immo for immo in immobilienList]
+
+    @staticmethod
+    def _addGeohashes(immobilienList):
+        """sets the geohash of the immobilien, None for those without latitude and longitude, the
+        rows of an executemany need the same keys
+        :returns: immobilienList"""
+        for immo in immobilienList:
+            if immo.get('latitude') is not None and immo.get('longitude') is not None:
+                immo['geohash'] = geohash(immo['latitude'], immo['longitude'])
+            else:
+                immo['geohash'] = None
+        return immobilienList
+
+    def _addUrlIds(self, immobilienList):
+        """sets the url_fk of the immobilien with a search_url
+        :returns: immobilienList"""
+        urlIds = self.inserturls(set(immo['search_url'] for immo in immobilienList if immo.get('search_url')))
+        for immo in immobilienList:
+            if immo.get('search_url'):
+                immo['url_fk'] = urlIds[immo['search_url']]
+        return immobilienList
+
+    def inserturls(self, urls):
+        """adds the urls missing in the url table, classified by url_category
+        :urls: iterable of search urls
+        :returns: dict url: url.id for every url of urls
+        """
+        urls = set(urls)
+        urlIds = self._cachedIds('_urlIds')
+        missing = list(urls - set(urlIds))
+        if len(missing) > 0:
+            self._cacheIds('_urlIds', self.conn.execute(
+                select([self.url.c.url, self.url.c.id]).where(self.url.c.url.in_(missing))).fetchall())
+            missing = [url for url in missing if url not in urlIds]
+        if len(missing) > 0:
+            with self.conn.begin():
+                self.conn.execute(self.url.insert(), [dict(url_category(url), url=url) for url in missing])
+            self._cacheIds('_urlIds', self.conn.execute(
+                select([self.url.c.url, self.url.c.id]).where(self.url.c.url.in_(missing))).fetchall())
             if self.debug:
-                print('no objects to insert ')
-            return ()
-
-    def selectUniqeSearchUrls(self, pattern='.+[A-Z]-[A-Z]\/(?![A-Z][-][0-9]).+'):
-        """returns unique urls matching re pattern from the db"""
-        # TODO:remove python regex in favor of:
-        # 'SELECT DISTINCT search_url FROM immobilien WHERE search_url NOT LIKE "%s-t/p%'
-        urls = self.conn.execute(
-            select([self.immobilien.c.search_url]).distinct().where(
-                self.immobilien.c.search_url.like('%S-T%')))
-        # convert db proxyobject to list of strings
-        urls = [u[0] for u in urls]
-        pattern = re.compile(pattern)
-        urls = list(filter(lambda url: pattern.match(url), urls))
+                print('urls inserted', missing)
+        return dict((url, urlIds[url]) for url in urls)
+
+    def insertstream(self, immobilien, batch_size=None, incremental=False, on_commit=None):
+        """writes a stream of immobilien batch by batch, each batch is committed on its own,
+        so a crash only loses the batch in flight
+        :immobilien: iterable of dicts or Immo_scraper.Immobilie records, e.g. Immo_scraper.iter_immobilien
+        :batch_size: nr of immobilien per transaction, defaults to the batch_size of the database
+        :incremental: update known immobilien with upsertimmobilie instead of skipping them
+        :on_commit: callable run after every committed batch, e.g. Immo_scraper.checkpoint
+        :returns: tuple (nr of inserted, nr of updated immobilien)
+        """
+        batch_size = batch_size or self.batch_size
+        inserted = updated = 0
+        batch = []
+
+        def write(batch):
+            if incremental:
+                insertedIds, updatedIds = self.upsertimmobilie(batch)
+                return len(insertedIds), len(updatedIds)
+            with self.conn.begin():
+                result = self.insertimmobilie(batch)
+            return (result.rowcount if result else 0), 0
+
+        for immo in immobilien:
+            batch.append(immo)
+            if len(batch) >= batch_size:
+                counts = write(batch)
+                inserted, updated = inserted + counts[0], updated + counts[1]
+                if self.debug:
+                    print('committed batch of {0} immobilien'.format(len(batch)))
+                batch = []
+                if on_commit is not None:
+                    on_commit()
+        if len(batch) > 0:
+            counts = write(batch)
+            inserted, updated = inserted + counts[0], updated + counts[1]
+        if on_commit is not None:
+            on_commit()
+        return inserted, updated
+
+    def selectChangedimmobilien(self, immobilienList):
+        """set based diff of a whole scrape batch against the db: the batch is loaded into a
+        temporary table and compared with one join
+        :immobilienList: list of dicts containing immobilien
+        :returns: list of the dicts whose kaltmiete, kaufpreis or wohnfläche differ from the db
+        """
+        if len(immobilienList) == 0:
+            return []
+        batch = self.historyBatch.c
+        if not self._historyBatchCreated:
+            # it may have outlived the rollback of a later transaction
+            self.historyBatch.create(self.conn, checkfirst=True)
+            self._historyBatchCreated = True
+        self.conn.execute(self.historyBatch.delete())
+        self.conn.execute(self.historyBatch.insert(),
+                          [dict([('id', int(immo['id']))] + [(c, immo.get(c)) for c in self.historyColumns])
+                           for immo in immobilienList])
+        changed = self.conn.execute(
+            select([batch.id]).select_from(
+                self.historyBatch.join(self.immobilien, self.immobilien.c.id == batch.id)).where(
+                    or_(*[self.immobilien.c[c].is_distinct_from(batch[c]) for c in self.historyColumns])))
+        changed = set(int(iid[0]) for iid in changed)
+        if self.debug:
+            print('id''s with changed', self.historyColumns, changed)
+        return [immo for immo in immobilienList if int(immo['id']) in changed]
+
+    def inserthistory(self, immobilienList, unixtimestamp=None):
+        """records the tracked columns of immobilien as observed now. the key has a resolution of
+        a second, an observation in the same second as an earlier one of a listing overwrites it
+        :immobilienList: list of dicts containing new or changed immobilien
+        :returns: nr of history rows written
+        """
+        from sqlalchemy import bindparam
+        if len(immobilienList) == 0:
+            return 0
+        if unixtimestamp is None:
+            unixtimestamp = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+        # the last observation of a listing in the batch wins
+        rows = dict((int(immo['id']), dict((c, immo.get(c)) for c in self.historyColumns))
+                    for immo in immobilienList)
+        history = self.immobilienHistory.c
+        existing = set(iid for iid, in self.conn.execute(select([history.id]).where(and_(
+            history.unixtimestamp == unixtimestamp, history.id.in_(list(rows))))))
+        if len(existing) > 0:
+            self.conn.execute(self.immobilienHistory.update().where(and_(
+                history.id == bindparam('b_id'), history.unixtimestamp == unixtimestamp)).values(
+                    dict((c, bindparam('b_' + c)) for c in self.historyColumns)),
+                [dict([('b_' + c, value) for c, value in rows[iid].items()], b_id=iid) for iid in existing])
+        if len(rows) > len(existing):
+            self.conn.execute(self.immobilienHistory.insert(),
+                              [dict(rows[iid], id=iid, unixtimestamp=unixtimestamp)
+                               for iid in rows if iid not in existing])
+        return len(rows)
+
+    def _updatehistoryColumns(self, immobilienList):
+        """overwrites the tracked columns of known immobilien with the scraped values, and their
+        fingerprint, which would leave them unenriched and changed to --incremental otherwise"""
+        from sqlalchemy import bindparam
+        columns = self.historyColumns + ('fingerprint',)
+        self.conn.execute(
+            self.immobilien.update().where(self.immobilien.c.id == bindparam('b_id')).values(
+                dict((c, bindparam('b_' + c)) for c in columns)),
+            [dict([('b_' + c, immo.get(c)) for c in columns], b_id=int(immo['id']))
+             for immo in immobilienList])
+
+    def selectPriceDrops(self, days=7):
+        """immobilien whose kaufpreis or kaltmiete dropped within the last days, uses the
+        history indexes on unixtimestamp and (id, unixtimestamp)
+        :days: size of the time window
+        :returns: list of tuples (id, unixtimestamp, old kaufpreis, kaufpreis, old kaltmiete, kaltmiete)
+        """
+        since = datetime.datetime.now(datetime.timezone.utc).timestamp() - days * 86400
+        current = self.immobilienHistory.alias('current')
+        previous = self.immobilienHistory.alias('previous')
+        before = select([self.immobilienHistory.c.unixtimestamp]).where(and_(
+            self.immobilienHistory.c.id == current.c.id,
+            self.immobilienHistory.c.unixtimestamp < current.c.unixtimestamp)).order_by(
+                self.immobilienHistory.c.unixtimestamp.desc()).limit(1).as_scalar()
+        drops = self.conn.execute(
+            select([current.c.id, current.c.unixtimestamp,
+                    previous.c.kaufpreis, current.c.kaufpreis,
+                    previous.c.kaltmiete, current.c.kaltmiete]).select_from(
+                current.join(previous, and_(previous.c.id == current.c.id,
+                                            previous.c.unixtimestamp == before))).where(and_(
+                    current.c.unixtimestamp >= since,
+                    or_(current.c.kaufpreis < previous.c.kaufpreis,
+                        current.c.kaltmiete < previous.c.kaltmiete))).order_by(
+                            current.c.unixtimestamp.desc()))
+        return [tuple(row) for row in drops]
+
+    def selectKnownIds(self, ids):
+        """
+        :ids: iterable of immobilien ids
+        :returns: set of the given ids already in the db
+        """
+        # own connection, this is called from the scraper's worker threads, which see nothing of
+        # an in memory db
+        with self.engine.connect() as conn:
+            known = conn.execute(
+                select([self.immobilien.c.id]).where(
+                    self.immobilien.c.id.in_(list(ids))))
+            return set(int(iid[0]) for iid in known)
+
+    def selectFingerprints(self, ids):
+        """
+        :ids: iterable of immobilien ids
+        :returns: dict id: fingerprint of the given ids already in the db
+        """
+        # own connection, this is called from the scraper's worker threads, which see nothing of
+        # an in memory db
+        with self.engine.connect() as conn:
+            fingerprints = conn.execute(
+                select([self.immobilien.c.id, self.immobilien.c.fingerprint]).where(
+                    self.immobilien.c.id.in_(list(ids))))
+            return dict((int(iid), fp) for iid, fp in fingerprints)
+
+    def upsertimmobilie(self, immobilienList):
+        """inserts new immobilien and updates the ones already in the db, e.g. after a price change
+        :immobilienList: list of dicts or Immo_scraper.Immobilie records containing immobilien to write
+        :returns: tuple (list of inserted ids, list of updated ids)
+        """
+        from sqlalchemy import bindparam
+        assert isinstance(immobilienList, list), "immobilienList is not a list: %r" % immobilienList
+        immobilienList = self._addUrlIds(self._addGeohashes(self._asdicts(immobilienList)))
+        known = self.selectKnownIds(int(immo['id']) for immo in immobilienList)
+        insertList = [immo for immo in immobilienList if int(immo['id']) not in known]
+        updateList = [immo for immo in immobilienList if int(immo['id']) in known]
+        metrics.count('rows_inserted_total', len(insertList))
+        metrics.count('rows_updated_total', len(updateList))
+        with metrics.timer('insert_seconds'), self.conn.begin():
+            # diff before the rows get overwritten
+            changedList = self.selectChangedimmobilien(updateList)
+            self.inserthistory(insertList + changedList)
+            if len(insertList) > 0:
+                self.conn.execute(self.immobilien.insert(), insertList)
+            if len(updateList) > 0:
+                # only overwrite the columns the scrape delivered, unixtimestamp stays the time of the
+                # insert, immobilien_history has the time of the change
+                columns = set(k for immo in updateList for k in immo) & set(self.immobilien.c.keys())
+                columns = sorted(columns - set(['id', 'unixtimestamp']))
+                values = dict((c, bindparam('b_' + c)) for c in columns)
+                self.conn.execute(
+                    self.immobilien.update().where(self.immobilien.c.id == bindparam('b_id')).values(values),
+                    [dict([('b_' + c, immo.get(c)) for c in columns], b_id=int(immo['id'])) for immo in updateList])
+            self.insertimmobilienAttributes(insertList + updateList)
+            if len(insertList) > 0:
+                for hook in self.on_insert:
+                    hook(insertList)
+        if self.debug:
+            print('inserted immos with id: ', [immo['id'] for immo in insertList])
+            print('updated immos with id: ', [immo['id'] for immo in updateList])
+        return [int(immo['id']) for immo in insertList], [int(immo['id']) for immo in updateList]
+
+    def selectCrawlState(self, url):
+        """
+        :url: search url
+        :returns: dict with last_page, pages, unixtimestamp and status of the last crawl of url or None
+        """
+        # own connection, this is called from the scraper's worker threads
+        with self.engine.connect() as conn:
+            state = conn.execute(
+                select([self.url.c.last_page, self.url.c.pages, self.url.c.unixtimestamp,
+                        self.url.c.status]).where(self.url.c.url == url)).first()
+            return dict(state) if state is not None else None
+
+    def updateCrawlStates(self, pages):
+        """checkpoints crawled pages in the url table
+        :pages: list of Result_page, the last page given of a url wins
+        :returns: nr of urls checkpointed
+        """
+        from sqlalchemy import bindparam
+        now = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+        states = dict((page.url, {'last_page': page.page, 'pages': page.pages, 'status': page.status,
+                                  'unixtimestamp': now}) for page in pages)
+        if len(states) == 0:
+            return 0
+        with self.conn.begin():
+            urlIds = self.inserturls(states)
+            self.conn.execute(
+                self.url.update().where(self.url.c.id == bindparam('b_id')).values(
+                    dict((c, bindparam('b_' + c)) for c in ('last_page', 'pages', 'status', 'unixtimestamp'))),
+                [dict([('b_' + c, v) for c, v in state.items()], b_id=urlIds[url]) for url, state in states.items()])
+        if self.debug:
+            print('checkpointed', states)
+        return len(states)
+
+    def selectPhotos(self, ids):
+        """
+        :ids: list of immobilien ids
+        :returns: dict id: list of tuples (url, sha1) in gallery order of the given ids in the manifest
+        """
+        photos = {}
+        for iid, url, digest in self.conn.execute(
+                select([self.photos.c.immobilie_fk, self.photos.c.url, self.photos.c.hash]).where(
+                    self.photos.c.immobilie_fk.in_(ids)).order_by(
+                    self.photos.c.immobilie_fk, self.photos.c.position)):
+            photos.setdefault(iid, []).append((url, digest))
+        return photos
+
+    def selectPhotoHashes(self, urls):
+        """
+        :urls: iterable of picture urls
+        :returns: dict url: sha1 of the given urls already downloaded for any listing
+        """
+        urls = list(urls)
+        hashes = {}
+        # chunked, sqlite limits the nr of bound parameters
+        for i in range(0, len(urls), 500):
+            hashes.update((url, digest) for url, digest in self.conn.execute(
+                select([self.photos.c.url, self.photos.c.hash]).where(
+                    self.photos.c.url.in_(urls[i:i + 500]))))
+        return hashes
+
+    def insertphotos(self, photos, ids):
+        """replaces the manifest of immobilien
+        :photos: list of dicts with immobilie_fk, position, url and hash
+        :ids: list of immobilien ids whose manifest is replaced by photos
+        """
+        with self.conn.begin():
+            self.conn.execute(self.photos.delete().where(self.photos.c.immobilie_fk.in_(ids)))
+            if len(photos) > 0:
+                self.conn.execute(self.photos.insert(), photos)
+        if self.debug:
+            print('recorded {0} photos of {1} immobilien'.format(len(photos), len(ids)))
+
+    def selectUnenriched(self, limit=None):
+        """listings without exposé details or changed since they got them, the ones never tried first,
+        then by the age of their last attempt
+        :limit: nr of listings at most
+        :returns: list of tuples (id, fingerprint)
+        """
+        from sqlalchemy import func
+        i, e = self.immobilien.c, self.expose.c
+        query = select([i.id, i.fingerprint]).select_from(self.immobilien.outerjoin(self.expose, e.id == i.id)).where(
+            or_(e.id.is_(None), e.fingerprint.is_(None), e.fingerprint != func.coalesce(i.fingerprint, ''))).order_by(
+            func.coalesce(e.unixtimestamp, 0), i.id.desc())
+        if limit is not None:
+            query = query.limit(limit)
+        return self.conn.execute(query).fetchall()
+
+    def insertexposes(self, exposes):
+        """replaces the exposé details of listings
+        :exposes: list of dicts with every column of immobilien_expose
+        """
+        if len(exposes) == 0:
+            return
+        with self.conn.begin():
+            self.conn.execute(self.expose.delete().where(self.expose.c.id.in_([expose['id'] for expose in exposes])))
+            self.conn.execute(self.expose.insert(), exposes)
+        if self.debug:
+            print('recorded {0} exposés'.format(len(exposes)))
+
+    def selectListings(self, columns=None):
+        """
+        :columns: names of immobilien columns to select, search_url instead of url_fk,
+            defaults to all columns in table order
+        :returns: select of immobilien with their search_url joined from the url table
+        """
+        if columns is None:
+            columns = ['search_url' if column.name == 'url_fk' else column.name for column in self.immobilien.columns]
+        return select([self.url.c.url.label('search_url') if column == 'search_url' else self.immobilien.c[column]
+                       for column in columns]).select_from(
+                           self.immobilien.outerjoin(self.url, self.immobilien.c.url_fk == self.url.c.id))
+
+    def selectimmobilien(self, ids=None):
+        """loads immobilien as compact records, e.g. to analyse a large db in memory
+        :ids: iterable of ids to load, defaults to all
+        :returns: generator of Immo_scraper.Immobilie
+        """
+        query = self.selectListings(IMMOBILIE_FIELDS)
+        if ids is not None:
+            query = query.where(self.immobilien.c.id.in_(list(ids)))
+        for row in self.conn.execute(query):
+            yield Immo_scraper.Immobilie(*row)
+
+    def near(self, latitude, longitude, km):
+        """immobilien within a radius, prefiltered on the geohash index by the cells covering
+        the radius and then checked with the exact haversine distance
+        :latitude: of the center in degrees
+        :longitude: of the center in degrees
+        :km: radius
+        :returns: list of tuples (distance in km, Immo_scraper.Immobilie) sorted by distance
+        """
+        cells = geohash_cover(latitude, longitude, km)
+        query = self.selectListings(IMMOBILIE_FIELDS).where(or_(*[
+            and_(self.immobilien.c.geohash >= cell, self.immobilien.c.geohash < cell + '{') for cell in cells]))
+        found = []
+        for row in self.conn.execute(query):
+            immo = Immo_scraper.Immobilie(*row)
+            distance = haversine(latitude, longitude, immo.latitude, immo.longitude)
+            if distance <= km:
+                found.append((distance, immo))
+        if self.debug:
+            print('{0} immobilien within {1} km in cells {2}'.format(len(found), km, cells))
+        return sorted(found, key=lambda hit: hit[0])
+
+    def updateGeohashes(self, batch_size=10000):
+        """fills the geohash of rows written before there was one
+        :returns: nr of rows updated"""
+        from sqlalchemy import bindparam
+        updated = 0
+        while True:
+            rows = self.conn.execute(
+                select([self.immobilien.c.id, self.immobilien.c.latitude, self.immobilien.c.longitude]).where(and_(
+                    self.immobilien.c.geohash.is_(None), self.immobilien.c.latitude.isnot(None),
+                    self.immobilien.c.longitude.isnot(None))).limit(batch_size)).fetchall()
+            if len(rows) == 0:
+                return updated
+            with self.conn.begin():
+                self.conn.execute(
+                    self.immobilien.update().where(self.immobilien.c.id == bindparam('b_id')).values(
+                        geohash=bindparam('b_geohash')),
+                    [{'b_id': iid, 'b_geohash': geohash(lat, lon)} for iid, lat, lon in rows])
+            updated += len(rows)
+
+    def selectUniqeSearchUrls(self, category=None):
+        """seed urls of --update-db, a lookup on the seed and category index of the url table
+        :category: real estate type of the searches, e.g. Wohnung-Miete, defaults to all
+        :returns: list of urls
+        """
+        query = select([self.url.c.url]).where(self.url.c.seed.is_(True))
+        if category is not None:
+            query = query.where(self.url.c.category == category)
+        urls = [url for url, in self.conn.execute(query)]
         if self.debug is True:
-            print('uniqe urls:{0}, matching pattern:{1}'.format(len(urls), pattern))
+            print('uniqe urls:{0}, category:{1}'.format(len(urls), category))
         return urls
 
+    def selectSchedule(self):
+        """:returns: list of tuples (url, crawl_interval, next_crawl) of the seed urls, see Scheduler"""
+        return self.conn.execute(select([self.url.c.url, self.url.c.crawl_interval, self.url.c.next_crawl]).where(
+            self.url.c.seed.is_(True))).fetchall()
+
+    def updateSchedule(self, url, crawl_interval, next_crawl, new_ids=None, due=None):
+        """records when url is crawled next
+        :crawl_interval: seconds between two crawls of url
+        :next_crawl: unixtimestamp of the next crawl
+        :new_ids: nr of new ids the last crawl found
+        :due: next_crawl the crawl just done was scheduled for, if a trigger changed it meanwhile
+            the trigger wins over next_crawl
+        :returns: True if next_crawl was recorded
+        """
+        urlId = self.inserturls([url])[url]
+        with self.conn.begin():
+            self.conn.execute(self.url.update().where(self.url.c.id == urlId).values(
+                crawl_interval=crawl_interval, new_ids=new_ids))
+            query = self.url.update().where(self.url.c.id == urlId)
+            if due is not None:
+                query = query.where(self.url.c.next_crawl == due)
+            return self.conn.execute(query.values(next_crawl=next_crawl)).rowcount == 1
+
+    def triggerCrawls(self, urls):
+        """makes urls due now, a running Scheduler crawls them at its next poll
+        :urls: list of seed urls
+        :returns: nr of urls triggered
+        """
+        from sqlalchemy import bindparam
+        now = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+        with self.conn.begin():
+            urlIds = self.inserturls(urls)
+            if len(urlIds) > 0:
+                self.conn.execute(self.url.update().where(self.url.c.id == bindparam('b_id')).values(
+                    next_crawl=now), [{'b_id': urlId} for urlId in urlIds.values()])
+        return len(urlIds)
+
     def insertcheckedAttributes(self, immobilien):
+        """bulk loads the distinct checkedattributes of immobilien: one IN lookup for the attributes
+        not cached yet and one multi-row insert for the ones missing in the db
+        :immobilien: list of dicts with a list of attribute names in 'checkedattributes'
+        :returns: dict attribute: id for every attribute of immobilien
         """
-        list of dicts immobilien
-        :returns: list of inserted ids
+        attributes = set(attr for d in immobilien for attr in (d.get('checkedattributes') or []))
+        attributeIds = self._cachedIds('_attributeIds')
+        missing = attributes - set(attributeIds)
+        if len(missing) > 0:
+            self._cacheIds('_attributeIds', self.conn.execute(
+                select([self.checkedAttributes.c.attribute, self.checkedAttributes.c.id]).where(
+                    self.checkedAttributes.c.attribute.in_(missing))).fetchall())
+            missing -= set(attributeIds)
+        if len(missing) > 0:
+            self.conn.execute(self.checkedAttributes.insert().values(
+                [{'attribute': attr} for attr in sorted(missing)]))
+            self._cacheIds('_attributeIds', self.conn.execute(
+                select([self.checkedAttributes.c.attribute, self.checkedAttributes.c.id]).where(
+                    self.checkedAttributes.c.attribute.in_(missing))).fetchall())
+            if self.debug:
+                print('INFO:inserted checkedAttributes into db:', sorted(missing))
+        return dict((attr, attributeIds[attr]) for attr in attributes)
+
+    def insertimmobilienAttributes(self, immobilien):
+        """links immobilien with their checkedattributes, set based: one IN lookup of the existing
+        links, one executemany for the new and one for the stale ones
+        :immobilien: list of dicts with a list of attribute names in 'checkedattributes'
+        :returns: tuple (nr of links inserted, nr of links deleted)
         """
-        insertedAttributes = []
-        # TODO: make this more functional
-        attributes = set([attr for d in immobilien for attr in d['checkedattributes']])
-        id_attributes = select([self.checkedAttributes.c.id, self.checkedAttributes.c.attribute]).where(
-            self.checkedAttributes.c.attribute.in_(attributes))
-        for immobilie in immobilien:
-            attribute = immobilie['checkedattributes']
-            #  print(attribute)
-            for attr in attribute:
-                AttributeinDB = self.conn.execute(
-                    select([self.checkedAttributes.c.id]).where(
-                        self.checkedAttributes.c.attribute == attr)).scalar()
-                if AttributeinDB is None:
-                    attr = self.conn.execute(
-                        self.checkedAttributes.insert(), {'attribute': attr})  # .inserted_primary_key[0]
-                    if self.debug:
-                        print(
-                            'INFO:inserted checkedAttribute into db, assigned id:', AttributeinDB)
+        if len(immobilien) == 0:
+            return 0, 0
+        attributeIds = self.insertcheckedAttributes(immobilien)
+        links = set((int(immo['id']), attributeIds[attr])
+                    for immo in immobilien for attr in (immo.get('checkedattributes') or []))
+        existing = set(tuple(link) for link in self.conn.execute(
+            select([self.immobilienAttributes.c.immobilie_fk,
+                    self.immobilienAttributes.c.checkedAttributes_fk]).where(
+                        self.immobilienAttributes.c.immobilie_fk.in_(
+                            set(int(immo['id']) for immo in immobilien)))))
+        insertLinks, deleteLinks = links - existing, existing - links
+        if len(insertLinks) > 0:
+            self.conn.execute(self.immobilienAttributes.insert(),
+                              [{'immobilie_fk': iid, 'checkedAttributes_fk': aid} for iid, aid in insertLinks])
+        if len(deleteLinks) > 0:
+            from sqlalchemy import bindparam
+            self.conn.execute(self.immobilienAttributes.delete().where(and_(
+                self.immobilienAttributes.c.immobilie_fk == bindparam('b_immobilie'),
+                self.immobilienAttributes.c.checkedAttributes_fk == bindparam('b_attribute'))),
+                [{'b_immobilie': iid, 'b_attribute': aid} for iid, aid in deleteLinks])
+        if self.debug:
+            print('immobilienAttributes inserted: {0}, deleted: {1}'.format(len(insertLinks), len(deleteLinks)))
+        return len(insertLinks), len(deleteLinks)
+
+class Exporter(object):
+    """streams a table of the db chunk by chunk to csv, json lines, parquet or arrow ipc,
+    memory stays flat whatever the size of the table"""
+
+    def __init__(self, db, table='immobilien', chunksize=10000):
+        """
+        :db: database to export from
+        :table: name of the table, e.g. immobilien or immobilien_history
+        :chunksize: nr of rows fetched and written at a time
+        """
+        self.db = db
+        self.table = db.metadata.tables[table]
+        self.chunksize = chunksize
+        # listings are exported with their search url instead of the url_fk
+        self.query = db.selectListings() if self.table is db.immobilien else select([self.table])
+        self.columns = [column.name for column in self.query.columns]
+
+    def chunks(self):
+        """:yields: lists of rows in primary key order, fetched over a server side cursor
+        where the dialect has one"""
+        result = self.db.conn.execution_options(stream_results=True).execute(
+            self.query.order_by(*self.table.primary_key.columns))
+        try:
+            for chunk in iter(lambda: result.fetchmany(self.chunksize), []):
+                yield chunk
+        finally:
+            result.close()
+
+    def _converters(self, text=False):
+        """:text: convert for csv instead of json and arrow
+        :returns: list of callables turning a non None value into a plain python value, per column"""
+        def number(value):
+            if text:
+                return format(decimal.Decimal(value).normalize(), 'f')
+            return float(value)
+
+        def document(value):
+            return json.dumps(value, ensure_ascii=False)
+
+        converters = []
+        for column in self.query.columns:
+            if isinstance(column.type, JSONType):
+                converters.append(document if text else None)
+            elif isinstance(column.type, Integer):
+                converters.append(int)
+            elif isinstance(column.type, Numeric):
+                converters.append(number)
+            else:
+                converters.append(str)
+        return converters
+
+    def _rows(self, text=False):
+        """:yields: lists of converted rows"""
+        converters = self._converters(text)
+        for chunk in self.chunks():
+            yield [[value if value is None or convert is None else convert(value)
+                    for convert, value in zip(converters, row)] for row in chunk]
+
+    def tocsv(self, out):
+        """:out: text file opened with newline=''
+        :returns: nr of rows written"""
+        import csv
+        writer = csv.writer(out, delimiter=';', quotechar='"', quoting=csv.QUOTE_ALL, lineterminator='\n')
+        writer.writerow(self.columns)
+        written = 0
+        for rows in self._rows(text=True):
+            writer.writerows(rows)
+            written += len(rows)
+        return written
+
+    def tojsonl(self, out):
+        """writes one json object per row and line
+        :out: text file
+        :returns: nr of rows written"""
+        written = 0
+        for rows in self._rows():
+            out.writelines(json.dumps(dict(zip(self.columns, row)), ensure_ascii=False) + '\n' for row in rows)
+            written += len(rows)
+        return written
+
+    def schema(self):
+        """:returns: pyarrow.Schema of the table, json columns are kept as json text"""
+        import pyarrow
+        fields = []
+        for column in self.query.columns:
+            if isinstance(column.type, JSONType):
+                fields.append(pyarrow.field(column.name, pyarrow.string()))
+            elif isinstance(column.type, Integer):
+                fields.append(pyarrow.field(column.name, pyarrow.int64()))
+            elif isinstance(column.type, Numeric):
+                fields.append(pyarrow.field(column.name, pyarrow.float64()))
+            else:
+                fields.append(pyarrow.field(column.name, pyarrow.string()))
+        return pyarrow.schema(fields)
+
+    def _batches(self, schema):
+        """:yields: pyarrow.RecordBatch per chunk"""
+        import pyarrow
+        jsoncolumns = set(i for i, column in enumerate(self.query.columns) if isinstance(column.type, JSONType))
+        for rows in self._rows():
+            columns = [list(values) for values in zip(*rows)]
+            for i in jsoncolumns:
+                columns[i] = [value if value is None else json.dumps(value, ensure_ascii=False) for value in columns[i]]
+            yield pyarrow.RecordBatch.from_arrays(
+                [pyarrow.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema)
+
+    def toparquet(self, path):
+        """writes a parquet file with a row group per chunk
+        :path: file name
+        :returns: nr of rows written"""
+        import pyarrow
+        import pyarrow.parquet
+        schema = self.schema()
+        written = 0
+        with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+            for batch in self._batches(schema):
+                writer.write_table(pyarrow.Table.from_batches([batch]))
+                written += batch.num_rows
+        return written
+
+    def toarrow(self, path):
+        """writes an arrow ipc file, pandas reads it with pyarrow.ipc.open_file(path).read_pandas()
+        :path: file name
+        :returns: nr of rows written"""
+        import pyarrow
+        schema = self.schema()
+        written = 0
+        with pyarrow.ipc.new_file(path, schema) as writer:
+            for batch in self._batches(schema):
+                writer.write_batch(batch)
+                written += batch.num_rows
+        return written
+
+class Analytics(object):
+    """aggregate tables on top of database, €/m² and counts of new and removed listings per
+    day and city, zip or district. each listing remembers what it added to the aggregates of
+    the day it was last counted in, a batch only applies the difference for the listings it
+    touched, so keeping them up to date and reports are index lookups instead of scans over
+    immobilien. medians can't be kept that way, medians fills them in once per group"""
+    levels = ('city', 'zip', 'district')
+
+    def __init__(self, db):
+        """
+        :db: database to aggregate
+        """
+        self.db = db
+        self.debug = db.debug
+        # when a listing was seen first and last, removed while a complete crawl of its
+        # search url misses it, counted is [start of the day, contribution] of its last count
+        self.seen = Table('immobilien_seen', db.metadata,
+                          Column('id', Integer(), ForeignKey('immobilien.id'), primary_key=True, autoincrement=False),
+                          Column('firstseen', Integer()),
+                          Column('lastseen', Integer()),
+                          Column('removed', Integer()),
+                          Column('counted', JSONType()),
+                          Index('ix_immobilien_seen_lastseen', 'lastseen'),
+                          Index('ix_immobilien_seen_removed', 'removed'),
+                          extend_existing=True)
+        # one row per day, level (city, zip, district), key and kind (rent, purchase), the running
+        # sum of €/m² and nr of listings with an area make the mean, a NULL median is out of date
+        self.stats = Table('immobilien_stats', db.metadata,
+                           Column('level', String(10), primary_key=True),
+                           Column('key', String(255), primary_key=True),
+                           Column('kind', String(10), primary_key=True),
+                           Column('day', Date(), primary_key=True),
+                           Column('listings', Integer()),
+                           Column('new', Integer()),
+                           Column('removed', Integer()),
+                           Column('mean_sqm', Numeric()),
+                           Column('median_sqm', Numeric()),
+                           Column('sqm_sum', Float()),
+                           Column('sqm_listings', Integer()),
+                           Index('ix_immobilien_stats_level_day', 'level', 'day'),
+                           extend_existing=True)
+
+    @staticmethod
+    def _day(unixtimestamp):
+        """:returns: tuple (utc date, unixtimestamp of its start)"""
+        day = datetime.datetime.fromtimestamp(unixtimestamp, datetime.timezone.utc).date()
+        return day, int(datetime.datetime(day.year, day.month, day.day, tzinfo=datetime.timezone.utc).timestamp())
+
+    def touch(self, ids, now=None):
+        """marks listings as seen and updates today's aggregates of their groups
+        :ids: iterable of immobilien ids in the db
+        :now: unixtimestamp, defaults to now
+        """
+        from sqlalchemy import bindparam
+        now = int(now or datetime.datetime.now(datetime.timezone.utc).timestamp())
+        ids = set(ids)
+        if len(ids) == 0:
+            return
+        known = set(iid for iid, in self.db.conn.execute(
+            select([self.seen.c.id]).where(self.seen.c.id.in_(ids))))
+        with self.db.conn.begin():
+            if len(ids) > len(known):
+                self.db.conn.execute(self.seen.insert(), [
+                    {'id': iid, 'firstseen': now, 'lastseen': now, 'removed': None} for iid in ids - known])
+            if len(known) > 0:
+                self.db.conn.execute(self.seen.update().where(self.seen.c.id == bindparam('b_id')).values(
+                    lastseen=now, removed=None), [{'b_id': iid} for iid in known])
+            self.refresh(ids, now)
+
+    def sweep(self, search_url, since, now=None):
+        """marks the listings of a completely crawled search url not seen by that crawl as removed
+        :search_url: url crawled through all its pages
+        :since: unixtimestamp the crawl started
+        :now: unixtimestamp, defaults to now
+        :returns: nr of listings removed
+        """
+        now = int(now or datetime.datetime.now(datetime.timezone.utc).timestamp())
+        gone = [iid for iid, in self.db.conn.execute(
+            select([self.seen.c.id]).select_from(
+                self.seen.join(self.db.immobilien, self.db.immobilien.c.id == self.seen.c.id).join(
+                    self.db.url, self.db.url.c.id == self.db.immobilien.c.url_fk)).where(and_(
+                    self.db.url.c.url == search_url,
+                    self.seen.c.lastseen < int(since),
+                    self.seen.c.removed.is_(None))))]
+        if len(gone) > 0:
+            with self.db.conn.begin():
+                self.db.conn.execute(self.seen.update().where(self.seen.c.id.in_(gone)).values(removed=now))
+                self.refresh(gone, now)
+        if self.debug:
+            print('{0} listings of {1} removed'.format(len(gone), search_url))
+        return len(gone)
+
+    def _contribution(self, listing, start):
+        """:returns: list of [level, key, kind, new, removed, €/m²] a listing adds to the aggregates
+        of the day starting at start, €/m² None without an area"""
+        contribution = []
+        for level in self.levels:
+            if listing[level] is None:
+                continue
+            for kind, value in (('rent', listing['kaltmiete']), ('purchase', listing['kaufpreis'])):
+                if value is None:
+                    continue
+                if listing['removed'] is not None:
+                    contribution.append([level, str(listing[level]), kind, 0, 1, None])
                 else:
-                    attr = AttributeinDB
-                    if self.debug:
-                        print('INFO:checkedAttribute already in db :', AttributeinDB, attr)
-                insertedAttributes.append(AttributeinDB)
-        return insertedAttributes
-
-    def insertimmobilienAttributes(self, listOfcheckedAttributes_key, immobilien):
-        """insertimmobilienAttributes.
-        :immobilie_key: from immobilie table
-        :listOfcheckedAttributes_key: list of checkedAttributes_key
-        :returns: inserted or selected ids
-        TODO: fix this method
-        """
-        "is not a dictionary: %r" % immobilienList
-        immobilienAttributes = []
-        for immobilie in immobilien:
-            for listOfcheckedAttributes_key in immobilie['checkedattributes']:
-                #  print(checkedAttributes_key)
-                keyCombination = self.conn.execute(
-                    select([self.immobilienAttributes.c.id]).where(
-                        self.immobilienAttributes.c.immobilie_fk == immobilie_key).where(
-                            self.checkedAttributes.c.checkedAttributes_fk == checkedAttributes_key).scalar())
-                if keyCombination is None:
-                    keyCombination = self.conn.execute(
-                        self.immobilienAttributes.insert(),
-                        {'checkedAttributes_fk': checkedAttributes_key,
-                         'immobilie_fk': immobilie_key}).inserted_primary_key[0]
-                    if self.debug:
-                        print('inserted immobilienAttributes into db assigned id:', keyCombination)
+                    contribution.append([level, str(listing[level]), kind, int(listing['firstseen'] >= start), 0,
+                                         float(value) / float(listing['wohnfläche'])
+                                         if listing['wohnfläche'] else None])
+        return contribution
+
+    def refresh(self, ids, now):
+        """updates the aggregates of the day of now by what the listings ids add to them now
+        less what they added at their last count that day, the aggregates of past days stay
+        as they were
+        :ids: iterable of immobilien ids
+        :now: unixtimestamp
+        """
+        from sqlalchemy import bindparam
+        day, start = self._day(now)
+        immobilien = self.db.immobilien
+        listings = self.db.conn.execute(
+            select([immobilien.c.id, immobilien.c.kaltmiete, immobilien.c.kaufpreis, immobilien.c['wohnfläche'],
+                    self.seen.c.firstseen, self.seen.c.removed, self.seen.c.counted] +
+                   [immobilien.c[level] for level in self.levels]).select_from(
+                immobilien.join(self.seen, self.seen.c.id == immobilien.c.id)).where(
+                immobilien.c.id.in_(list(ids)))).fetchall()
+        deltas = {}  # (level, key, kind): [listings, new, removed, €/m² sum, listings with an area]
+        counted = []
+        for listing in listings:
+            contribution = self._contribution(listing, start)
+            before = listing['counted'][1] if listing['counted'] and listing['counted'][0] == start else []
+            if contribution == before:
+                continue
+            counted.append({'b_id': listing['id'], 'b_counted': [start, contribution]})
+            for sign, parts in ((-1, before), (1, contribution)):
+                for level, key, kind, new, removed, sqm in parts:
+                    delta = deltas.setdefault((level, key, kind), [0, 0, 0, 0.0, 0])
+                    delta[0] += sign * (1 - removed)
+                    delta[1] += sign * new
+                    delta[2] += sign * removed
+                    if sqm is not None:
+                        delta[3] += sign * sqm
+                        delta[4] += sign
+        if len(counted) > 0:
+            self.db.conn.execute(self.seen.update().where(self.seen.c.id == bindparam('b_id')).values(
+                counted=bindparam('b_counted')), counted)
+        stats = self.stats.c
+        for level in self.levels:
+            keys = set(key for (lvl, key, kind) in deltas if lvl == level)
+            if len(keys) == 0:
+                continue
+            existing = dict(((row.key, row.kind), row) for row in self.db.conn.execute(
+                select([stats.key, stats.kind, stats.listings, stats.new, stats.removed, stats.sqm_sum,
+                        stats.sqm_listings]).where(and_(stats.level == level, stats.day == day, stats.key.in_(keys)))))
+            inserts, updates, deletes = [], [], []
+            for (lvl, key, kind), delta in deltas.items():
+                if lvl != level:
+                    continue
+                row = existing.get((key, kind))
+                values = [delta[i] + ((row[i + 2] or 0) if row is not None else 0) for i in range(5)]
+                aggregate = {'b_key': key, 'b_kind': kind, 'listings': values[0], 'new': values[1],
+                             'removed': values[2], 'sqm_sum': values[3], 'sqm_listings': values[4],
+                             'mean_sqm': values[3] / values[4] if values[4] > 0 else None, 'median_sqm': None}
+                if row is None:
+                    inserts.append(aggregate)
+                elif values[0] == 0 and values[2] == 0:
+                    deletes.append(key)
                 else:
-                    if self.debug:
-                        print('immobilienAttributes already in db ', keyCombination)
-                immobilienAttributes.append(keyCombination)
-        return immobilienAttributes
+                    updates.append(aggregate)
+            if len(inserts) > 0:
+                self.db.conn.execute(self.stats.insert(), [
+                    dict(level=level, key=aggregate.pop('b_key'), kind=aggregate.pop('b_kind'), day=day, **aggregate)
+                    for aggregate in inserts])
+            if len(updates) > 0:
+                self.db.conn.execute(self.stats.update().where(and_(
+                    stats.level == level, stats.day == day, stats.key == bindparam('b_key'),
+                    stats.kind == bindparam('b_kind'))), updates)
+            if len(deletes) > 0:
+                self.db.conn.execute(self.stats.delete().where(and_(
+                    stats.level == level, stats.day == day, stats.key.in_(deletes),
+                    stats.listings == 0, stats.removed == 0)))
+        if self.debug:
+            print('updated aggregates of {0} for {1} groups by {2} listings'.format(day, len(deltas), len(listings)))
+
+    def medians(self, now=None):
+        """computes the out of date medians of the day of now, once per group and not per batch
+        :now: unixtimestamp, defaults to now
+        :returns: nr of medians computed
+        """
+        import statistics
+        from sqlalchemy import bindparam
+        now = int(now or datetime.datetime.now(datetime.timezone.utc).timestamp())
+        day, start = self._day(now)
+        immobilien = self.db.immobilien
+        computed = 0
+        for level in self.levels:
+            stale = set((key, kind) for key, kind in self.db.conn.execute(
+                select([self.stats.c.key, self.stats.c.kind]).where(and_(
+                    self.stats.c.level == level, self.stats.c.day == day, self.stats.c.median_sqm.is_(None),
+                    self.stats.c.sqm_listings > 0))))
+            if len(stale) == 0:
+                continue
+            column = immobilien.c[level]
+            sqm = {}  # (key, kind): [€/m²]
+            for key, rent, price, area in self.db.conn.execute(
+                    select([column, immobilien.c.kaltmiete, immobilien.c.kaufpreis,
+                            immobilien.c['wohnfläche']]).select_from(
+                        immobilien.join(self.seen, self.seen.c.id == immobilien.c.id)).where(and_(
+                            column.in_(set(column.type.python_type(key) for key, kind in stale)),
+                            self.seen.c.lastseen >= start, self.seen.c.removed.is_(None)))):
+                for kind, value in (('rent', rent), ('purchase', price)):
+                    if value is not None and area and (str(key), kind) in stale:
+                        sqm.setdefault((str(key), kind), []).append(float(value) / float(area))
+            if len(sqm) > 0:
+                self.db.conn.execute(self.stats.update().where(and_(
+                    self.stats.c.level == level, self.stats.c.day == day, self.stats.c.key == bindparam('b_key'),
+                    self.stats.c.kind == bindparam('b_kind'))).values(median_sqm=bindparam('b_median')), [
+                    {'b_key': key, 'b_kind': kind, 'b_median': statistics.median(values)}
+                    for (key, kind), values in sqm.items()])
+                computed += len(sqm)
+        if self.debug:
+            print('computed {0} medians of {1}'.format(computed, day))
+        return computed
+
+    def report(self, level='city', key=None, days=30):
+        """
+        :level: city, zip or district
+        :key: name of the city, zip or district, defaults to all
+        :days: size of the time window
+        :returns: list of tuples (day, key, kind, listings, new, removed, mean €/m², median €/m²)
+        """
+        assert level in self.levels, 'unknown level %r' % level
+        self.medians()
+        since = self._day(datetime.datetime.now(datetime.timezone.utc).timestamp() - days * 86400)[0]
+        query = select([self.stats.c.day, self.stats.c.key, self.stats.c.kind, self.stats.c.listings,
+                        self.stats.c.new, self.stats.c.removed, self.stats.c.mean_sqm,
+                        self.stats.c.median_sqm]).where(and_(self.stats.c.level == level, self.stats.c.day >= since))
+        if key is not None:
+            query = query.where(self.stats.c.key == str(key))
+        return [tuple(row) for row in self.db.conn.execute(
+            query.order_by(self.stats.c.key, self.stats.c.kind, self.stats.c.day))]
+
+class Deduplicator(object):
+    """finds listings of the same property, re-posts under a new id or offers of several
+    realtors, and stores the smallest id of each group as cluster_id.
+    pairs are only compared within blocks of the same kind, zip (or geohash cell without zip),
+    nr of rooms and living space bucket and, sorted by price, within a window, so the work
+    grows linearly with the table"""
+    # compared in a block: a price at most this far off and the next this many listings
+    price_tolerance = 0.1
+    window = 16
+    threshold = 0.7
+
+    def __init__(self, db):
+        """
+        :db: database to deduplicate
+        """
+        self.db = db
+        self.debug = db.debug
+        self.compared = 0
+
+    @staticmethod
+    def _tokens(text):
+        """:returns: frozenset of the normalized words of an address or title"""
+        if not text:
+            return frozenset()
+        text = text.lower().replace('straße', 'str').replace('strasse', 'str')
+        return frozenset(word.strip('.,;:-/()') for word in text.split()) - frozenset([''])
+
+    @staticmethod
+    def _similarity(tokens, tokens2):
+        """:returns: jaccard similarity of two token sets, 0.5 if one is unknown"""
+        if not tokens or not tokens2:
+            return 0.5
+        return len(tokens & tokens2) / len(tokens | tokens2)
+
+    def score(self, immo, immo2):
+        """:immo: tuple (id, block, price, area, address tokens, title tokens, geohash)
+        :returns: similarity of two listings of one block, 0 if the prices are too far apart"""
+        price, price2 = immo[2], immo2[2]
+        difference = abs(price - price2) / max(price, price2, 1)
+        if difference > self.price_tolerance:
+            return 0.0
+        similarity = (0.6 * self._similarity(immo[4], immo2[4]) + 0.25 * self._similarity(immo[5], immo2[5]) +
+                      0.15 * (1 - difference / self.price_tolerance))
+        if immo[6] and immo2[6] and immo[6][:7] == immo2[6][:7]:
+            # within about 150 m
+            similarity += 0.2
+        return min(similarity, 1.0)
+
+    def _rows(self, zips=None):
+        """:yields: tuples (id, block, bucket, price, area, address tokens, title tokens, geohash)"""
+        c = self.db.immobilien.c
+        query = select([c.id, c.zip, c.geohash, c.zimmer, c['wohnfläche'], c.kaltmiete, c.kaufpreis, c.address, c.title])
+        if zips is not None:
+            query = query.where(c.zip.in_(zips))
+        for iid, zipcode, cell, rooms, area, rent, price, address, title in self.db.conn.execute(
+                query.execution_options(stream_results=True)):
+            if area is None or (rent is None and price is None) or (zipcode is None and cell is None):
+                continue
+            area = float(area)
+            block = ('rent' if rent is not None else 'purchase', zipcode if zipcode is not None else cell[:5],
+                     None if rooms is None else float(rooms))
+            yield (iid, block, int(area // 2), float(rent if rent is not None else price), area,
+                   self._tokens(address), self._tokens(title), cell)
+
+    def run(self, ids=None):
+        """clusters the listings and updates cluster_id where it changed
+        :ids: only recompute the zips these immobilien are in, defaults to the whole table
+        :returns: tuple (nr of listings in clusters of 2 or more, nr of such clusters)
+        """
+        from sqlalchemy import bindparam
+        zips = None
+        if ids is not None:
+            zips = [z for z, in self.db.conn.execute(
+                select([self.db.immobilien.c.zip]).distinct().where(self.db.immobilien.c.id.in_(list(ids))))
+                if z is not None]
+        blocks = {}  # (block, area bucket): [rows]
+        parent = {}
+        for row in self._rows(zips):
+            blocks.setdefault((row[1], row[2]), []).append((row[0], row[1]) + row[3:])
+            parent[row[0]] = row[0]
+
+        def find(iid):
+            while parent[iid] != iid:
+                parent[iid] = parent[parent[iid]]
+                iid = parent[iid]
+            return iid
+
+        self.compared = 0
+        for (block, bucket), members in blocks.items():
+            # the neighbouring bucket catches areas on both sides of a bucket border
+            candidates = sorted(members + blocks.get((block, bucket + 1), []), key=lambda immo: immo[2])
+            for i, immo in enumerate(candidates):
+                for immo2 in candidates[i + 1:i + 1 + self.window]:
+                    if immo2[2] - immo[2] > self.price_tolerance * max(immo2[2], 1):
+                        break
+                    self.compared += 1
+                    if self.score(immo, immo2) >= self.threshold:
+                        root, root2 = find(immo[0]), find(immo2[0])
+                        if root != root2:
+                            parent[max(root, root2)] = min(root, root2)
+        clusters = dict((iid, find(iid)) for iid in parent)
+        # listings outside any block are their own cluster
+        c = self.db.immobilien.c
+        query = select([c.id, c.cluster_id])
+        if zips is not None:
+            query = query.where(c.zip.in_(zips))
+        changed = [{'b_id': iid, 'b_cluster': clusters.get(iid, iid)}
+                   for iid, cluster in self.db.conn.execute(query).fetchall() if cluster != clusters.get(iid, iid)]
+        with self.db.conn.begin():
+            for i in range(0, len(changed), 10000):
+                self.db.conn.execute(self.db.immobilien.update().where(c.id == bindparam('b_id')).values(
+                    cluster_id=bindparam('b_cluster')), changed[i:i + 10000])
+        sizes = collections.Counter(clusters.values())
+        duplicates = [size for size in sizes.values() if size > 1]
+        if self.debug:
+            print('compared {0} pairs in {1} blocks, updated {2} cluster ids'.format(
+                self.compared, len(blocks), len(changed)))
+        return sum(duplicates), len(duplicates)
+
+class Alerts(object):
+    """watchlists of saved criteria over the columns of database.immobilien, matched against the
+    new listings of every batch written, the matches are queued in an outbox table in the same
+    transaction. the watchlists are compiled into buckets by zip or city, the ones without either
+    share one bucket, and a bucket keeps the watchlists with a bound on a numeric column sorted
+    by it. a listing is only tested against the watchlists of its zip and city buckets whose
+    bound it is within, instead of against all"""
+    # column, operator, value: < <= > >= on numeric columns, = takes a list of values for any
+    # column, for checkedattributes all of them are needed
+    operators = ('<=', '>=', '<', '>', '=')
+    _tests = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+              'in': lambda value, values: value in values, 'all': lambda value, values: values <= value}
+    # bounds on these columns are preferred for the sorted index, they split rent from purchase
+    _prices = ('kaufpreis', 'kaltmiete')
+
+    def __init__(self, db):
+        """
+        :db: database whose new listings are matched
+        """
+        self.db = db
+        self.debug = db.debug
+        self.watchlists = Table('watchlists', db.metadata,
+                                Column('id', Integer(), primary_key=True),
+                                Column('name', String(255)),
+                                # list of [column, operator, value]
+                                Column('criteria', JSONType()),
+                                Column('unixtimestamp', Integer()),
+                                extend_existing=True)
+        # one row per watchlist and listing matching it, sent is when it was handed out
+        self.outbox = Table('alerts_outbox', db.metadata,
+                            Column('watchlist_fk', Integer(), ForeignKey('watchlists.id'),
+                                   primary_key=True, autoincrement=False),
+                            Column('immobilie_fk', Integer(), ForeignKey('immobilien.id'),
+                                   primary_key=True, autoincrement=False),
+                            Column('unixtimestamp', Integer()),
+                            Column('sent', Integer()),
+                            Index('ix_alerts_outbox_sent', 'sent'),
+                            extend_existing=True)
+        self._stamp = None
+        self._buckets = {}  # ('zip', zip), ('city', city) or (None, None): bucket, see compile
+        self._predicates = {}  # watchlist id: tuple of (column, test, value)
+        self._columns = {}  # column the watchlists test: normalizer of its values
+
+    def criterion(self, text):
+        """parses a criterion of the command line, e.g. kaufpreis<300000, zip=99867,99869 or
+        checkedattributes=balcony
+        :returns: list [column, operator, value], ValueError for an unknown column or a bad value"""
+        match = re.match(r'^\s*(\w+)\s*({0})\s*(.+?)\s*$'.format('|'.join(self.operators)), text)
+        if match is None or match.group(1) not in self.db.immobilien.c:
+            raise ValueError('bad criterion {0!r}, e.g. kaufpreis<300000 or zip=99867,99869'.format(text))
+        column, op, value = match.groups()
+        numeric = isinstance(self.db.immobilien.c[column].type, (Integer, Numeric))
+        if op != '=' and not numeric:
+            raise ValueError('{0} of {1!r} needs a numeric column'.format(op, text))
+        values = [v.strip() for v in value.split(',')] if op == '=' else [value]
+        if numeric:
+            values = [parse_number(v) for v in values]
+            if None in values:
+                raise ValueError('bad number in {0!r}'.format(text))
+            values = [int(v) if v == int(v) else float(v) for v in values]
+        return [column, op, values if op == '=' else values[0]]
+
+    def watch(self, name, criteria):
+        """saves a watchlist
+        :criteria: list of [column, operator, value], see criterion
+        :returns: id of the watchlist"""
+        now = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+        return self.db.conn.execute(self.watchlists.insert(), {'name': name, 'criteria': criteria,
+                                                               'unixtimestamp': now}).inserted_primary_key[0]
+
+    def unwatch(self, watchlist):
+        """deletes a watchlist and its alerts
+        :returns: True if there was one"""
+        with self.db.conn.begin():
+            self.db.conn.execute(self.outbox.delete().where(self.outbox.c.watchlist_fk == watchlist))
+            return self.db.conn.execute(self.watchlists.delete().where(
+                self.watchlists.c.id == watchlist)).rowcount == 1
+
+    def _normalizer(self, column):
+        """:returns: callable turning a value of column into the one the predicates test"""
+        if column == 'checkedattributes':
+            return frozenset
+        if isinstance(self.db.immobilien.c[column].type, (Integer, Numeric)):
+            return float
+        return lambda value: str(value).lower()
+
+    def compile(self, watchlists):
+        """builds the index of watchlists, a bucket is a dict with
+        upper: dict column: (sorted upper bounds, ids of their watchlists),
+        lower: the same for lower bounds and rest: ids of the watchlists without a bound
+        :watchlists: iterable of tuples (id, criteria)"""
+        buckets = collections.defaultdict(lambda: {'upper': collections.defaultdict(list),
+                                                   'lower': collections.defaultdict(list), 'rest': []})
+        self._predicates, self._columns = {}, {}
+        for wid, criteria in watchlists:
+            predicate = []
+            for column, op, value in criteria:
+                normalize = self._columns[column] = self._normalizer(column)
+                if op != '=':
+                    predicate.append((column, self._tests[op], float(value)))
+                elif column == 'checkedattributes':
+                    predicate.append((column, self._tests['all'], frozenset(value)))
+                else:
+                    predicate.append((column, self._tests['in'], frozenset(normalize(v) for v in value)))
+            self._predicates[wid] = tuple(predicate)
+            zips = [value for column, op, value in criteria if column == 'zip' and op == '=']
+            cities = [value for column, op, value in criteria if column == 'city' and op == '=']
+            if len(zips) > 0:
+                keys = [('zip', float(v)) for v in zips[0]]
+            elif len(cities) > 0:
+                keys = [('city', str(v).lower()) for v in cities[0]]
+            else:
+                keys = [(None, None)]
+            # the bound the watchlist is sorted by in its buckets, an upper one on a price first
+            bounds = [(column not in self._prices, op[0] == '>', column, op[0], float(value))
+                      for column, op, value in criteria if op != '=']
+            for key in keys:
+                if len(bounds) == 0:
+                    buckets[key]['rest'].append(wid)
+                else:
+                    _, _, column, side, bound = min(bounds)
+                    buckets[key]['upper' if side == '<' else 'lower'][column].append((bound, wid))
+        self._buckets = {}
+        for key, bucket in buckets.items():
+            for side in ('upper', 'lower'):
+                bucket[side] = dict((column, ([bound for bound, _ in entries], [wid for _, wid in entries]))
+                                    for column, entries in ((column, sorted(entries))
+                                                            for column, entries in bucket[side].items()))
+            self._buckets[key] = bucket
+        if self.debug:
+            print('compiled {0} watchlists into {1} buckets'.format(len(self._predicates), len(self._buckets)))
+
+    def _compiled(self):
+        """recompiles the watchlists after one was added or deleted, e.g. by another process"""
+        from sqlalchemy import func
+        w = self.watchlists.c
+        stamp = tuple(self.db.conn.execute(select([func.count(), func.max(w.id), func.max(w.unixtimestamp)])).first())
+        if stamp != self._stamp:
+            self.compile(self.db.conn.execute(select([w.id, w.criteria])))
+            self._stamp = stamp
+
+    def _candidates(self, bucket, values):
+        """:yields: ids of the watchlists of bucket whose sort bound values is within"""
+        for column, (bounds, ids) in bucket['upper'].items():
+            if values.get(column) is not None:
+                yield from ids[bisect.bisect_left(bounds, values[column]):]
+        for column, (bounds, ids) in bucket['lower'].items():
+            if values.get(column) is not None:
+                yield from ids[:bisect.bisect_right(bounds, values[column])]
+        yield from bucket['rest']
+
+    def match(self, immobilien):
+        """:immobilien: list of dicts
+        :returns: list of tuples (watchlist id, immobilie id)"""
+        matches = []
+        for immo in immobilien:
+            values = dict((column, None if immo.get(column) is None else normalizer(immo[column]))
+                          for column, normalizer in self._columns.items())
+            for key in (('zip', values.get('zip')), ('city', values.get('city')), (None, None)):
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    continue
+                for wid in self._candidates(bucket, values):
+                    if all(values[column] is not None and test(values[column], value)
+                           for column, test, value in self._predicates[wid]):
+                        matches.append((wid, int(immo['id'])))
+        return matches
+
+    def queue(self, immobilien):
+        """matches new listings and puts the matches in the outbox, inside the transaction of the
+        caller, see database.on_insert
+        :returns: nr of alerts queued"""
+        self._compiled()
+        if len(self._predicates) == 0:
+            return 0
+        with metrics.timer('alert_match_seconds'):
+            matches = self.match(immobilien)
+        if len(matches) > 0:
+            now = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+            self.db.conn.execute(self.outbox.insert(), [{'watchlist_fk': wid, 'immobilie_fk': iid,
+                                                         'unixtimestamp': now} for wid, iid in matches])
+        metrics.count('alerts_queued_total', len(matches))
+        return len(matches)
+
+    def pending(self):
+        """hands out the alerts not sent yet and marks them sent
+        :returns: list of tuples (watchlist name, immobilie id, title, address, kaltmiete, kaufpreis)"""
+        from sqlalchemy import bindparam
+        o, w, i = self.outbox.c, self.watchlists.c, self.db.immobilien.c
+        now = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+        with self.db.conn.begin():
+            alerts = self.db.conn.execute(
+                select([o.watchlist_fk, w.name, i.id, i.title, i.address, i.kaltmiete, i.kaufpreis]).select_from(
+                    self.outbox.join(self.watchlists, w.id == o.watchlist_fk).join(
+                        self.db.immobilien, i.id == o.immobilie_fk)).where(o.sent.is_(None)).order_by(
+                    o.watchlist_fk, i.id)).fetchall()
+            if len(alerts) > 0:
+                # only the ones handed out, the daemon may queue more meanwhile
+                self.db.conn.execute(self.outbox.update().where(and_(
+                    o.watchlist_fk == bindparam('b_watchlist'), o.immobilie_fk == bindparam('b_id'))).values(
+                    sent=now), [{'b_watchlist': alert[0], 'b_id': alert[2]} for alert in alerts])
+        return [tuple(alert[1:]) for alert in alerts]
+
+def extract_result_model(html):
+    """grabs the IS24.resultList.resultListModel.searchResponseModel object from the page source
+    of a result list, no JS rendering needed
+    :html: page source as str
+    :returns: searchResponseModel as dict or None if the page does not contain one
+    """
+    match = re.search(r'["\']?searchResponseModel["\']?\s*:\s*', html)
+    if match is None:
+        return None
+    try:
+        model, _ = json.JSONDecoder().raw_decode(html, match.end())
+    except ValueError:
+        return None
+    return model if isinstance(model, dict) else None
+
+EXPOSE_URL = 'https://www.immobilienscout24.de/expose/{0}'
+_EXPOSE_CRITERION = re.compile(r'<dd class="is24qa-([\w-]+)[^"]*"[^>]*>(.*?)</dd>', re.S)
+_HTML_TAG = re.compile(r'<[^>]+>')
+_HTML_ALT = re.compile(r'alt="([^"]*)"')
+_FIRST_NUMBER = re.compile(r'\d[\d.]*(?:,\d+)?')
+
+def extract_expose(html):
+    """reads the criteria of an exposé page, its dd elements classed is24qa-<criterion>
+    :html: page source as str
+    :returns: dict criterion: text, e.g. {'baujahr': '1995', 'etage': '2 von 4'}, empty for a page without
+    """
+    from html import unescape
+    criteria = {}
+    for name, value in _EXPOSE_CRITERION.findall(html):
+        text = ' '.join(unescape(_HTML_TAG.sub(' ', value)).split())
+        if not text:
+            # the energy class is an image
+            alt = _HTML_ALT.search(value)
+            text = unescape(alt.group(1)).strip() if alt else ''
+        criteria[name.lower()] = text
+    return criteria
+
+def expose_details(criteria):
+    """:criteria: dict of extract_expose
+    :returns: dict of the detail columns of database.expose"""
+    def number(name):
+        match = _FIRST_NUMBER.search(criteria.get(name) or '')
+        return parse_number(match.group()) if match else None
+
+    def integer(name):
+        value = number(name)
+        return None if value is None else int(value)
+
+    def text(name, length=255):
+        value = criteria.get(name)
+        return value[:length] if value else None
+
+    floor = criteria.get('etage') or ''
+    floors = re.search(r'von\s+(\d+)', floor)
+    return {'baujahr': integer('baujahr'),
+            'etage': 0 if floor.startswith(('EG', 'Erdgeschoss')) else integer('etage'),
+            'etagen': int(floors.group(1)) if floors else None,
+            'hausgeld': number('hausgeld'),
+            'nebenkosten': number('nebenkosten'),
+            'heizkosten': number('heizkosten'),
+            'endenergiebedarf': number('endenergiebedarf' if 'endenergiebedarf' in criteria
+                                       else 'energieverbrauchskennwert'),
+            'energieeffizienzklasse': text('energieeffizienzklasse', 4),
+            'heizungsart': text('heizungsart'),
+            'energietraeger': text('wesentliche-energietraeger'),
+            'objektzustand': text('objektzustand'),
+            'criteria': criteria}
+
+# the columns of database.immobilien normalize fills, in table order, search_url is stored as url_fk
+IMMOBILIE_FIELDS = ('id', 'search_url', 'cwid', 'shortlisted', 'privateoffer', 'title', 'address', 'district',
+                    'city', 'zip', 'distanceinkm', 'hasnewflag', 'hasfloorplan', 'hasvaluation',
+                    'realtorlogoforresultlisturl', 'realtorcompanyname', 'contactname', 'kaltmiete', 'kaufpreis',
+                    'wohnfläche', 'grundstück', 'zimmer', 'idtohide', 'listingsize', 'latitude', 'longitude',
+                    'checkedattributes', 'gallerypictures', 'fingerprint')
+_IMMOBILIE_FIELDSET = frozenset(IMMOBILIE_FIELDS)
+_GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+def geohash(latitude, longitude, precision=9):
+    """encodes a position as geohash, positions sharing a prefix share a cell
+    :precision: nr of characters, 9 is a cell of about 5 m
+    :returns: str"""
+    latitude, longitude = float(latitude), float(longitude)
+    latitudes, longitudes = [-90.0, 90.0], [-180.0, 180.0]
+    cell = []
+    bits = bit = 0
+    even = True
+    while len(cell) < precision:
+        interval, value = (longitudes, longitude) if even else (latitudes, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        if value >= middle:
+            bits = bits * 2 + 1
+            interval[0] = middle
+        else:
+            bits = bits * 2
+            interval[1] = middle
+        even = not even
+        bit += 1
+        if bit == 5:
+            cell.append(_GEOHASH_ALPHABET[bits])
+            bits = bit = 0
+    return ''.join(cell)
+
+def geohash_cover(latitude, longitude, km, limit=32):
+    """the geohash cells covering the bounding box of a circle, as fine as limit allows
+    :km: radius
+    :limit: max nr of cells
+    :returns: sorted list of geohash prefixes"""
+    import math
+    latitude, longitude = float(latitude), float(longitude)
+    dlat = km / 111.32
+    dlon = km / (111.32 * max(math.cos(math.radians(latitude)), 1e-6))
+    south, north = max(latitude - dlat, -90.0), min(latitude + dlat, 90.0)
+    west, east = longitude - min(dlon, 180.0), longitude + min(dlon, 180.0)
+    for precision in range(9, 0, -1):
+        height = 180.0 / 2 ** (5 * precision // 2)
+        width = 360.0 / 2 ** ((5 * precision + 1) // 2)
+        rows = int((north - south) / height) + 2
+        columns = int((east - west) / width) + 2
+        if rows * columns <= limit:
+            break
+    cells = set()
+    for i in range(rows):
+        for j in range(columns):
+            lon = min(west + j * width, east)
+            cells.add(geohash(min(south + i * height, north), (lon + 180.0) % 360.0 - 180.0, precision))
+    return sorted(cells)
+
+def haversine(latitude, longitude, latitude2, longitude2):
+    """:returns: great circle distance in km, infinite if a position is missing"""
+    import math
+    if None in (latitude, longitude, latitude2, longitude2):
+        return float('inf')
+    lat1, lon1, lat2, lon2 = map(math.radians, map(float, (latitude, longitude, latitude2, longitude2)))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0088 * math.asin(math.sqrt(a))
+
+# thousands separators, units and currency around german formatted numbers
+_NUMBER_NOISE = str.maketrans('', '', '. \xa0€m²')
+
+def parse_number(value):
+    """parses a german formatted number, '1.234,56 €', '54,17 m²' or '2,5'
+    :value: str, int, float or None
+    :returns: Decimal or None if value is no number
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return decimal.Decimal(str(value))
+    try:
+        return decimal.Decimal(value.translate(_NUMBER_NOISE).replace(',', '.'))
+    except (decimal.InvalidOperation, AttributeError):
+        return None
+
+def normalize(entries):
+    """turns raw resultlistEntries into rows of database.immobilien in a single pass, replaces
+    the json round trip of Immo_scraper._jsn2immobilie
+    :entries: list of dicts as scraped
+    :returns: list of dicts with the keys IMMOBILIE_FIELDS, prices and areas as Decimal
+    """
+    immobilien = []
+    with metrics.timer('parse_seconds'):
+        for entry in entries:
+            estate = entry.get('resultlist.realEstate') or {}
+            # attributes: [ { attribute: [ { label: Kaufpreis, value: '1.000 €' },... ] } ]
+            labels = {}
+            for group in entry.get('attributes') or []:
+                for attr in group.get('attribute') or []:
+                    labels[attr.get('label')] = attr.get('value')
+            address = estate.get('address') or {}
+            coordinate = address.get('wgs84Coordinate') or {}
+            contact = estate.get('contactDetails') or {}
+            gallery = (estate.get('galleryAttachments') or {}).get('attachment') or []
+            if isinstance(gallery, dict):
+                gallery = [gallery]
+            postcode = address.get('postcode')
+            plot = parse_number(labels.get('Grundstück'))
+            immobilien.append({
+                'id': int(entry['@id']),
+                'search_url': entry.get('search_url'),
+                'cwid': estate.get('companyWideCustomerId'),
+                'shortlisted': entry.get('shortlisted'),
+                'privateoffer': entry.get('privateOffer'),
+                'title': estate.get('title'),
+                'address': (address.get('description') or {}).get('text'),
+                'district': address.get('quarter'),
+                'city': address.get('city'),
+                'zip': int(postcode) if isinstance(postcode, str) and postcode.isdigit() else None,
+                'distanceinkm': entry.get('distanceInKm'),
+                'hasnewflag': entry.get('hasNewFlag'),
+                'hasfloorplan': entry.get('hasFloorPlan'),
+                'hasvaluation': entry.get('hasValuation'),
+                'realtorlogoforresultlisturl': entry.get('realtorLogoForResultlistUrl'),
+                'realtorcompanyname': entry.get('realtorCompanyName'),
+                'contactname': ' '.join(name for name in (contact.get('firstname'), contact.get('lastname'))
+                                        if name) or None,
+                'kaltmiete': parse_number(labels.get('Kaltmiete')),
+                'kaufpreis': parse_number(labels.get('Kaufpreis')),
+                'wohnfläche': parse_number(labels.get('Wohnfläche')),
+                # integer column
+                'grundstück': int(plot) if plot is not None else None,
+                'zimmer': parse_number(labels.get('Zimmer')),
+                'idtohide': entry.get('idToHide'),
+                'listingsize': estate.get('listingType'),
+                'latitude': parse_number(coordinate.get('latitude')),
+                'longitude': parse_number(coordinate.get('longitude')),
+                'checkedattributes': [attr for attr in ('garden', 'balcony', 'builtInKitchen')
+                                      if estate.get(attr) in ('true', True)],
+                'gallerypictures': [picture['@xlink.href'] for picture in gallery if '@xlink.href' in picture],
+                'fingerprint': entry.get('fingerprint')})
+    metrics.count('entries_parsed_total', len(immobilien))
+    return immobilien
+
+def result_entries(model):
+    """extracts the list of immobilien from a searchResponseModel, the list is in the key
+    'searchResponseModel["resultlist.resultlist"].resultlistEntries[0].resultlistEntry'
+    :model: searchResponseModel as dict or None
+    :returns: list of dicts, a single result is returned as list as well
+    """
+    try:
+        entries = model['resultlist.resultlist']['resultlistEntries'][0]['resultlistEntry']
+    except (KeyError, IndexError, TypeError):
+        return []
+    if isinstance(entries, dict):
+        return [entries]
+    elif isinstance(entries, list):
+        return entries
+    return []
+
+def paging_info(model):
+    """reads the paging info of a searchResponseModel
+    :model: searchResponseModel as dict or None
+    :returns: tuple (pageNumber, numberOfPages), (1, 1) if the model has no paging info
+    """
+    try:
+        paging = model['resultlist.resultlist']['paging']
+        return int(paging['pageNumber']), int(paging['numberOfPages'])
+    except (KeyError, TypeError, ValueError):
+        return 1, 1
+
+def page_url(baseurl, page):
+    """url of result page nr page of the search baseurl, alike
+    https://www.immobilienscout24.de/Suche/S-T/P-2/Wohnung-Miete/Thueringen/Gotha
+    :baseurl: search url, page 1
+    :page: page nr, starting at 1
+    :returns: url
+    """
+    import urllib.parse
+    pattern = re.compile(r'(/Suche/[A-Z]-[A-Z]/)(P-\d+/)?')
+    if pattern.search(baseurl):
+        return pattern.sub(r'\g<1>' + ('P-{0}/'.format(page) if page > 1 else ''), baseurl, count=1)
+    # newer search urls page with a query parameter
+    parts = urllib.parse.urlsplit(baseurl)
+    query = [(k, v) for k, v in urllib.parse.parse_qsl(parts.query) if k != 'pagenumber']
+    if page > 1:
+        query.append(('pagenumber', str(page)))
+    return urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(query)))
+
+# one fetched result page of a search url, status is 'running', 'done' (last page of the url)
+# or 'failed' (page is the last good one); ids are all the listings on the page, entries only
+# the new or changed ones; crawl_started is set on the last page of a crawl that went through
+# every page of the url in one go, to the time it started
+Result_page = collections.namedtuple('Result_page', ['url', 'page', 'pages', 'status', 'entries', 'ids',
+                                                     'crawl_started'])
+
+def normalize_url(url):
+    """the form of url the Http_cache is keyed by: lower case scheme and host, no default port,
+    no fragment and the query parameters sorted
+    :returns: url
+    """
+    import urllib.parse
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower() or 'https'
+    netloc = parts.netloc.lower()
+    host, _, port = netloc.rpartition(':')
+    if (scheme, port) in (('http', '80'), ('https', '443')):
+        netloc = host
+    query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True)))
+    return urllib.parse.urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+# a cached response, stored is the unixtimestamp it was fetched or last revalidated at
+Cache_entry = collections.namedtuple('Cache_entry', ['url', 'headers', 'body', 'stored'])
+
+class Http_cache(object):
+    """on disk cache of GET responses keyed by normalized url, path/<first 2 hex digits>/<sha1 of the url>.
+    entries older than ttl are revalidated with their ETag or Last-Modified and the least recently used
+    ones are evicted beyond maxsize. entries are replaced atomically, so workers and processes can share
+    a cache"""
+
+    # response headers stored with an entry
+    keep = ('content-type', 'etag', 'last-modified')
+
+    def __init__(self, path='immoCache', ttl=3600, maxsize=512 * 2 ** 20, offline=False, debug=False):
+        """
+        :path: directory of the cache
+        :ttl: seconds an entry is served without asking the server
+        :maxsize: bytes kept on disk
+        :offline: serve from the cache only, whatever the age of the entries, see Connection_pool.request
+        """
+        import threading
+        self.path = path
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.offline = offline
+        self.debug = debug
+        self.hits = self.revalidated = self.misses = 0
+        self._lock = threading.Lock()
+        self._sizes = collections.OrderedDict()  # key: bytes, least recently used first
+        self._size = 0
+        os.makedirs(path, exist_ok=True)
+        entries = []
+        for directory in os.listdir(path):
+            if len(directory) == 2 and os.path.isdir(os.path.join(path, directory)):
+                for key in os.listdir(os.path.join(path, directory)):
+                    if len(key) == 40:
+                        stat = os.stat(os.path.join(path, directory, key))
+                        entries.append((stat.st_mtime, key, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._sizes[key] = size
+            self._size += size
+
+    @staticmethod
+    def key(url):
+        """:returns: sha1 hex digest of the normalized url"""
+        import hashlib
+        return hashlib.sha1(normalize_url(url).encode('utf-8')).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, url):
+        """:returns: Cache_entry of url or None"""
+        key = self.key(url)
+        try:
+            with open(self._file(key), 'rb') as cached:
+                meta = json.loads(cached.readline().decode('utf-8'))
+                body = cached.read()
+            # the modification time is the last use, the order of eviction
+            os.utime(self._file(key))
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            if key in self._sizes:
+                self._sizes.move_to_end(key)
+        return Cache_entry(meta['url'], meta['headers'], body, meta['stored'])
+
+    def fresh(self, entry):
+        """:returns: True if entry is younger than ttl"""
+        return datetime.datetime.now(datetime.timezone.utc).timestamp() - entry.stored < self.ttl
+
+    def put(self, url, headers, body, final_url=None):
+        """stores a 200 response of url
+        :headers: dict of lower cased response headers
+        :final_url: url after redirects, defaults to url
+        """
+        import tempfile
+        key = self.key(url)
+        meta = {'url': final_url or url, 'headers': dict((k, v) for k, v in headers.items() if k in self.keep),
+                'stored': datetime.datetime.now(datetime.timezone.utc).timestamp()}
+        os.makedirs(os.path.dirname(self._file(key)), exist_ok=True)
+        fd, part = tempfile.mkstemp(suffix='.part', dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as cached:
+                cached.write(json.dumps(meta).encode('utf-8') + b'\n')
+                cached.write(body)
+                # the bytes on disk, metadata included, as __init__ counts them with os.stat
+                size = cached.tell()
+            os.replace(part, self._file(key))
+        finally:
+            if os.path.isfile(part):
+                os.remove(part)
+        with self._lock:
+            self._size += size - self._sizes.pop(key, 0)
+            self._sizes[key] = size
+            evicted = []
+            while self._size > self.maxsize and len(self._sizes) > 1:
+                oldest, oldsize = self._sizes.popitem(last=False)
+                self._size -= oldsize
+                evicted.append(oldest)
+        for oldest in evicted:
+            try:
+                os.remove(self._file(oldest))
+            except FileNotFoundError:
+                pass
+        if self.debug and len(evicted) > 0:
+            print('evicted {0} responses from the cache'.format(len(evicted)))
+
+    @staticmethod
+    def validators(entry):
+        """:returns: dict of the conditional request headers revalidating entry"""
+        headers = {}
+        if 'etag' in entry.headers:
+            headers['If-None-Match'] = entry.headers['etag']
+        if 'last-modified' in entry.headers:
+            headers['If-Modified-Since'] = entry.headers['last-modified']
+        return headers
+
+class Connection_pool(object):
+    """keep-alive http(s) connections pooled per host, can be shared between threads"""
+
+    def __init__(self, headers={}, maxsize=8, timeout=30, cache=None, debug=False):
+        """
+        :headers: dict of headers sent with every request, e.g. the User-Agent
+        :maxsize: nr of idle connections kept per host
+        :timeout: socket timeout in seconds
+        :cache: Http_cache for GET requests
+        """
+        import threading
+        self.headers = dict(headers)
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.cache = cache
+        self.debug = debug
+        self._idle = {}  # (scheme, netloc): [connections]
+        self._lock = threading.Lock()
+
+    def _connection(self, scheme, netloc):
+        """:returns: tuple (connection, True if it was taken from the pool)"""
+        import http.client
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout), False
+        return http.client.HTTPConnection(netloc, timeout=self.timeout), False
+
+    def _release(self, scheme, netloc, conn):
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.maxsize:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, url, headers={}, method='GET', redirects=5, sink=None):
+        """sends a request over a pooled connection and reads the whole response, GET requests
+        without a sink go through the cache: fresh entries are served from it, stale ones revalidated
+        and with an offline cache the network is never touched
+        :url: absolute http(s) url
+        :headers: extra request headers
+        :redirects: max nr of redirects to follow
+        :sink: callable getting the decoded body of a 200 response chunk by chunk instead of
+            returning it, keeps large downloads out of memory
+        :returns: tuple (status, dict of lower cased response headers, body as bytes, url after redirects)
+        """
+        if self.cache is None or method != 'GET' or sink is not None:
+            return self._request(url, headers, method, redirects, sink)
+        entry = self.cache.get(url)
+        if entry is not None and (self.cache.offline or self.cache.fresh(entry)):
+            self.cache.hits += 1
+            metrics.count('cache_hits_total')
+            if self.debug:
+                print('cached', url)
+            return 200, dict(entry.headers), entry.body, entry.url
+        if self.cache.offline:
+            raise IOError('{0} is not in the cache, offline'.format(url))
+        if entry is not None:
+            headers = dict(headers, **self.cache.validators(entry))
+        status, responseheaders, body, final_url = self._request(url, headers, method, redirects, sink)
+        if status == 304 and entry is not None:
+            self.cache.revalidated += 1
+            metrics.count('cache_revalidated_total')
+            if self.debug:
+                print('revalidated', url)
+            # unchanged, keep the body and restart its ttl
+            responseheaders = dict(entry.headers, **dict((k, v) for k, v in responseheaders.items()
+                                                         if k in self.cache.keep))
+            self.cache.put(url, responseheaders, entry.body, entry.url)
+            return 200, responseheaders, entry.body, entry.url
+        if status == 200 and 'no-store' not in responseheaders.get('cache-control', ''):
+            self.cache.misses += 1
+            metrics.count('cache_misses_total')
+            self.cache.put(url, responseheaders, body, final_url)
+        return status, responseheaders, body, final_url
+
+    def _request(self, url, headers, method, redirects, sink):
+        """request bypassing the cache"""
+        import http.client
+        import urllib.parse
+        import gzip
+        import zlib
+        for _ in range(redirects + 1):
+            parts = urllib.parse.urlsplit(url)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            sendheaders = dict(self.headers, **{'Accept-Encoding': 'gzip'})
+            sendheaders.update(headers)
+            while True:
+                conn, reused = self._connection(parts.scheme, parts.netloc)
+                streamed = False
+                try:
+                    conn.request(method, path, headers=sendheaders)
+                    response = conn.getresponse()
+                    if sink is not None and response.status == 200:
+                        gzipped = response.getheader('Content-Encoding') == 'gzip'
+                        decoder = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+                        size = 0
+                        for chunk in iter(lambda: response.read(65536), b''):
+                            streamed = True
+                            size += len(chunk)
+                            sink(decoder.decompress(chunk) if gzipped else chunk)
+                        if gzipped:
+                            sink(decoder.flush())
+                        body = b''
+                    else:
+                        body = response.read()
+                except (http.client.HTTPException, OSError) as error:
+                    # a timeout or a failing sink leaves the response half read, the connection is
+                    # of no use to the next request
+                    conn.close()
+                    if reused and not streamed and isinstance(error, (http.client.HTTPException, ConnectionError)):
+                        # the server closed the idle keep-alive connection, retry on a new one
+                        continue
+                    raise
+                break
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(parts.scheme, parts.netloc, conn)
+            responseheaders = dict((k.lower(), v) for k, v in response.getheaders())
+            if responseheaders.get('content-encoding') == 'gzip' and len(body) > 0:
+                body = gzip.decompress(body)
+            metrics.count('http_requests_total')
+            metrics.count('bytes_downloaded_total', size if streamed else len(body))
+            if self.debug:
+                print('{0} {1} {2} bytes, connection reused: {3}'.format(
+                    response.status, url, size if streamed else len(body), reused))
+            if response.status in (301, 302, 303, 307, 308) and 'location' in responseheaders:
+                url = urllib.parse.urljoin(url, responseheaders['location'])
+                continue
+            return response.status, responseheaders, body, url
+        raise IOError('too many redirects for {0}'.format(url))
+
+    def close(self):
+        """closes all idle connections"""
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle = {}
+
+class Photo_downloader(object):
+    """downloads gallery pictures concurrently over pooled connections into a content addressed
+    store, imagepath/<first 2 hex digits>/<sha1>.jpg, so a picture shared by listings is kept once"""
+
+    def __init__(self, imagepath='immoPhotos', pool=None, workers=8, manifest=None, debug=False):
+        """
+        :imagepath: directory of the store
+        :pool: Connection_pool to download with
+        :workers: nr of concurrent downloads
+        :manifest: database recording which pictures belong to which immobilie, the pictures
+            of immobilien in it are not downloaded again
+        """
+        self.imagepath = imagepath
+        self.pool = pool if pool is not None else Connection_pool(maxsize=workers, debug=debug)
+        self.workers = workers
+        self.manifest = manifest
+        self.debug = debug
+        self._digests = {}  # url: sha1 of the pictures downloaded in this run
+
+    def path(self, digest):
+        """:returns: path of the picture with sha1 digest"""
+        return os.path.join(self.imagepath, digest[:2], digest + '.jpg')
+
+    def download(self, url):
+        """streams url into a temp file hashing it on the way and moves that to its address,
+        a failed download leaves no file behind
+        :returns: sha1 hex digest of the picture"""
+        import hashlib
+        import tempfile
+        sha1 = hashlib.sha1()
+        fd, part = tempfile.mkstemp(suffix='.part', dir=self.imagepath)
+        try:
+            with os.fdopen(fd, 'wb') as photo, metrics.timer('photo_download_seconds'):
+                def write(chunk):
+                    sha1.update(chunk)
+                    photo.write(chunk)
+                status = self.pool.request(url, sink=write)[0]
+            if status != 200:
+                raise IOError('GET {0} returned HTTP {1}'.format(url, status))
+            digest = sha1.hexdigest()
+            os.makedirs(os.path.dirname(self.path(digest)), exist_ok=True)
+            os.replace(part, self.path(digest))
+        finally:
+            if os.path.isfile(part):
+                os.remove(part)
+        if self.debug:
+            print('downloaded', url, 'to', self.path(digest))
+        return digest
+
+    def fetch(self, immobilien, chunksize=200):
+        """downloads the gallery pictures of immobilien missing in the store and records them
+        in the manifest
+        :immobilien: iterable of dicts with id and gallerypictures (list of urls)
+        :chunksize: nr of immobilien handled per round trip to the manifest
+        :returns: tuple (nr of pictures downloaded, nr of failed downloads)
+        """
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        import itertools
+        os.makedirs(self.imagepath, exist_ok=True)
+        downloaded = failed = 0
+        immobilien = iter(immobilien)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for chunk in iter(lambda: list(itertools.islice(immobilien, chunksize)), []):
+                galleries = dict((int(immo['id']), [p['url'] if isinstance(p, dict) else p
+                                                    for p in immo.get('gallerypictures') or []])
+                                 for immo in chunk)
+                if self.manifest is not None:
+                    known = self.manifest.selectPhotos(list(galleries))
+                    # the manifest is up to date and the pictures are in the store
+                    galleries = dict((iid, urls) for iid, urls in galleries.items()
+                                     if [url for url, _ in known.get(iid, [])] != urls or
+                                     not all(os.path.isfile(self.path(d)) for _, d in known.get(iid, [])))
+                    missing = set(url for urls in galleries.values() for url in urls) - set(self._digests)
+                    self._digests.update((url, d) for url, d in self.manifest.selectPhotoHashes(missing).items()
+                                         if os.path.isfile(self.path(d)))
+                missing = set(url for urls in galleries.values() for url in urls) - set(self._digests)
+                futures = dict((pool.submit(self.download, url), url) for url in missing)
+                for future in as_completed(futures):
+                    try:
+                        self._digests[futures[future]] = future.result()
+                        downloaded += 1
+                        metrics.count('photos_downloaded_total')
+                    except Exception as e:
+                        failed += 1
+                        metrics.count('photos_failed_total')
+                        print('failed to download picture', futures[future], e)
+                if self.manifest is not None and len(galleries) > 0:
+                    # failed pictures are left out and retried next time
+                    self.manifest.insertphotos(
+                        [dict(immobilie_fk=iid, position=position, url=url, hash=self._digests[url])
+                         for iid, urls in galleries.items()
+                         for position, url in enumerate(urls) if url in self._digests],
+                        ids=list(galleries))
+        return downloaded, failed
+
+class Enricher(object):
+    """fetches the exposé pages of listings new or changed since their last enrichment into
+    database.expose, concurrently over pooled connections and throttled. a run enriches at most
+    limit listings, so its time does not grow with the size of the db"""
+
+    def __init__(self, db, pool=None, workers=4, interval=0.5, debug=False):
+        """
+        :db: database of the listings
+        :pool: Connection_pool to fetch with, with an Http_cache pages are revalidated
+        :workers: nr of concurrent fetches
+        :interval: min seconds between the starts of two fetches
+        """
+        import threading
+        self.db = db
+        self.pool = pool if pool is not None else Connection_pool(maxsize=workers, debug=debug)
+        self.workers = workers
+        self.interval = interval
+        self.debug = debug
+        self._lock = threading.Lock()
+        self._last = 0.0  # start of the last fetch
+
+    def _throttle(self):
+        import time
+        with self._lock:
+            wait = self._last + self.interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._last = time.monotonic()
+
+    def fetch(self, iid):
+        """fetches and parses the exposé of listing iid
+        :returns: tuple (http status, dict of expose_details or None if the page has no criteria)"""
+        self._throttle()
+        with metrics.timer('expose_seconds'):
+            status, _, body, _ = self.pool.request(EXPOSE_URL.format(iid))
+        if status != 200:
+            return status, None
+        criteria = extract_expose(body.decode('utf-8', 'replace'))
+        return status, expose_details(criteria) if criteria else None
+
+    def run(self, limit=500, chunksize=50):
+        """enriches the listings of database.selectUnenriched, each chunk is committed on its own
+        :limit: nr of listings at most
+        :chunksize: nr of listings fetched and recorded at a time
+        :returns: tuple (nr of listings enriched, nr of failed fetches)
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        columns = [column.name for column in self.db.expose.columns]
+        todo = self.db.selectUnenriched(limit)
+        enriched = failed = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for start in range(0, len(todo), chunksize):
+                chunk = todo[start:start + chunksize]
+                futures = [pool.submit(self.fetch, iid) for iid, _ in chunk]
+                now = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+                exposes = []
+                for (iid, fp), future in zip(chunk, futures):
+                    expose = dict.fromkeys(columns)
+                    expose.update(id=iid, unixtimestamp=now)
+                    try:
+                        expose['status'], details = future.result()
+                    except Exception as e:
+                        print('failed to fetch the exposé of', iid, e)
+                        details = None
+                    if details is not None:
+                        expose.update(details, fingerprint=fp or '')
+                        enriched += 1
+                        metrics.count('exposes_enriched_total')
+                    elif expose['status'] in (404, 410):
+                        # the listing is gone, it is not asked for again unless it changes
+                        expose['fingerprint'] = fp or ''
+                    else:
+                        failed += 1
+                        metrics.count('exposes_failed_total')
+                        if self.debug:
+                            print('no exposé criteria for', iid, 'HTTP', expose['status'])
+                    exposes.append(expose)
+                self.db.insertexposes(exposes)
+        return enriched, failed
+
+class Browser_fetcher(object):
+    """fetch engine rendering result pages with phantomJS"""
+
+    def __init__(self, headers, cache_path='phantomjs_cache', debug=False):
+        """starts a phantomJS session
+        :headers: dict of headers
+        :cache_path: disk cache of the session, must not be shared between running sessions
+        """
+        from selenium import webdriver
+        self.debug = debug
+        for key, value in headers.items():
+            webdriver.DesiredCapabilities.PHANTOMJS[
+                'phantomjs.page.customHeaders.{}'.format(key)] = value
+        # use phantomJS to render the JS
+        self.driver = webdriver.PhantomJS(
+            service_args=['--disk-cache=true', '--disk-cache-path={0}'.format(cache_path),
+                          '--load-images=false', '--ignore-ssl-errors=true', '--ssl-protocol=any'])
+
+    def result_model(self, url):
+        """renders url and returns IS24.resultList.resultListModel.searchResponseModel"""
+        with metrics.timer('render_seconds'):
+            self.driver.get(url.replace('http:', 'https:'))
+            model = self.driver.execute_script(
+                'return IS24.resultList.resultListModel.searchResponseModel;')
+        metrics.count('pages_fetched_total')
+        return model
+
+    def close(self):
+        self.driver.quit()
+
+class Http_fetcher(object):
+    """fetch engine reading the result model straight from the page source,
+    one http round trip per page instead of a phantomJS render"""
+
+    def __init__(self, headers, pool=None, debug=False):
+        """
+        :headers: dict of headers, used when no pool is given
+        :pool: Connection_pool to share between fetchers
+        """
+        self.debug = debug
+        self._ownpool = pool is None
+        self.pool = Connection_pool(headers, debug=debug) if pool is None else pool
+
+    def result_model(self, url):
+        """fetches url and extracts IS24.resultList.resultListModel.searchResponseModel"""
+        with metrics.timer('fetch_seconds'):
+            status, _, body, url = self.pool.request(url)
+        if status != 200:
+            metrics.count('pages_failed_total')
+            raise IOError('GET {0} returned HTTP {1}'.format(url, status))
+        metrics.count('pages_fetched_total')
+        with metrics.timer('extract_seconds'):
+            return extract_result_model(body.decode('utf-8', 'replace'))
+
+    def close(self):
+        if self._ownpool:
+            self.pool.close()
 
 class Immo_scraper(object):
     """
     scrapes immobilienscout24 resultlist urls for 'property' (immobilien)
     """
 
-    def __init__(self, urls=[], imagepath='immoPhotos', debug=False):
+    def __init__(self, urls=[], imagepath='immoPhotos', debug=False, workers=1, recycle_after=25,
+                 engine='browser', max_pages=None, known_ids=None, fingerprints=None,
+                 frontier=None, freshness=0, analytics=None, cache=None):
         """initializes Immo_scraper class
 
         :url: List of urls to scrape
+        :workers: number of fetch sessions to spread the urls over
+        :recycle_after: restart a worker's fetch session after this many urls
+        :engine: 'browser' renders pages with phantomJS, 'http' reads them from the page source
+        :max_pages: scrape at most this many result pages per url
+        :known_ids: callable returning the subset of given ids already known, e.g.
+            database.selectKnownIds, stops paging through a url at the first page with only known ids
+        :fingerprints: callable returning a dict id: fingerprint for the given ids, e.g.
+            database.selectFingerprints, only new or changed immobilien are scraped then
+        :frontier: database keeping the crawl state of every url, see checkpoint
+        :freshness: seconds a url crawled completely is skipped with a frontier
+        :analytics: Analytics to keep up to date with the pages seen, see checkpoint
+        :cache: Http_cache the http engine fetches result pages through
         """
         assert isinstance(urls, list), "urls is not a list"
-        from selenium import webdriver
+        assert workers >= 1, "workers must be >= 1: %r" % workers
+        assert engine in ('browser', 'http'), "unknown engine: %r" % engine
+        assert cache is None or engine == 'http', "the cache needs the http engine"
         #  import locale
         self.imagepath = imagepath
         self.immobilien = []
+        # gallery pictures downloaded by scrape_many
+        self.photo_manifest = []
         self.debug = debug
+        self.workers = workers
+        self.recycle_after = recycle_after
+        self.engine = engine
+        self.max_pages = max_pages
+        self.known_ids = known_ids
+        self.fingerprints = fingerprints
+        self.frontier = frontier
+        self.freshness = freshness
+        self.analytics = analytics
+        # pages handed out by iter_immobilien but not checkpointed yet
+        self._progress = []
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (iPhone; U; CPU like Mac OS X; en) AppleWebKit/420.1'
             ' (KHTML, like Gecko) Version/3.0 Mobile/3B48b Safari/419.3'}
-        for key, value in enumerate(self.headers):
-            webdriver.DesiredCapabilities.PHANTOMJS[
-                'phantomjs.page.customHeaders.{}'.format(key)] = value
-        # use phantomJS to render the JS
-        self._seleniumdriver = webdriver.PhantomJS(
-            service_args=['--disk-cache=true', '--disk-cache-path=phantomjs_cache',
-                          '--load-images=false', '--ignore-ssl-errors=true', '--ssl-protocol=any'])
+        # keep-alive connections shared by all http fetchers
+        self._pool = None
+        if self.engine == 'http':
+            self._pool = Connection_pool(self.headers, maxsize=max(8, workers), cache=cache, debug=debug)
+        # started on the first page fetched, runs that only download photos or export never boot
+        # phantomJS, the worker pool brings its own sessions
+        self._fetcher = None
         # urls from immosearch
         self.baseurls = urls
         if len(urls) > 0:
             #  print(urls)
-            for url in self.baseurls:
-                base_jsn = self._scrape_baseurl(url)
-                #  convert scraped JS to json
-                base_jsn = self._jsn2immobilie(base_jsn)
-                self.immobilien.extend(base_jsn)
+            if self.workers > 1:
+                for base_jsn in self._scrape_parallel(self.baseurls):
+                    self.immobilien.extend(base_jsn)
+            else:
+                for url in self.baseurls:
+                    for page in self._iter_pages(url):
+                        #  convert scraped JS to json
+                        base_jsn = normalize(page.entries)
+                        self.immobilien.extend(base_jsn)
             self.immobilien = uniqDicts(self.immobilien)
-            #  self._seleniumdriver.close()
+            #  self._fetcher.close()
+
+    def _new_fetcher(self, worker=None):
+        """starts a session of the configured fetch engine
+        :worker: nr of the pool worker, keeps the phantomJS disk caches apart
+        :returns: Browser_fetcher or Http_fetcher
+        """
+        if self.engine == 'http':
+            return Http_fetcher(self.headers, pool=self._pool, debug=self.debug)
+        cache_path = 'phantomjs_cache' if worker is None else 'phantomjs_cache_{0}'.format(worker)
+        return Browser_fetcher(self.headers, cache_path=cache_path, debug=self.debug)
+
+    def _iter_parallel(self, urls):
+        """spreads urls over a pool of self.workers fetch sessions,
+        every worker thread owns one session and restarts it after self.recycle_after urls
+        :urls: list of urls to scrape
+        :yields: tuple (index of the url in urls, Result_page) as the pages come in
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        import queue
+        import threading
+        sessions = {}  # thread ident: [fetcher, nr of urls scraped, worker nr]
+        lock = threading.Lock()
+        # bounded, so workers can not run ahead of the consumer
+        pages = queue.Queue(maxsize=2 * self.workers)
+        stop = threading.Event()
+        done = object()
+
+        def session():
+            ident = threading.get_ident()
+            with lock:
+                if ident not in sessions:
+                    sessions[ident] = [None, 0, len(sessions)]
+                worker = sessions[ident]
+            if worker[0] is not None and worker[1] >= self.recycle_after:
+                if self.debug:
+                    print('recycling fetch session of worker', worker[2])
+                worker[0].close()
+                worker[0] = None
+            if worker[0] is None:
+                worker[0] = self._new_fetcher(worker[2])
+                worker[1] = 0
+            worker[1] += 1
+            return worker[0]
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def scrape(index):
+            try:
+                if stop.is_set():
+                    return
+                for page in self._iter_pages(urls[index], fetcher=session()):
+                    put((index, page))
+                    if stop.is_set():
+                        return
+            finally:
+                put((index, done))
+
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+        futures = [pool.submit(scrape, index) for index in range(len(urls))]
+        try:
+            finished = 0
+            while finished < len(urls):
+                index, page = pages.get()
+                if page is done:
+                    # reraise what went wrong in the worker
+                    futures[index].result()
+                    finished += 1
+                else:
+                    yield index, page
+        finally:
+            stop.set()
+            for future in futures:
+                future.cancel()
+            pool.shutdown(wait=True)
+            for fetcher, _, _ in sessions.values():
+                if fetcher is not None:
+                    fetcher.close()
+
+    def _scrape_parallel(self, urls):
+        """scrapes urls with the worker pool
+        :urls: list of urls to scrape
+        :returns: list of lists of immobilien, in the order of urls
+        """
+        # pages of one url come from one worker in order, so the merged result equals the serial one
+        immobilien = [[] for _ in urls]
+        for index, page in self._iter_parallel(urls):
+            immobilien[index].extend(normalize(page.entries))
+        return immobilien
+
+    def iter_immobilien(self, urls):
+        """streams the immobilien of urls page by page instead of collecting them in self.immobilien,
+        memory stays flat apart from a set of the ids seen so far
+        progress is kept for checkpoint
+        :urls: list of urls to scrape
+        :yields: cleaned dicts of immobilien, every id once
+        """
+        assert isinstance(urls, list), "urls is not a list"
+        if self.workers > 1:
+            pages = (page for _, page in self._iter_parallel(urls))
+        else:
+            pages = (page for url in urls for page in self._iter_pages(url))
+        seen = set()
+        for page in pages:
+            for immo in normalize(page.entries):
+                if int(immo['id']) not in seen:
+                    seen.add(int(immo['id']))
+                    yield immo
+            # the consumer pulled past every immo of the page, see checkpoint
+            self._progress.append(page)
 
     def _jsn2immobilie(self, listofjsn=[], debug=False):
         """
         extracts immobilien, adds missing values from list of dicts
+        superseded by normalize, kept as the baseline of benchmarks.py
         :listofjson: list of dicts
         returns list of dicts
         """
         assert isinstance(listofjsn, list), 'is not a list %r' % listofjsn
-        if len(listofjsn) is 0:
+        if len(listofjsn) == 0:
             return []
         #  assert isinstance(listofjsn[0], dict), 'is not a list of dicts %r' % listofjsn
         immobilien = []
@@ -287,7 +2840,6 @@ class Immo_scraper(object):
         # remove @ from key names @id...
         keyname = re.compile(r'@(?=[\w\.]+[''"]\s?:)')
         immo_str = json.dumps(listofjsn)
-        #  immo_str = demjson.decode(listofjsn)
         immo_str = re.sub(keyname, '', immo_str)
 
         #  keyname = re.compile(r'(["\'])[fF]alse\1')
@@ -379,162 +2931,508 @@ class Immo_scraper(object):
         return immobilien
 
     class Immobilie(object):
-        """Docstring for Immobilie. """
+        """compact record of one listing, its fields are the columns of database.immobilien in
+        IMMOBILIE_FIELDS order, portal fields beyond them are kept in the extra dict"""
+        __slots__ = IMMOBILIE_FIELDS + ('extra',)
+        _values = operator.attrgetter(*IMMOBILIE_FIELDS)
 
-        def __init__(self, json=[]):
-            """creates an immbobilien instance from a dict or iterable
-            :json: TODO
+        def __init__(self, *values, extra=None):
+            """creates an immobilie from field values in IMMOBILIE_FIELDS order, e.g. a db row
+            :values: missing trailing values are None
+            :extra: dict of further portal fields or None
             """
-            if isinstance(json, dict):
-                self.id = json['id']
-                #  self._json = json
+            assert len(values) <= len(IMMOBILIE_FIELDS), 'too many values for Immobilie: %r' % (values,)
+            for field, value in zip(IMMOBILIE_FIELDS, values):
+                setattr(self, field, value)
+            for field in IMMOBILIE_FIELDS[len(values):]:
+                setattr(self, field, None)
+            self.extra = extra
 
-    def _scrape_baseurl(self, baseurl):
-        """
+        @classmethod
+        def fromdict(cls, immo):
+            """:immo: dict, e.g. a row of normalize, keys beyond IMMOBILIE_FIELDS go to extra"""
+            extra = None
+            if not immo.keys() <= _IMMOBILIE_FIELDSET:
+                extra = dict((k, v) for k, v in immo.items() if k not in _IMMOBILIE_FIELDSET)
+            return cls(*map(immo.get, IMMOBILIE_FIELDS), extra=extra)
+
+        def asdict(self):
+            """:returns: dict of the fields, the row database.insertimmobilie writes"""
+            return dict(zip(IMMOBILIE_FIELDS, self._values(self)))
+
+        def __getitem__(self, key):
+            if key in _IMMOBILIE_FIELDSET:
+                return getattr(self, key)
+            if self.extra is not None and key in self.extra:
+                return self.extra[key]
+            raise KeyError(key)
+
+        def get(self, key, default=None):
+            """dict like access to fields and extra"""
+            try:
+                return self[key]
+            except KeyError:
+                return default
+
+        def __eq__(self, other):
+            return isinstance(other, type(self)) and self._values(self) == other._values(other) and self.extra == other.extra
+
+        def __repr__(self):
+            return 'Immobilie(id={0!r}, title={1!r})'.format(self.id, self.title)
+
+    def _only_known(self, entries):
+        """:returns: True if self.known_ids knows every id of a non empty result page"""
+        if self.known_ids is None or len(entries) == 0:
+            return False
+        ids = set(int(immo['@id']) for immo in entries)
+        return len(ids - set(self.known_ids(ids))) == 0
+
+    def _changed(self, entries):
+        """drops the entries whose fingerprint equals the one in self.fingerprints
+        :entries: list of raw immos carrying their 'fingerprint'
+        :returns: list of new or changed immos"""
+        if self.fingerprints is None or len(entries) == 0:
+            return entries
+        known = self.fingerprints(set(int(immo['@id']) for immo in entries))
+        changed = [immo for immo in entries if known.get(int(immo['@id'])) != immo['fingerprint']]
+        if self.debug:
+            print('{0} of {1} immobilien unchanged'.format(len(entries) - len(changed), len(entries)))
+        return changed
+
+    def _iter_pages(self, baseurl, fetcher=None):
+        """pages through the results of a search, the urls of subsequent pages are derived from
+        the paging info of the first page; page N+1 is prefetched while page N is processed.
+        with self.frontier a url crawled within self.freshness seconds is skipped and an
+        interrupted or failed crawl resumes after its last checkpointed page
         :baseurl: url to scrape for immo data
-        :returns: list of immos"""
+        :fetcher: fetch session to use, defaults to self._fetcher
+        :yields: Result_page per page, its entries are the new or changed immos"""
+        from concurrent.futures import ThreadPoolExecutor
         validate_url(baseurl)
-        immobilien = []
+        if fetcher is None:
+            if self._fetcher is None:
+                self._fetcher = self._new_fetcher()
+            fetcher = self._fetcher
+        page = 1
+        started = datetime.datetime.now(datetime.timezone.utc).timestamp()
+        if self.frontier is not None:
+            state = self.frontier.selectCrawlState(baseurl)
+            if state is not None:
+                age = datetime.datetime.now(datetime.timezone.utc).timestamp() - (state['unixtimestamp'] or 0)
+                if state['status'] == 'done' and age < self.freshness:
+                    if self.debug:
+                        print('skipping {0}, crawled {1:.0f}s ago'.format(baseurl, age))
+                    return
+                if state['status'] in ('running', 'failed') and state['last_page'] < state['pages']:
+                    page = state['last_page'] + 1
+                    started = None
+                    if self.debug:
+                        print('resuming {0} at page {1} of {2}'.format(baseurl, page, state['pages']))
 
         def scrape_JS(result_url):
-            """ grab IS24.resultList variable from source code of url return IS24.resultList.resultListModel;
+            """ grab IS24.resultList.resultListModel.searchResponseModel from url;
             the list of immobilien is in the key
             'IS24.resultList.resultListModel.searchResponseModel["resultlist.resultlist"].resultlistEntries[0].resultlistEntry'
-            : [ immos,...] """
+            : ([ immos,...], searchResponseModel) """
 
             if self.debug:
                 assert isinstance(result_url, str)  # 'url is malformed'
-            self._seleniumdriver.get(result_url.replace('http:', 'https:'))
 
-            try:
-                page_JS = self._seleniumdriver.execute_script(
-                'return IS24.resultList.resultListModel.searchResponseModel["resultlist.resultlist"].resultlistEntries[0].resultlistEntry;')
-            except Exception as e:
-                print('Failed to scrape variable from url:',result_url,e)
-            # if page only has one result page_JS is a dict, if it has many a list
-            if isinstance(page_JS, list):
-                pass
-            elif isinstance(page_JS, dict):
-                page_JS = [page_JS]
-                if self.debug:
-                    print('converting to list', page_JS[0]['@id'])
-            elif page_JS is None:
-                if self.debug:
-                    print('the result page was empty ', page_JS)
-                return []
-            else:
+            model = fetcher.result_model(result_url)
+            page_JS = result_entries(model)
+            if len(page_JS) == 0:
                 if self.debug:
-                    print('no immobilie extracted from {0}, instead i got this?\n {1}, '.format(result_url, page_JS))
-                return []
+                    print('no immobilie extracted from {0}'.format(result_url))
+                return [], model
 
             for immo in page_JS:
                 # add baseurl to dict
                 immo['search_url'] = baseurl
+                immo['fingerprint'] = fingerprint(immo)
             if self.debug:
                 [print('extracted immobilie with id {0} from {1}'.format(imm['@id'], result_url))
                  for imm in page_JS]
-            return page_JS
+            return page_JS, model
 
-        next_page = baseurl
-        while isinstance(next_page, str):
-            immobilien.extend(scrape_JS(next_page))
+        # one prefetch thread, so a browser session is never used concurrently
+        with ThreadPoolExecutor(max_workers=1) as prefetch:
+            pending = prefetch.submit(scrape_JS, page_url(baseurl, page))
+            pages = None
+            while pending is not None:
+                try:
+                    immobilien, model = pending.result()
+                except Exception as e:
+                    # give up on this url only, it resumes at this page next time
+                    print('Failed to scrape variable from url:', page_url(baseurl, page), e)
+                    yield Result_page(baseurl, page - 1, page if pages is None else pages, 'failed', [], [], None)
+                    return
+                pending = None
+                if pages is None:
+                    pages = paging_info(model)[1]
+                    if self.max_pages is not None and self.max_pages < pages:
+                        pages = self.max_pages
+                        started = None
+                if page < pages:
+                    pending = prefetch.submit(scrape_JS, page_url(baseurl, page + 1))
+                    if self.debug:
+                        print('prefetching page {0} of {1} for {2}'.format(page + 1, pages, baseurl))
+                stop = self._only_known(immobilien)
+                status = 'done' if stop or page >= pages else 'running'
+                yield Result_page(baseurl, page, pages, status, self._changed(immobilien),
+                                  [int(immo['@id']) for immo in immobilien],
+                                  started if page >= pages and not stop else None)
+                if stop:
+                    if self.debug:
+                        print('page {0} of {1} only has known ids, stopping'.format(page, baseurl))
+                    if pending is not None:
+                        pending.cancel()
+                    return
+                page += 1
+
+    def checkpoint(self):
+        """records the pages iter_immobilien handed out completely in self.frontier and
+        self.analytics, call it once the consumer committed them, e.g. as on_commit of
+        database.insertstream"""
+        if len(self._progress) == 0:
+            return
+        progress, self._progress = self._progress, []
+        if self.frontier is not None:
+            self.frontier.updateCrawlStates(progress)
+        if self.analytics is not None:
+            self.analytics.touch(iid for page in progress for iid in page.ids)
+            for page in progress:
+                if page.crawl_started is not None:
+                    self.analytics.sweep(page.url, page.crawl_started)
+
+    async def scrape_many(self, urls, photos=False, concurrency=8, per_host=2, interval=0.0):
+        """fetches the result pages of urls, pages through their results and downloads
+        the gallery pictures concurrently in one event loop, needs the http engine
+        :urls: list of validated search urls
+        :photos: download gallery pictures to the photo store in self.imagepath while scraping,
+            self.photo_manifest then lists them for database.insertphotos
+        :concurrency: max nr of requests in flight
+        :per_host: max nr of requests in flight per host
+        :interval: min seconds between the starts of two requests to the same host
+        :returns: list of unique immobilien, self.known_ids and self.fingerprints are called from
+            the threads of the requests, so an in memory sqlite db can't answer them
+        """
+        import asyncio
+        import urllib.parse
+        from concurrent.futures import ThreadPoolExecutor
+        assert self.engine == 'http', 'scrape_many needs the http engine'
+        loop = asyncio.get_running_loop()
+        # the blocking pooled connections run in threads, the loop only schedules them
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        slots = asyncio.Semaphore(concurrency)
+        hosts = {}  # netloc: [semaphore, lock, start of last request]
+        downloads = {}  # url: task
+        gallery = []  # (immobilie id, position, url)
+        downloader = self.photo_downloader(workers=concurrency)
 
+        async def throttled(func, url, *args):
+            host = urllib.parse.urlsplit(url).netloc
+            if host not in hosts:
+                hosts[host] = [asyncio.Semaphore(per_host), asyncio.Lock(), 0.0]
+            async with hosts[host][0]:
+                async with hosts[host][1]:
+                    wait = hosts[host][2] + interval - loop.time()
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    hosts[host][2] = loop.time()
+                async with slots:
+                    return await loop.run_in_executor(executor, func, url, *args)
+
+        def fetch_page(url):
+            model = Http_fetcher(self.headers, pool=self._pool, debug=self.debug).result_model(url)
+            return result_entries(model), model
+
+        async def crawl(baseurl):
+            immobilien = []
+            page = pages = 1
+            pending = loop.create_task(throttled(fetch_page, baseurl))
+            while pending is not None:
+                try:
+                    entries, model = await pending
+                except Exception as e:
+                    # give up on this url only, the others and its pages so far are kept
+                    print('Failed to scrape variable from url:', page_url(baseurl, page), e)
+                    break
+                pending = None
+                if page == 1:
+                    pages = paging_info(model)[1]
+                    if self.max_pages is not None:
+                        pages = min(pages, self.max_pages)
+                if page < pages:
+                    # prefetch the next page while this one is processed
+                    pending = loop.create_task(throttled(fetch_page, page_url(baseurl, page + 1)))
+                for immo in entries:
+                    # add baseurl to dict
+                    immo['search_url'] = baseurl
+                    immo['fingerprint'] = fingerprint(immo)
+                # the lookups block on the db, keep them off the loop
+                stop = await loop.run_in_executor(executor, self._only_known, entries)
+                immos = normalize(await loop.run_in_executor(executor, self._changed, entries))
+                immobilien.extend(immos)
+                if photos:
+                    for immo in immos:
+                        for i, picture in enumerate(immo.get('gallerypictures') or []):
+                            url = picture['url'] if isinstance(picture, dict) else picture
+                            gallery.append((int(immo['id']), i, url))
+                            if url not in downloads:
+                                downloads[url] = loop.create_task(throttled(downloader.download, url))
+                if stop:
+                    if pending is not None:
+                        pending.cancel()
+                    break
+                page += 1
             return immobilien
+
+        if photos:
+            os.makedirs(self.imagepath, exist_ok=True)
+        try:
+            results = await asyncio.gather(*[crawl(url) for url in urls])
+            digests = dict(zip(downloads, await asyncio.gather(*downloads.values(), return_exceptions=True)))
+            for url, digest in digests.items():
+                if isinstance(digest, Exception):
+                    print('failed to download picture', url, digest)
+            self.photo_manifest = [dict(immobilie_fk=iid, position=position, url=url, hash=digests[url])
+                                   for iid, position, url in gallery if isinstance(digests[url], str)]
+        finally:
+            executor.shutdown(wait=False)
+        return uniqDicts([immo for immobilien in results for immo in immobilien])
+
+    def photo_downloader(self, manifest=None, workers=8):
+        """:returns: Photo_downloader storing to self.imagepath over the http engine's connections"""
+        pool = self._pool
+        if pool is None:
+            pool = Connection_pool(self.headers, maxsize=workers, debug=self.debug)
+        return Photo_downloader(self.imagepath, pool=pool, workers=workers, manifest=manifest, debug=self.debug)
+
+    def close(self):
+        """ends the fetch session, the next page fetched starts a new one"""
+        if self._fetcher is not None:
+            self._fetcher.close()
+            self._fetcher = None
+
+    def enricher(self, db, workers=4, interval=0.5):
+        """:returns: Enricher of the listings in db over the http engine's connections and cache"""
+        pool = self._pool
+        if pool is None:
+            pool = Connection_pool(self.headers, maxsize=workers, debug=self.debug)
+        return Enricher(db, pool=pool, workers=workers, interval=interval, debug=self.debug)
+
+    def dl_images(self, immo_id, gallerypictures, manifest=None):
+        """download images into the photo store, see Photo_downloader
+        :gallerypictures: list of urls or dicts [ { "url" : ... ,"type":"..." },..]
+        :manifest: database to record the pictures in
+        :returns: tuple (nr of pictures downloaded, nr of failed downloads)"""
+        assert isinstance(gallerypictures, list), 'is not of list type %r' % gallerypictures
+        return self.photo_downloader(manifest).fetch([dict(id=immo_id, gallerypictures=gallerypictures)])
+
+class Scheduler(object):
+    """crawls the seed urls of a db continuously over one warm fetch session and db connection,
+    every url on its own interval: halved after a crawl finding new ids, stretched by half after
+    one finding none, within min_interval and max_interval. the urls wait in a heap ordered by
+    their next crawl, the url table keeps the schedule across restarts and takes triggers"""
+
+    def __init__(self, db, scraper, min_interval=900, max_interval=86400, poll=10, incremental=False,
+                 recycle_after=25, on_crawl=None, debug=False):
+        """
+        :db: database to crawl the seed urls of
+        :scraper: Immo_scraper with db as frontier, its fetch session is kept between crawls
+        :min_interval: seconds between two crawls of a url at least
+        :max_interval: seconds between two crawls of a url at most
+        :poll: seconds between two looks at the url table for new seed urls and triggers
+        :incremental: update known immobilien, see database.insertstream
+        :recycle_after: restart the fetch session after this many crawls
+        :on_crawl: callable run after every crawl, e.g. to write metrics
+        """
+        import threading
+        assert 0 < min_interval <= max_interval, 'bad intervals: %r, %r' % (min_interval, max_interval)
+        self.db = db
+        self.scraper = scraper
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.poll = poll
+        self.incremental = incremental
+        self.recycle_after = recycle_after
+        self.on_crawl = on_crawl
+        self.debug = debug
+        self.crawls = 0
+        # heap of (next crawl, url), entries whose next crawl is not the one in self._due are stale
+        self._queue = []
+        self._due = {}  # url: next_crawl
+        self._interval = {}  # url: crawl_interval
+        self._stopping = threading.Event()
+
+    def refresh(self, now=None):
+        """queues new seed urls and the ones a trigger made due earlier, new urls are due now
+        :returns: nr of urls queued"""
+        import heapq
+        now = int(now or datetime.datetime.now(datetime.timezone.utc).timestamp())
+        queued = 0
+        for url, interval, due in self.db.selectSchedule():
+            if due is None:
+                interval = interval or self.min_interval
+                self.db.updateSchedule(url, interval, now)
+                due = now
+            self._interval[url] = interval or self.min_interval
+            if self._due.get(url) != due:
+                self._due[url] = due
+                heapq.heappush(self._queue, (due, url))
+                queued += 1
+        return queued
+
+    def adapt(self, interval, new_ids):
+        """:returns: the interval of a url after a crawl finding new_ids"""
+        interval = interval / 2 if new_ids > 0 else interval * 1.5
+        return int(min(self.max_interval, max(self.min_interval, interval)))
+
+    def crawl(self, url):
+        """scrapes url into the db, a stop ends it after the batch in flight and the url
+        resumes at its next page
+        :returns: tuple (nr of inserted, nr of updated immobilien)"""
+        import itertools
+        immobilien = itertools.takewhile(lambda immo: not self._stopping.is_set(),
+                                         self.scraper.iter_immobilien([url]))
+        with metrics.timer('crawl_seconds'):
+            counts = self.db.insertstream(immobilien, incremental=self.incremental,
+                                          on_commit=self.scraper.checkpoint)
+        metrics.count('crawls_total')
+        self.crawls += 1
+        if self.crawls % self.recycle_after == 0:
+            if self.debug:
+                print('recycling the fetch session after {0} crawls'.format(self.crawls))
+            self.scraper.close()
+        return counts
+
+    def run_due(self):
+        """crawls the urls due until none is left or a stop
+        :returns: nr of urls crawled"""
+        import heapq
+        crawled = 0
+        while len(self._queue) > 0 and not self._stopping.is_set():
+            now = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+            due, url = self._queue[0]
+            if due > now:
+                break
+            heapq.heappop(self._queue)
+            if self._due.get(url) != due:
+                continue
             try:
-                next_page = self._seleniumdriver.find_element_by_link_text('nächste Seite')
-                next_page = next_page.get_property('href')
-                # recurse until no more pages for search are found
-                if self.debug:
-                    assert isinstance(next_page, str)
-                    print('found next button, scrapeing subsequent page', next_page)
+                inserted, updated = self.crawl(url)
             except Exception as e:
-                if self.debug:
-                    print('no subsequent links found for', next_page)
-                next_page = None
-        return immobilien
+                # one broken search must not end the daemon, it is retried after its interval
+                print('crawl of {0} failed: {1}'.format(url, e))
+                inserted, updated = None, 0
+            if self._stopping.is_set():
+                # interrupted, stays due and resumes first on the next start
+                break
+            interval = self._interval[url] if inserted is None else self.adapt(self._interval[url], inserted)
+            now = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+            if self.db.updateSchedule(url, interval, now + interval, new_ids=inserted, due=due):
+                self._due[url] = now + interval
+                heapq.heappush(self._queue, (now + interval, url))
+            self._interval[url] = interval
+            crawled += 1
+            if inserted is not None:
+                print('crawled {0}: {1} new, {2} updated immobilien, next crawl in {3:.1f} min'.format(
+                    url, inserted, updated, interval / 60))
+            if self.on_crawl is not None:
+                self.on_crawl()
+            # a trigger may have come in during a long crawl
+            self.refresh()
+        return crawled
 
-    def _url2json(self, url, regexp='\{"results":(\[.+\])\},\n'):
-        """scrapes script tags in a url for given regexp, describing json
-        uses urllib as it ignores the JS, this is faster than rendering js with selenium/
-        :url: list of urls to scrape
-        :returns: list of dicts
-        """
-        import bs4
-        import urllib5
-        pattern = re.compile(regexp)
-        resultjson = []
-        html = urllib.request.urlopen(self._createRequest(url))
-        soup = bs(html.read(), 'lxml')
-
-        for script in soup.findAll('script'):
-            data = pattern.findall(str(script.string))
-            if len(data) > 0:
-                for item in data:
-                    resultjson.extend(json.loads(item))
-        # add url to each dict
-        resultjson = [dict(jsonitem, search_url=url) for jsonitem in resultjson]
-        if self.debug:
-            [print('scraped immobilie with id : {0} from '
-                   'url:{1}, with {2} items'.format(jsonitem['id'],
-                                                    url,
-                                                    len(jsonitem)))
-             for jsonitem in resultjson]
-        return uniqDicts(resultjson, debug=self.debug)
-
-    def dl_images(self, immo_id, gallerypictures):
-        """download images
-        :gallerypictures: list of dicts [ { "url" : ... ,"type":"..." },..]
-        :returns:
-        TODO: create absolute path to photos in rdbms"""
-        assert isinstance(gallerypictures, list), 'is not of list type %r' % gallerypictures
-        path = self.imagepath
-        if not os.path.isdir(path):
-            os.mkdir(path)
-        #  pattern=re.compile(r'.+\/([0-9]+[-][0-9]+[.]jpg)\/.+')
-        for i in range(0, len(gallerypictures)):
-            filename = '{0}/{1}-{2}.jpg'.format(path, immo_id, i)
-            url_to_dl = gallerypictures[i]['url']
-            if not os.path.isfile(filename):
-                if self.debug:
-                    print('downloading :', url_to_dl, 'to :', filename)
-                with open(filename, 'wb') as photo:
-                    try:
-                        photo.write(urllib.request.urlopen(url_to_dl).read())
-                        photo.close()
-                    except Exception as e:
-                        print('url cant be found ', url_to_dl)
-                        raise e
-            else:
-                print('file already exists:', filename)
+    def run(self):
+        """crawls until stop, waking up for the next url due or every poll seconds for triggers"""
+        try:
+            while not self._stopping.is_set():
+                self.refresh()
+                self.run_due()
+                now = datetime.datetime.now(datetime.timezone.utc).timestamp()
+                wait = self.poll if len(self._queue) == 0 else min(self.poll, self._queue[0][0] - now)
+                if self.debug and len(self._queue) > 0:
+                    print('next crawl of {0} in {1:.0f}s'.format(self._queue[0][1], self._queue[0][0] - now))
+                self._stopping.wait(max(wait, 0))
+        finally:
+            self.scraper.close()
+
+    def stop(self, *args):
+        """ends run after the batch in flight, takes the arguments of a signal handler"""
+        self._stopping.set()
 
 def main(debug=False):
     """main"""
     import argparse
 
-    def update_fotos():
-        if parser.results['photo_dir'] is not [1]:
-            if debugging:
-                print('updating/downloading photos')
-            image_urls = []
-            if 'db' in locals():
-                image_urls = db.conn.execute(select([db.immobilien.c.id,
-                                                     db.immobilien.c.gallerypictures]))
-                image_urls = [dict(id=d[0], gallerypictures=d[1])
-                              for d in image_urls]
-                assert isinstance(image_urls[0]['gallerypictures'], list), 'wrong type %r' % image_urls[0]['gallerypictures']
-            if 'scrapeoff' not in locals():
-                if isinstance(parser.results['photo_dir'], str):
-                    scrapeoff = Immo_scraper(debug=debugging,
-                                             imagepath=parser.results['photo_dir'])
-                else:
-                    scrapeoff = Immo_scraper(debug=debugging)
-            try:
-                image_urls.extend(scrapeoff.immobilien)
-            except:
-                print('no immobilie scraped, supply --url or --database parameter')
-            image_urls = uniqDicts(image_urls)
-            [scrapeoff.dl_images(dic['id'], dic['gallerypictures'])
-             for dic in image_urls]
+    def update_fotos(immobilien, manifest=None):
+        """downloads the gallery pictures of immobilien missing in the photo store
+        :immobilien: iterable of dicts with id and gallerypictures
+        :manifest: database recording the pictures
+        :returns: tuple (nr of pictures downloaded, nr of failed downloads)"""
+        if debugging:
+            print('updating/downloading photos')
+        photo_dir = parser.results['photo_dir'][-1]
+        if isinstance(photo_dir, str):
+            scrapeoff = scraper(engine='http', imagepath=photo_dir)
+        else:
+            scrapeoff = scraper(engine='http')
+        return scrapeoff.photo_downloader(manifest, workers=parser.results['photo_workers']).fetch(immobilien)
+
+    def write_metrics():
+        """writes the run summary, prometheus metrics and profile asked for on the command line,
+        each file is replaced atomically"""
+        for option, write in (('metrics', metrics.tojson), ('prometheus', metrics.toprometheus)):
+            if parser.results[option]:
+                with open(parser.results[option] + '.part', 'w') as out:
+                    write(out)
+                os.replace(parser.results[option] + '.part', parser.results[option])
+        if parser.results['profile']:
+            metrics.dump_profile(parser.results['profile'])
+
+    def scraper(urls=[], **options):
+        """Immo_scraper configured by the command line, options override it"""
+        options = dict(dict(debug=debugging, workers=parser.results['workers'], engine=parser.results['engine'],
+                            max_pages=parser.results['max_pages'], known_ids=known_ids,
+                            fingerprints=fingerprints, cache=cache), **options)
+        return Immo_scraper(urls=urls, **options)
+
+    def enricher():
+        """Enricher of the db configured by the command line, over the http engine and --cache"""
+        return scraper(engine='http').enricher(db, workers=parser.results['enrich_workers'],
+                                               interval=parser.results['enrich_interval'])
+
+    def scrape(urls):
+        """scrapes urls with the engine, workers or concurrency given on the command line"""
+        if parser.results['concurrency']:
+            import asyncio
+            photo_dir = (parser.results['photo_dir'] or [None])[-1]
+            if isinstance(photo_dir, str):
+                scrapeoff = scraper(engine='http', imagepath=photo_dir)
+            else:
+                scrapeoff = scraper(engine='http')
+            scrapeoff.immobilien = asyncio.run(scrapeoff.scrape_many(
+                urls, photos=photo_dir is not None, concurrency=parser.results['concurrency'],
+                per_host=parser.results['per_host'], interval=parser.results['interval']))
+            return scrapeoff
+        return scraper(urls)
+
+    def stream(urls):
+        """streams the scraped immobilien of urls into the db, committing batch by batch
+        :returns: tuple (nr of inserted, nr of updated immobilien)"""
+        if parser.results['concurrency']:
+            scrapeoff = scrape(urls)
+            counts = db.insertstream(scrapeoff.immobilien, incremental=parser.results['incremental'])
+            # unchanged listings and removals are only seen by iter_immobilien
+            analytics.touch(int(immo['id']) for immo in scrapeoff.immobilien)
+            if len(scrapeoff.photo_manifest) > 0:
+                db.insertphotos(scrapeoff.photo_manifest,
+                                list(set(photo['immobilie_fk'] for photo in scrapeoff.photo_manifest)))
+            return counts
+        scrapeoff = scraper(frontier=db, freshness=parser.results['freshness'] * 3600, analytics=analytics)
+        return db.insertstream(scrapeoff.iter_immobilien(urls), incremental=parser.results['incremental'],
+                               on_commit=scrapeoff.checkpoint)
 
     parser = argparse.ArgumentParser(
         description='immoKrabbler, der Immobilienscout scraper')
@@ -550,13 +3448,114 @@ def main(debug=False):
     parser.add_argument('--update-db', action="store_true", dest='update_db', required=False,
                         help='update search results in db')
     parser.add_argument('--json', action="store_true", dest='json', required=False,
-                        help='write json to stdout')
+                        help='write json lines to stdout')
     parser.add_argument('--photos', action="append", dest='photo_dir', nargs='?', const=1, required=False,
-                        help='save photos to dir')
+                        help='save photos to dir, a store addressed by content, defaults to immoPhotos')
+    parser.add_argument('--photo-workers', type=int, default=8, dest='photo_workers', required=False,
+                        help='nr of concurrent photo downloads, defaults to 8')
     parser.add_argument('--csv', action="store_true", dest='csv', required=False,
                         help='write csv to stdout')
+    parser.add_argument('--parquet', action="store_true", dest='parquet', required=False,
+                        help='write a parquet file, needs pyarrow')
+    parser.add_argument('--arrow', action="store_true", dest='arrow', required=False,
+                        help='write an arrow ipc file, needs pyarrow')
     parser.add_argument('--outfile', action="append", dest='outfile', nargs='?', required=False,
-                        help='write [csv|json] to file')
+                        help='write [csv|json|parquet|arrow] to file, defaults to TABLE.[csv|jsonl|parquet|arrow]')
+    parser.add_argument('--table', choices=['immobilien', 'immobilien_history', 'immobilien_expose'], default='immobilien',
+                        dest='table', required=False, help='table to export, defaults to immobilien')
+    parser.add_argument('--chunk-size', type=int, default=10000, dest='chunk_size', required=False,
+                        help='nr of rows exported at a time, defaults to 10000')
+    parser.add_argument('--workers', type=int, default=1, dest='workers', required=False,
+                        help='number of parallel fetch sessions to scrape urls with, defaults to 1')
+    parser.add_argument('--engine', choices=['browser', 'http'], default='browser', dest='engine', required=False,
+                        help='fetch result pages by rendering them with phantomJS [browser] or '
+                        'from the page source [http], defaults to browser')
+    parser.add_argument('--concurrency', type=int, dest='concurrency', required=False,
+                        help='scrape urls, their subsequent pages and photos asynchronously '
+                        'with this many requests in flight, implies --engine http')
+    parser.add_argument('--per-host', type=int, default=2, dest='per_host', required=False,
+                        help='max requests in flight per host with --concurrency, defaults to 2')
+    parser.add_argument('--interval', type=float, default=0.0, dest='interval', required=False,
+                        help='min seconds between two requests to the same host with --concurrency')
+    parser.add_argument('--cache', nargs='?', const='immoCache', dest='cache', required=False,
+                        help='cache result pages in this dir and revalidate them with ETag or Last-Modified, '
+                        'implies --engine http, defaults to immoCache')
+    parser.add_argument('--cache-ttl', type=float, default=1, dest='cache_ttl', required=False,
+                        help='hours a cached page is used without asking the server, defaults to 1')
+    parser.add_argument('--cache-size', type=int, default=512, dest='cache_size', required=False,
+                        help='MiB the cache keeps, least recently used pages are evicted first, defaults to 512')
+    parser.add_argument('--offline', action="store_true", dest='offline', required=False,
+                        help='scrape from the cache only without touching the network, e.g. to rerun '
+                        'the parser over a past crawl, implies --cache')
+    parser.add_argument('--max-pages', type=int, dest='max_pages', required=False,
+                        help='scrape at most this many result pages per url')
+    parser.add_argument('--stop-known', action="store_true", dest='stop_known', required=False,
+                        help='stop paging through a url at the first page with only ids already in the db')
+    parser.add_argument('--incremental', action="store_true", dest='incremental', required=False,
+                        help='only parse new or changed immobilien and update changed ones in the db')
+    parser.add_argument('--price-drops', type=int, nargs='?', const=7, dest='price_drops', required=False,
+                        help='list immobilien whose price dropped within the last days, defaults to 7')
+    parser.add_argument('--near', nargs=3, type=float, metavar=('LAT', 'LON', 'KM'), dest='near', required=False,
+                        help='list immobilien within KM of a position, nearest first')
+    parser.add_argument('--dedup', action="store_true", dest='dedup', required=False,
+                        help='cluster listings of the same property, re-posts and offers of several realtors')
+    parser.add_argument('--report', nargs='?', const='city', choices=Analytics.levels, dest='report', required=False,
+                        help='print €/m², new and removed listings per day and city, zip or district, defaults to city')
+    parser.add_argument('--report-key', dest='report_key', required=False,
+                        help='report this city, zip or district only')
+    parser.add_argument('--report-days', type=int, default=30, dest='report_days', required=False,
+                        help='days to report, defaults to 30')
+    parser.add_argument('--batch-size', type=int, default=500, dest='batch_size', required=False,
+                        help='nr of immobilien written to the db per transaction, defaults to 500')
+    parser.add_argument('--migrate', action="store_true", dest='migrate', required=False,
+                        help='bring the schema of a db created by an older version up to date and exit')
+    parser.add_argument('--pool-size', type=int, dest='pool_size', required=False,
+                        help='nr of db connections kept open, defaults to the sqlalchemy default of the backend')
+    parser.add_argument('--max-overflow', type=int, dest='max_overflow', required=False,
+                        help='nr of db connections opened beyond --pool-size when all are in use')
+    parser.add_argument('--pool-timeout', type=float, dest='pool_timeout', required=False,
+                        help='seconds to wait for a free db connection')
+    parser.add_argument('--pool-recycle', type=int, dest='pool_recycle', required=False,
+                        help='seconds after which a db connection is replaced, for servers closing idle ones')
+    parser.add_argument('--enrich', type=int, nargs='?', const=500, dest='enrich', required=False,
+                        help='fetch the exposés of up to ENRICH listings new or changed since their last '
+                        'enrichment for construction year, floor, energy data and hausgeld, defaults to 500, '
+                        'with --daemon after every crawl')
+    parser.add_argument('--enrich-workers', type=int, default=4, dest='enrich_workers', required=False,
+                        help='nr of concurrent exposé fetches, defaults to 4')
+    parser.add_argument('--enrich-interval', type=float, default=0.5, dest='enrich_interval', required=False,
+                        help='min seconds between the starts of two exposé fetches, defaults to 0.5')
+    parser.add_argument('--watch', nargs='+', metavar=('NAME', 'CRITERION'), dest='watch', required=False,
+                        help='save a watchlist, new listings matching all its criteria are queued as alerts, '
+                        'e.g. --watch family "kaufpreis<300000" "wohnfläche>80" zip=99867,99869 '
+                        'checkedattributes=balcony')
+    parser.add_argument('--unwatch', type=int, metavar='ID', dest='unwatch', required=False,
+                        help='delete the watchlist ID and its alerts')
+    parser.add_argument('--watchlists', action="store_true", dest='watchlists', required=False,
+                        help='list the watchlists')
+    parser.add_argument('--alerts', action="store_true", dest='alerts', required=False,
+                        help='print the alerts not printed yet: watchlist, id, title, address, kaltmiete, kaufpreis')
+    parser.add_argument('--daemon', action="store_true", dest='daemon', required=False,
+                        help='crawl the seed urls of the db continuously over one warm fetch session, each on '
+                        'an interval adapting to how often it finds new ids, ends on SIGTERM or SIGINT')
+    parser.add_argument('--min-interval', type=float, default=15, dest='min_interval', required=False,
+                        help='minutes between two crawls of a url with --daemon at least, defaults to 15')
+    parser.add_argument('--max-interval', type=float, default=1440, dest='max_interval', required=False,
+                        help='minutes between two crawls of a url with --daemon at most, defaults to 1440')
+    parser.add_argument('--poll', type=float, default=10, dest='poll', required=False,
+                        help='seconds between two looks of --daemon for new urls and triggers, defaults to 10')
+    parser.add_argument('--trigger', action="append", dest='trigger', nargs='+', required=False,
+                        help='have the --daemon running on the db crawl these search urls right away')
+    parser.add_argument('--freshness', type=float, default=0, dest='freshness', required=False,
+                        help='skip urls crawled completely within this many hours, defaults to 0')
+    parser.add_argument('--metrics', dest='metrics', required=False,
+                        help='write a json summary of the run to this file: counters and latency histograms '
+                        'of fetching, parsing, inserting and photo downloads')
+    parser.add_argument('--prometheus', dest='prometheus', required=False,
+                        help='write the metrics of the run to this file in the prometheus text format')
+    parser.add_argument('--profile', dest='profile', required=False,
+                        help='profile fetching, parsing, inserting and photo downloads with cProfile and '
+                        'write the stats to this file, read them with python3 -m pstats')
     parser.results = vars(parser.parse_args())
     debugging = False
     urls = []
@@ -566,90 +3565,229 @@ def main(debug=False):
         print('started debugging session ', datetime.datetime.utcnow())
         print('optargs :', parser.results)
 
+    if parser.results['metrics'] or parser.results['prometheus'] or parser.results['profile']:
+        import atexit
+        metrics.enabled = True
+        metrics.profile = parser.results['profile'] is not None
+        # main leaves through sys.exit in many places
+        atexit.register(write_metrics)
+
+    if parser.results['database'] or parser.results['update_db'] or parser.results['price_drops'] or \
+            parser.results['report'] or parser.results['near'] or parser.results['dedup'] or parser.results['migrate'] or \
+            parser.results['daemon'] or parser.results['trigger'] or parser.results['enrich'] is not None or \
+            parser.results['watch'] or parser.results['unwatch'] is not None or parser.results['watchlists'] or \
+            parser.results['alerts']:
+        pool = dict((option, parser.results[option])
+                    for option in ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle'))
+        try:
+            if isinstance(parser.results['database'], str):
+                db = database(debug=debugging, db_uri=parser.results['database'], migrate=parser.results['migrate'],
+                              batch_size=parser.results['batch_size'], **pool)
+            else:
+                db = database(debug=debugging, migrate=parser.results['migrate'],
+                              batch_size=parser.results['batch_size'], **pool)
+        except RuntimeError as e:
+            sys.exit(e)
+        analytics = Analytics(db)
+        alerts = Alerts(db)
+        db.on_insert.append(alerts.queue)
+        if parser.results['migrate']:
+            print('{0} is at schema version {1}'.format(db.db_uri, db.selectSchemaVersion()))
+            sys.exit(0)
+
+    cache = None
+    if parser.results['cache'] or parser.results['offline']:
+        parser.results['engine'] = 'http'
+        cache = Http_cache(parser.results['cache'] or 'immoCache', ttl=parser.results['cache_ttl'] * 3600,
+                           maxsize=parser.results['cache_size'] * 2 ** 20, offline=parser.results['offline'],
+                           debug=debugging)
+
+    known_ids = None
+    if parser.results['stop_known']:
+        if 'db' not in locals():
+            sys.exit('--stop-known needs --database or --update-db')
+        known_ids = db.selectKnownIds
+
+    fingerprints = None
+    if parser.results['incremental']:
+        if 'db' not in locals():
+            sys.exit('--incremental needs --database or --update-db')
+        fingerprints = db.selectFingerprints
+
+    if (known_ids is not None or fingerprints is not None) and db.in_memory and \
+            (parser.results['workers'] > 1 or parser.results['concurrency']):
+        sys.exit('--workers and --concurrency look up known ids from threads, an in memory sqlite db is not shared '
+                 'with them, use a file db')
+
     if isinstance(parser.results['url'], list):
         if debugging:
             print('urls supplied:', parser.results['url'])
         for url in [url for urllist in parser.results['url'] for url in urllist]:
             validate_url(url)
             urls.append(url)
-        scrapeoff = Immo_scraper(urls=urls, debug=debugging)
-
-    if parser.results['database'] or parser.results['update_db']:
-        if isinstance(parser.results['database'], str):
-            db = database(debug=debugging, db_uri=parser.results['database'])
-        else:
-            db = database(debug=debugging)
+        # with a db the immobilien are streamed into it instead
+        if 'db' not in locals():
+            scrapeoff = scrape(urls)
 
     if parser.results['update_db']:
         urls.extend(db.selectUniqeSearchUrls())
         urls = list(set(urls))
         if debugging:
             print('updating results for urls: ', urls)
-        if 'scrapeoff' not in locals():
-            scrapeoff = Immo_scraper(debug=debugging, urls=urls)
-            # TODO:debug
-            #  print('scraped nr of immos ', len(scrapeoff.immobilien))
-            #  sys.exit(0)
-        db.insertimmobilie(scrapeoff.immobilien)
+
+    if parser.results['watch']:
+        if len(parser.results['watch']) < 2:
+            sys.exit('--watch needs a name and criteria, e.g. --watch flat "kaltmiete<600" zip=99867')
+        try:
+            criteria = [alerts.criterion(criterion) for criterion in parser.results['watch'][1:]]
+        except ValueError as e:
+            sys.exit(e)
+        print('saved watchlist {0}'.format(alerts.watch(parser.results['watch'][0], criteria)))
+        sys.exit(0)
+
+    if parser.results['unwatch'] is not None:
+        if not alerts.unwatch(parser.results['unwatch']):
+            sys.exit('no watchlist {0}'.format(parser.results['unwatch']))
+        print('deleted watchlist {0}'.format(parser.results['unwatch']))
+        sys.exit(0)
+
+    if parser.results['watchlists']:
+        for wid, name, criteria in db.conn.execute(
+                select([alerts.watchlists.c.id, alerts.watchlists.c.name, alerts.watchlists.c.criteria])):
+            print('{0};{1};{2}'.format(wid, name, ' '.join('{0}{1}{2}'.format(
+                column, op, ','.join(str(v) for v in value) if isinstance(value, list) else value)
+                for column, op, value in criteria)))
+        sys.exit(0)
+
+    if parser.results['alerts']:
+        for name, iid, title, address, *prices in alerts.pending():
+            print('{0};{1};{2};{3};{4};{5}'.format(name, iid, title, address, *[
+                '' if price is None else '{0:.2f}'.format(price) for price in prices]))
+        sys.exit(0)
+
+    if parser.results['trigger']:
+        triggered = [url for urllist in parser.results['trigger'] for url in urllist]
+        for url in triggered:
+            validate_url(url)
+            if not url_category(url)['seed']:
+                sys.exit('{0} is a page of a search, trigger its first page'.format(url))
+        print('triggered {0} searches'.format(db.triggerCrawls(triggered)))
+        sys.exit(0)
+
+    if parser.results['daemon']:
+        import signal
+        if parser.results['concurrency']:
+            sys.exit('--daemon crawls over one fetch session, it does not take --concurrency')
+        # --url adds seed urls to the schedule
+        db.inserturls(urls)
+        enrichment = enricher() if parser.results['enrich'] is not None else None
+
+        def after_crawl():
+            analytics.medians()
+            if enrichment is not None:
+                print('enriched {0} listings, {1} failed'.format(*enrichment.run(parser.results['enrich'])))
+            if metrics.enabled:
+                write_metrics()
+
+        scheduler = Scheduler(db, scraper(frontier=db, freshness=parser.results['freshness'] * 3600,
+                                          analytics=analytics, workers=1),
+                              min_interval=parser.results['min_interval'] * 60,
+                              max_interval=parser.results['max_interval'] * 60, poll=parser.results['poll'],
+                              incremental=parser.results['incremental'],
+                              on_crawl=after_crawl, debug=debugging)
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, scheduler.stop)
+        print('daemon started, {0} seed urls'.format(len(db.selectUniqeSearchUrls())))
+        scheduler.run()
+        print('daemon stopped after {0} crawls'.format(scheduler.crawls))
+        sys.exit(0)
+
+    if 'db' in locals() and len(urls) > 0:
+        if debugging:
+            print('scraping urls: ', urls)
+        insertedImmobilien, updatedImmobilien = stream(urls)
+        analytics.medians()
+        print('inserted {0} immobilien, updated {1} immobilien'.format(insertedImmobilien, updatedImmobilien))
+
+    if parser.results['enrich'] is not None:
+        print('enriched {0} listings, {1} failed'.format(*enricher().run(parser.results['enrich'])))
+
+    if parser.results['price_drops'] is not None:
+        for iid, unixtimestamp, *prices in db.selectPriceDrops(parser.results['price_drops']):
+            print('{0};{1};{2};{3};{4};{5}'.format(
+                iid, datetime.datetime.utcfromtimestamp(unixtimestamp).isoformat(), *prices))
+        sys.exit(0)
+
+    if parser.results['near'] is not None:
+        db.updateGeohashes()
+        for distance, immo in db.near(*parser.results['near']):
+            print('{0};{1:.2f};{2};{3};{4};{5}'.format(immo.id, distance, immo.title, immo.address, *[
+                '' if price is None else '{0:.2f}'.format(price) for price in (immo.kaltmiete, immo.kaufpreis)]))
+        sys.exit(0)
+
+    if parser.results['dedup']:
+        listings, clusters = Deduplicator(db).run()
+        print('{0} listings in {1} clusters of the same property'.format(listings, clusters))
+        sys.exit(0)
+
+    if parser.results['report']:
+        for row in analytics.report(parser.results['report'], key=parser.results['report_key'],
+                                    days=parser.results['report_days']):
+            print(';'.join('' if value is None else str(round(value, 2)) if isinstance(value, (float, decimal.Decimal)) else str(value)
+                           for value in row))
+        sys.exit(0)
 
     if parser.results['photo_dir']:
-        update_fotos()
+        if 'db' in locals():
+            downloaded, failed = update_fotos(
+                (dict(id=iid, gallerypictures=pictures) for iid, pictures in
+                 db.conn.execute(select([db.immobilien.c.id, db.immobilien.c.gallerypictures]))), manifest=db)
+        elif 'scrapeoff' not in locals():
+            sys.exit('no immobilie scraped, supply --url or --database parameter')
+        elif parser.results['concurrency']:
+            # scrape_many got them while scraping
+            downloaded, failed = len(set(photo['hash'] for photo in scrapeoff.photo_manifest)), None
+        else:
+            downloaded, failed = update_fotos(scrapeoff.immobilien)
+        print('downloaded {0} photos, {1} failed'.format(downloaded, failed or 0))
         # exit gracefully
         sys.exit(0)
 
     if 'url' not in locals() and parser.results['update_db'] is None:
         sys.exit('Scraper invoked without sane arguments')
 
-    if parser.results['outfile'] is not None:
-        if isinstance(parser.results['outfile'], str):
-            outfile = parser.results['outfile']
-        else:
-            outfile = 'immobilien'
-    else:
-        outfile = sys.stdout
-
-    if parser.results['csv'] is True:
-        import csv
-        if 'urls' not in locals():
-            urls = []
-        if 'scrapeoff' not in locals():
-            scrapeoff = Immo_scraper(debug=debugging, urls=urls)
+    formats = [form for form in ('csv', 'json', 'parquet', 'arrow') if parser.results[form]]
+    if len(formats) > 0:
+        outfile = (parser.results['outfile'] or [None])[-1]
+        if outfile is not None and len(formats) > 1:
+            sys.exit('--outfile takes one of --csv, --json, --parquet or --arrow')
         if 'db' not in locals():
             db = database(debug=debugging, db_uri='sqlite:///:memory:')
-        if len(urls) > 0:
+        if 'scrapeoff' in locals():
             db.insertimmobilie(scrapeoff.immobilien)
-        column_names = db.immobilien.__mapper__.columns
-        selected = db.conn.execute(select([db.immobilien]))
-        selected = [list(x) for x in selected]
-        for row in selected:
-            for col in row:
-                col = str(col)
-        if isinstance(outfile, str):
-            with open(outfile, 'wb') as csvfile:
-                print('writing csv to file:', csvfile)
-                outcsv = csv.writer(csvfile, delimiter=';', quotechar='"', quoting=csv.QUOTE_ALL, lineterminator='\n')
-                outcsv.writerows(selected)
-                #  print(selected)
-        else:
-            outcsv = csv.writer(outfile, delimiter=';', quotechar='"', quoting=csv.QUOTE_ALL, lineterminator='\n')
-            outcsv.writerows(selected)
+        exporter = Exporter(db, table=parser.results['table'], chunksize=parser.results['chunk_size'])
+        for form in formats:
+            if form in ('parquet', 'arrow'):
+                try:
+                    import pyarrow
+                except ImportError:
+                    sys.exit('--{0} needs pyarrow, pip3 install pyarrow'.format(form))
+                path = outfile or '{0}.{1}'.format(parser.results['table'], form)
+                written = exporter.toparquet(path) if form == 'parquet' else exporter.toarrow(path)
+            elif parser.results['outfile'] is None:
+                written = exporter.tocsv(sys.stdout) if form == 'csv' else exporter.tojsonl(sys.stdout)
+            else:
+                path = outfile or '{0}.{1}'.format(parser.results['table'], 'csv' if form == 'csv' else 'jsonl')
+                with open(path, 'w', newline='', encoding='utf-8') as out:
+                    written = exporter.tocsv(out) if form == 'csv' else exporter.tojsonl(out)
+            if parser.results['outfile'] is not None or form in ('parquet', 'arrow'):
+                print('wrote {0} rows of {1} to {2}'.format(written, parser.results['table'], path))
         sys.exit(0)
 
     if parser.results['database'] is not None and len(urls) > 0:
-        if debugging:
-            print('scraping urls: ', urls)
-        insertedImmobilien = db.insertimmobilie(scrapeoff.immobilien)
-        print('scraped immobilien with ids: ', str([i['id'] for i in scrapeoff.immobilien]))
-        try:
-            print('inserted immobilien with ids: ', str([i for i in insertedImmobilien]))
-        except:
-            print('inserted 0 immobilien')
         # exit gracefully
         sys.exit(0)
 
-    if 'urls' in locals() and len(urls) > 0 and parser.results['json'] is True:
-        if debugging:
-            print('scraped ', len(scrapeoff.immobilien), ' immobilien')
 
 if __name__ == "__main__":
     # execute only if run as a script
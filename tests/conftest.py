@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# conftest.py stub result list server the tests of immoKrabbler scrape over
+# Copyright © 2019 Henrik Lindgren (henrikprojekt at googlemail dot com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""the tests scrape the fixtures of fixtures/resultlist from fixtures.Stub_server"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fixtures  # noqa: E402
+
+@pytest.fixture
+def stub():
+    server = fixtures.Stub_server(delay=0.02)
+    yield server
+    server.close()
+
+@pytest.fixture
+def listings():
+    """the listings of every fixture page as a crawl of their searches hands them to the db"""
+    import immoKrabbler
+    immobilien = []
+    for name, page in sorted(fixtures.expected().items()):
+        entries = immoKrabbler.result_entries(immoKrabbler.extract_result_model(fixtures.read(name)))
+        for immo in entries:
+            immo['search_url'] = immoKrabbler.page_url(page['url'], 1)
+            immo['fingerprint'] = immoKrabbler.fingerprint(immo)
+        immobilien.extend(immoKrabbler.normalize(entries))
+    return immobilien
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# test_alerts.py watchlists of immoKrabbler matched against new listings into the alert outbox
+# Copyright © 2019 Henrik Lindgren (henrikprojekt at googlemail dot com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import itertools
+
+import pytest
+
+import immoKrabbler
+
+LISTINGS = [
+    {'id': 1, 'title': 'Wohnung', 'city': 'Gotha', 'zip': 99867, 'kaltmiete': 450, 'wohnfläche': 60,
+     'checkedattributes': ['Balkon', 'Keller']},
+    {'id': 2, 'title': 'Wohnung', 'city': 'Gotha', 'zip': 99867, 'kaltmiete': 700, 'wohnfläche': 95},
+    {'id': 3, 'title': 'Haus', 'city': 'Erfurt', 'zip': 99084, 'kaufpreis': 280000, 'wohnfläche': 130},
+    {'id': 4, 'title': 'Haus', 'city': 'ERFURT', 'zip': 99092, 'kaufpreis': 520000, 'wohnfläche': 210},
+    {'id': 5, 'title': 'Wohnung', 'city': 'Weimar', 'zip': 99423, 'kaltmiete': 380},
+]
+# rows of normalize all have the same keys
+LISTINGS = [dict(dict.fromkeys(('kaltmiete', 'kaufpreis', 'wohnfläche', 'checkedattributes')), **immo)
+            for immo in LISTINGS]
+
+WATCHLISTS = {
+    'cheap in gotha': ['zip=99867', 'kaltmiete<=500'],
+    'balcony': ['checkedattributes=Balkon,Keller'],
+    'erfurt houses': ['city=erfurt', 'kaufpreis<400000'],
+    'big anywhere': ['wohnfläche>=100'],
+    'two zips': ['zip=99084,99423'],
+}
+
+def alerts_db():
+    db = immoKrabbler.database('sqlite://')
+    alerts = immoKrabbler.Alerts(db)
+    ids = dict((alerts.watch(name, [alerts.criterion(text) for text in criteria]), name)
+               for name, criteria in WATCHLISTS.items())
+    return db, alerts, ids
+
+def scan(alerts, criteria, immo):
+    """tests a watchlist against a listing without the index"""
+    for column, op, value in criteria:
+        if immo.get(column) is None:
+            return False
+        if op == '=' and column == 'checkedattributes':
+            if not set(value) <= set(immo[column]):
+                return False
+        elif op == '=':
+            normalize = alerts._normalizer(column)
+            if normalize(immo[column]) not in set(normalize(v) for v in value):
+                return False
+        elif not alerts._tests[op](float(immo[column]), float(value)):
+            return False
+    return True
+
+def test_criterion():
+    alerts = immoKrabbler.Alerts(immoKrabbler.database('sqlite://'))
+    assert alerts.criterion('kaufpreis<300000') == ['kaufpreis', '<', 300000]
+    assert alerts.criterion('zip = 99867, 99869') == ['zip', '=', [99867, 99869]]
+    assert alerts.criterion('wohnfläche>=72,5') == ['wohnfläche', '>=', 72.5]
+    for bad in ('garage<2', 'city<Gotha', 'kaufpreis<viel'):
+        with pytest.raises(ValueError):
+            alerts.criterion(bad)
+
+def test_index_agrees_with_a_scan():
+    db, alerts, ids = alerts_db()
+    alerts._compiled()
+    criteria = dict((wid, [alerts.criterion(text) for text in WATCHLISTS[name]]) for wid, name in ids.items())
+    expected = sorted((wid, immo['id']) for immo, wid in itertools.product(LISTINGS, ids)
+                      if scan(alerts, criteria[wid], immo))
+    assert sorted(alerts.match(LISTINGS)) == expected
+    assert set((ids[wid], iid) for wid, iid in expected) == set([
+        ('cheap in gotha', 1), ('balcony', 1), ('erfurt houses', 3), ('big anywhere', 3), ('big anywhere', 4),
+        ('two zips', 3), ('two zips', 5)])
+
+def test_insertstream_queues_new_listings_once():
+    db, alerts, ids = alerts_db()
+    db.on_insert.append(alerts.queue)
+    assert db.insertstream([dict(immo) for immo in LISTINGS[:3]]) == (3, 0)
+    assert sorted((name, iid) for name, iid, *_ in alerts.pending()) == [
+        ('balcony', 1), ('big anywhere', 3), ('cheap in gotha', 1), ('erfurt houses', 3), ('two zips', 3)]
+    assert alerts.pending() == []
+    # known listings are no news, neither written again nor updated
+    db.insertstream([dict(immo) for immo in LISTINGS[:3]])
+    db.insertstream([dict(LISTINGS[1], kaltmiete=480)], incremental=True)
+    assert alerts.pending() == []
+    db.insertstream([dict(immo) for immo in LISTINGS[3:]], incremental=True)
+    assert sorted((name, iid) for name, iid, *_ in alerts.pending()) == [('big anywhere', 4), ('two zips', 5)]
+
+def test_queue_rolls_back_with_the_batch():
+    db, alerts, ids = alerts_db()
+    db.on_insert.append(alerts.queue)
+
+    def fail(batch):
+        raise ValueError('hook failed')
+    db.on_insert.append(fail)
+    with pytest.raises(ValueError):
+        db.insertstream([dict(LISTINGS[0])])
+    db.on_insert.remove(fail)
+    assert alerts.pending() == []
+    db.insertstream([dict(LISTINGS[0])])
+    assert len(alerts.pending()) == 2
+
+def test_unwatch_recompiles():
+    db, alerts, ids = alerts_db()
+    db.on_insert.append(alerts.queue)
+    names = dict((name, wid) for wid, name in ids.items())
+    assert alerts.unwatch(names['balcony'])
+    assert not alerts.unwatch(names['balcony'])
+    db.insertstream([dict(LISTINGS[0])])
+    assert [name for name, *_ in alerts.pending()] == ['cheap in gotha']
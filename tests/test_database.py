@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# test_database.py schema migrations and writes of the immoKrabbler database
+# Copyright © 2019 Henrik Lindgren (henrikprojekt at googlemail dot com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+
+import immoKrabbler
+
+def now():
+    return int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+
+def test_price_drop_of_a_listing_older_than_its_history():
+    db = immoKrabbler.database('sqlite://')
+    # a listing written before immobilien_history existed, without a row in it
+    db.conn.execute(db.immobilien.insert(), {'id': 1, 'kaufpreis': 280000, 'unixtimestamp': now() - 86400})
+    db.conn.execute(db.schemaVersion.delete().where(db.schemaVersion.c.version == 10))
+    assert db.migrate() == [10]
+    db.insertstream([{'id': 1, 'title': 'Haus', 'kaufpreis': 270000}])
+    assert [(iid, old, new) for iid, _, old, new, _, _ in db.selectPriceDrops()] == [(1, 280000, 270000)]
+
+def test_price_change_updates_the_fingerprint():
+    db = immoKrabbler.database('sqlite://')
+    db.conn.execute(db.immobilien.insert(), {'id': 1, 'kaufpreis': 280000, 'fingerprint': '280000'})
+    db.insertstream([{'id': 1, 'title': 'Haus', 'kaufpreis': 270000, 'fingerprint': '270000'}])
+    assert db.conn.execute(immoKrabbler.select([db.immobilien.c.kaufpreis, db.immobilien.c.fingerprint])).first() == \
+        (270000, '270000')
+
+def test_changes_within_one_second():
+    db = immoKrabbler.database('sqlite://')
+    second = now()
+    db.inserthistory([{'id': 1, 'kaufpreis': 280000}], second)
+    db.inserthistory([{'id': 1, 'kaufpreis': 270000}, {'id': 1, 'kaufpreis': 260000}], second)
+    assert db.conn.execute(immoKrabbler.select([db.immobilienHistory.c.kaufpreis])).fetchall() == [(260000,)]
+    # inserted and changed by two batches of one stream, usually within one second
+    assert db.insertstream([{'id': 2, 'title': 'Haus', 'kaufpreis': 280000}]) == (1, 0)
+    db.insertstream([{'id': 2, 'title': 'Haus', 'kaufpreis': 270000}])
+    db.insertstream([{'id': 2, 'title': 'Haus', 'kaufpreis': 265000}])
+    assert db.conn.execute(immoKrabbler.select([db.immobilien.c.kaufpreis]).where(
+        db.immobilien.c.id == 2)).scalar() == 265000
+
+def test_batch_after_a_rollback():
+    db = immoKrabbler.database('sqlite://')
+
+    def fail(batch):
+        raise ValueError('hook failed')
+    db.on_insert.append(fail)
+    try:
+        db.insertstream([{'id': 1, 'title': 'Haus', 'kaufpreis': 280000, 'checkedattributes': ['Garten'],
+                          'search_url': 'https://www.immobilienscout24.de/Suche/S-T/Haus-Kauf/Thueringen/Gotha'}])
+    except ValueError:
+        pass
+    db.on_insert.remove(fail)
+    assert db.insertstream([{'id': 1, 'title': 'Haus', 'kaufpreis': 280000, 'checkedattributes': ['Garten'],
+                             'search_url': 'https://www.immobilienscout24.de/Suche/S-T/Haus-Kauf/Thueringen/Gotha'}]) == (1, 0)
+    # the links and the search url point to rows of the committed batch
+    assert db.conn.execute('SELECT count(*) FROM immobilienAttributes JOIN checkedAttributes '
+                           'ON checkedAttributes.id = checkedAttributes_fk').scalar() == 1
+    assert db.selectUniqeSearchUrls() == ['https://www.immobilienscout24.de/Suche/S-T/Haus-Kauf/Thueringen/Gotha']
+
+def test_in_memory(tmp_path):
+    assert immoKrabbler.database('sqlite://').in_memory
+    assert immoKrabbler.database('sqlite:///:memory:').in_memory
+    assert not immoKrabbler.database('sqlite:///{0}'.format(tmp_path / 'immo.db')).in_memory
+
+def test_incremental_update_keeps_the_time_of_insert():
+    db = immoKrabbler.database('sqlite://')
+    inserted = now() - 86400
+    db.conn.execute(db.immobilien.insert(), {'id': 1, 'kaufpreis': 280000, 'unixtimestamp': inserted})
+    assert db.insertstream([{'id': 1, 'title': 'Haus', 'kaufpreis': 270000}], incremental=True) == (0, 1)
+    assert db.conn.execute('SELECT kaufpreis, unixtimestamp, typeof(unixtimestamp) FROM immobilien').first() == \
+        (270000, inserted, 'integer')
+
+def test_geohash():
+    assert immoKrabbler.geohash(42.6, -5.6, 5) == 'ezs42'
+    # positions sharing a prefix share a cell
+    assert immoKrabbler.geohash(50.95, 11.2499)[:4] != immoKrabbler.geohash(50.95, 11.2501)[:4]
+
+def test_near_across_a_cell_boundary():
+    # longitude 11.25 is a boundary of the cells down to the first three characters
+    center = (50.95, 11.2499)
+    positions = {1: (50.95, 11.2490), 2: (50.95, 11.2600), 3: (50.9600, 11.2450), 4: (50.95, 11.4000),
+                 5: (50.98, 11.2499), 6: (None, None)}
+    db = immoKrabbler.database('sqlite://')
+    db.insertstream([{'id': iid, 'title': 'Wohnung', 'latitude': latitude, 'longitude': longitude}
+                     for iid, (latitude, longitude) in positions.items()])
+    found = db.near(*center, 2)
+    assert [immo.id for distance, immo in found] == [1, 2, 3]
+    assert [distance for distance, immo in found] == sorted(
+        immoKrabbler.haversine(*center, *positions[iid]) for iid in (1, 2, 3))
+    assert immoKrabbler.geohash(*positions[1])[:3] != immoKrabbler.geohash(*positions[2])[:3]
+
+def test_geohashes_of_rows_written_before_them():
+    db = immoKrabbler.database('sqlite://')
+    db.conn.execute(db.immobilien.insert(), [{'id': 1, 'latitude': 50.95, 'longitude': 11.2499},
+                                             {'id': 2, 'latitude': None, 'longitude': None}])
+    assert db.near(50.95, 11.2499, 1) == []
+    assert db.updateGeohashes() == 1
+    assert [immo.id for distance, immo in db.near(50.95, 11.2499, 1)] == [1]
+
+def test_dedup_pairs_only_within_blocks():
+    listing = {'zip': 99867, 'geohash': None, 'zimmer': 3, 'wohnfläche': 60, 'kaltmiete': 500, 'kaufpreis': None,
+               'address': 'Hauptstraße 5', 'title': 'Schöne 3 Zimmer Wohnung'}
+    rows = {1: dict(listing, wohnfläche=59.9),
+            # a re-post on the other side of the living space bucket border
+            2: dict(listing, wohnfläche=60.1, kaltmiete=505, address='Hauptstr. 5'),
+            3: dict(listing, kaltmiete=900),
+            4: dict(listing, zip=99869),
+            5: dict(listing, zimmer=2),
+            6: dict(listing, kaltmiete=495),
+            7: dict(listing, kaltmiete=None, kaufpreis=500),
+            8: dict(listing, wohnfläche=None)}
+    db = immoKrabbler.database('sqlite://')
+    db.conn.execute(db.immobilien.insert(), [dict(immo, id=iid) for iid, immo in rows.items()])
+    deduplicator = immoKrabbler.Deduplicator(db)
+    assert deduplicator.run() == (3, 1)
+    # the blocks of 99867 with 3 rooms for rent hold 1, 2, 3 and 6, the others are alone
+    assert deduplicator.compared <= 6
+    clusters = dict(db.conn.execute(immoKrabbler.select([db.immobilien.c.id, db.immobilien.c.cluster_id])).fetchall())
+    assert clusters == {1: 1, 2: 1, 3: 3, 4: 4, 5: 5, 6: 1, 7: 7, 8: 8}
+    # a new listing only recomputes its zip
+    db.conn.execute(db.immobilien.insert(), dict(rows[4], id=9, kaltmiete=510))
+    db.conn.execute(db.immobilien.update().where(db.immobilien.c.id == 2).values(cluster_id=None))
+    assert deduplicator.run(ids=[9]) == (2, 1)
+    clusters = dict(db.conn.execute(immoKrabbler.select([db.immobilien.c.id, db.immobilien.c.cluster_id])).fetchall())
+    assert (clusters[2], clusters[4], clusters[9]) == (None, 4, 4)
+
+def report(analytics, level, key=None):
+    """:returns: today's rows of analytics.report without the day, €/m² as floats rounded to cents"""
+    return [row[1:6] + tuple(None if sqm is None else round(float(sqm), 2) for sqm in row[6:])
+            for row in analytics.report(level, key, days=0)]
+
+def test_aggregates_after_a_price_change():
+    db = immoKrabbler.database('sqlite://')
+    analytics = immoKrabbler.Analytics(db)
+    listing = {'city': 'Gotha', 'zip': 99867, 'district': None, 'kaufpreis': None, 'wohnfläche': 50}
+    db.conn.execute(db.immobilien.insert(), [dict(listing, id=1, kaltmiete=500), dict(listing, id=2, kaltmiete=600),
+                                             dict(listing, id=3, kaltmiete=800)])
+    second = now()
+    analytics.touch([1, 2, 3], second)
+    assert report(analytics, 'city', 'Gotha') == [('Gotha', 'rent', 3, 3, 0, 12.67, 12.0)]
+    # the batch of the change only applies its difference, and the median is computed again
+    db.conn.execute(db.immobilien.update().where(db.immobilien.c.id == 1).values(kaltmiete=700))
+    analytics.touch([1], second + 1)
+    assert report(analytics, 'city', 'Gotha') == [('Gotha', 'rent', 3, 3, 0, 14.0, 14.0)]
+    db.conn.execute(db.immobilien.update().where(db.immobilien.c.id == 3).values(city='Erfurt'))
+    analytics.touch([3], second + 2)
+    assert report(analytics, 'city') == [('Erfurt', 'rent', 1, 1, 0, 16.0, 16.0), ('Gotha', 'rent', 2, 2, 0, 13.0, 13.0)]
+    assert report(analytics, 'zip') == [('99867', 'rent', 3, 3, 0, 14.0, 14.0)]
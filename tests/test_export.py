@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# test_export.py exports of immoKrabbler read back and compared with the listings written
+# Copyright © 2019 Henrik Lindgren (henrikprojekt at googlemail dot com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import csv
+import decimal
+import json
+
+import pytest
+
+import immoKrabbler
+
+def exporter(listings, chunksize=5):
+    """:returns: Exporter of a db holding listings, in chunks smaller than the pages"""
+    db = immoKrabbler.database('sqlite://')
+    assert db.insertstream([dict(immo) for immo in listings]) == (len(listings), 0)
+    return immoKrabbler.Exporter(db, chunksize=chunksize)
+
+def same(immo, row):
+    """compares a listing as written with a row read back from json or arrow"""
+    for key in ('id', 'zip', 'title', 'address', 'search_url', 'checkedattributes', 'gallerypictures'):
+        assert row[key] == immo[key], key
+    for key in ('kaltmiete', 'kaufpreis', 'wohnfläche', 'latitude', 'longitude', 'zimmer'):
+        assert row[key] == (None if immo[key] is None else float(immo[key])), key
+
+def test_jsonl_round_trip(listings, tmp_path):
+    with open(str(tmp_path / 'immo.jsonl'), 'w', encoding='utf-8') as out:
+        assert exporter(listings).tojsonl(out) == len(listings)
+    with open(str(tmp_path / 'immo.jsonl'), encoding='utf-8') as exported:
+        rows = [json.loads(line) for line in exported]
+    assert [row['id'] for row in rows] == sorted(immo['id'] for immo in listings)
+    by_id = dict((immo['id'], immo) for immo in listings)
+    for row in rows:
+        same(by_id[row['id']], row)
+
+def test_csv_round_trip(listings, tmp_path):
+    export = exporter(listings)
+    with open(str(tmp_path / 'immo.csv'), 'w', encoding='utf-8', newline='') as out:
+        assert export.tocsv(out) == len(listings)
+    with open(str(tmp_path / 'immo.csv'), encoding='utf-8', newline='') as exported:
+        reader = csv.reader(exported, delimiter=';')
+        assert next(reader) == export.columns
+        rows = [dict(zip(export.columns, row)) for row in reader]
+    by_id = dict((immo['id'], immo) for immo in listings)
+    assert sorted(int(row['id']) for row in rows) == sorted(by_id)
+    for row in rows:
+        immo = by_id[int(row['id'])]
+        assert row['title'] == immo['title'] and row['search_url'] == immo['search_url']
+        # decimals as written, no float noise, None as an empty field
+        for key in ('kaltmiete', 'kaufpreis', 'wohnfläche', 'latitude'):
+            assert (decimal.Decimal(row[key]) if row[key] else None) == immo[key], key
+        assert json.loads(row['checkedattributes']) == immo['checkedattributes']
+
+def test_parquet_round_trip(listings, tmp_path):
+    parquet = pytest.importorskip('pyarrow.parquet')
+    assert exporter(listings).toparquet(str(tmp_path / 'immo.parquet')) == len(listings)
+    rows = parquet.read_table(str(tmp_path / 'immo.parquet')).to_pylist()
+    by_id = dict((immo['id'], immo) for immo in listings)
+    assert len(rows) == len(by_id)
+    for row in rows:
+        # json columns are json text in arrow
+        row['checkedattributes'] = json.loads(row['checkedattributes'] or 'null')
+        row['gallerypictures'] = json.loads(row['gallerypictures'] or 'null')
+        same(by_id[row['id']], row)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# test_fixtures.py the parser and end to end crawls of immoKrabbler against the recorded result pages
+# Copyright © 2019 Henrik Lindgren (henrikprojekt at googlemail dot com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+import fixtures
+import immoKrabbler
+
+def searches(pages):
+    """:returns: the search urls of the pages, page 1 of each"""
+    return [page['url'] for page in pages.values() if page['pageNumber'] == 1]
+
+def crawl(db, urls, **options):
+    """crawls urls into db the way --update-db does
+    :returns: tuple (nr of inserted, nr of updated immobilien)"""
+    scraper = immoKrabbler.Immo_scraper(engine='http', frontier=db, analytics=immoKrabbler.Analytics(db), **options)
+    try:
+        return db.insertstream(scraper.iter_immobilien(urls), on_commit=scraper.checkpoint)
+    finally:
+        scraper.close()
+
+def test_check():
+    assert fixtures.check() == []
+
+def test_snapshots_recorded():
+    for name in fixtures.expected():
+        assert os.path.isfile(os.path.join(fixtures.FIXTURES, name[:-len('.html')] + '.json')), name
+
+def test_offline_crawl(tmp_path):
+    pages = fixtures.expected()
+    cache = immoKrabbler.Http_cache(str(tmp_path / 'cache'), offline=True)
+    fixtures.replay(cache)
+    db = immoKrabbler.database('sqlite:///{0}'.format(tmp_path / 'immo.db'))
+    inserted, updated = crawl(db, searches(pages), cache=cache)
+    assert (inserted, updated) == (sum(page['entries'] for page in pages.values()), 0)
+    assert all(db.selectCrawlState(url)['status'] == 'done' for url in searches(pages))
+    assert set(searches(pages)) <= set(db.selectUniqeSearchUrls())
+    # a second crawl only finds known listings
+    assert crawl(db, searches(pages), cache=cache) == (0, 0)
+
+def test_stub_crawl(stub, tmp_path, monkeypatch):
+    # the stub is not www.immobilienscout24.de
+    monkeypatch.setattr(immoKrabbler, 'validate_url', lambda url: True)
+    pages = fixtures.expected()
+    db = immoKrabbler.database('sqlite:///{0}'.format(tmp_path / 'immo.db'))
+    urls = [stub.url(name) for name, page in pages.items() if page['pageNumber'] == 1]
+    inserted, updated = crawl(db, urls)
+    assert (inserted, updated) == (sum(page['entries'] for page in pages.values()), 0)
+    assert sorted(stub.requests) == sorted(stub.url(name)[len(stub.base):] for name in pages)
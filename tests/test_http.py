@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# test_http.py the connection pool and the on disk response cache of immoKrabbler
+# Copyright © 2019 Henrik Lindgren (henrikprojekt at googlemail dot com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+import pytest
+
+import immoKrabbler
+
+GOTHA = 'gotha_wohnung_miete_p1.html'
+
+def recording(pool):
+    """:returns: list the connections pool hands out are appended to"""
+    opened = []
+    connection = pool._connection
+
+    def record(scheme, netloc):
+        conn, reused = connection(scheme, netloc)
+        opened.append(conn)
+        return conn, reused
+    pool._connection = record
+    return opened
+
+def test_timeout_closes_the_connection(stub):
+    pool = immoKrabbler.Connection_pool(timeout=0.05)
+    opened = recording(pool)
+    stub.delay = 0.5
+    with pytest.raises(OSError):
+        pool.request(stub.url(GOTHA))
+    assert len(opened) == 1 and opened[0].sock is None
+    assert sum(len(idle) for idle in pool._idle.values()) == 0
+    stub.delay = 0
+    pool.timeout = 5
+    assert pool.request(stub.url(GOTHA))[0] == 200
+
+def test_failing_sink_closes_the_connection(stub):
+    pool = immoKrabbler.Connection_pool()
+    opened = recording(pool)
+
+    def sink(chunk):
+        raise OSError('disk full')
+    with pytest.raises(OSError):
+        pool.request(stub.url(GOTHA), sink=sink)
+    assert len(opened) == 1 and opened[0].sock is None
+    assert sum(len(idle) for idle in pool._idle.values()) == 0
+
+def test_cache_counts_the_bytes_on_disk(tmp_path):
+    cache = immoKrabbler.Http_cache(str(tmp_path), maxsize=10 ** 6)
+    urls = ['https://www.immobilienscout24.de/expose/{0}'.format(i) for i in range(3)]
+    for url in urls:
+        cache.put(url, {'content-type': 'text/html', 'etag': '"{0}"'.format(url)}, b'x' * 100)
+    on_disk = sum(os.path.getsize(cache._file(cache.key(url))) for url in urls)
+    assert cache._size == on_disk > 300
+    # a new instance reads the same sizes back
+    assert immoKrabbler.Http_cache(str(tmp_path))._size == on_disk
+    # the metadata counts against maxsize too
+    cache.maxsize = on_disk - 50
+    cache.put(urls[0], {'content-type': 'text/html', 'etag': '"{0}"'.format(urls[0])}, b'x' * 100)
+    assert cache.get(urls[1]) is None and cache._size <= cache.maxsize
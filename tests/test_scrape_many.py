@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# test_scrape_many.py concurrent scrapes of immoKrabbler against the stub result list server
+# Copyright © 2019 Henrik Lindgren (henrikprojekt at googlemail dot com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import os
+import threading
+import urllib.parse
+
+import immoKrabbler
+
+GOTHA = 'gotha_wohnung_miete_p1.html'
+ERFURT = 'erfurt_haus_kauf_single.html'
+WEIMAR = 'weimar_haus_kauf_empty.html'
+
+def scrape_many(urls, **options):
+    scraper = immoKrabbler.Immo_scraper(engine='http', imagepath=options.pop('imagepath', 'immoPhotos'))
+    try:
+        scraper.immobilien = asyncio.run(scraper.scrape_many(urls, **options))
+    finally:
+        scraper.close()
+    return scraper
+
+def test_pages_through_results(stub):
+    scraper = scrape_many([stub.url(GOTHA), stub.url(WEIMAR)])
+    assert len(scraper.immobilien) == 23
+    assert urllib.parse.urlsplit(stub.url('gotha_wohnung_miete_p2.html')).path in stub.requests
+    assert all(immo['search_url'] == stub.url(GOTHA) for immo in scraper.immobilien)
+
+def test_per_host_limit(stub):
+    scrape_many([stub.url(GOTHA), stub.url(ERFURT), stub.url(WEIMAR)], per_host=1, concurrency=8)
+    assert len(stub.requests) == 4
+    assert stub.max_in_flight == 1
+
+def test_downloads_photos(stub, tmp_path):
+    scraper = scrape_many([stub.url(ERFURT)], photos=True, per_host=2, imagepath=str(tmp_path))
+    pictures = [path for path in stub.requests if path.startswith('/pic/')]
+    assert len(pictures) > 0 and len(pictures) == len(set(pictures))
+    assert stub.max_in_flight <= 2
+    assert len(scraper.photo_manifest) > 0
+    for photo in scraper.photo_manifest:
+        assert photo['immobilie_fk'] == scraper.immobilien[0]['id']
+        assert os.path.isfile(os.path.join(str(tmp_path), photo['hash'][:2], photo['hash'] + '.jpg'))
+
+def test_failed_search_keeps_the_others(stub):
+    stub.failing.add(urllib.parse.urlsplit(stub.url(ERFURT)).path)
+    scraper = scrape_many([stub.url(ERFURT), stub.url(GOTHA)])
+    assert len(scraper.immobilien) == 23
+
+def test_lookups_run_off_the_loop(stub):
+    threads = []
+
+    def known_ids(ids):
+        threads.append(threading.get_ident())
+        return set()
+
+    def fingerprints(ids):
+        threads.append(threading.get_ident())
+        return {}
+    scraper = immoKrabbler.Immo_scraper(engine='http', known_ids=known_ids, fingerprints=fingerprints)
+    try:
+        assert len(asyncio.run(scraper.scrape_many([stub.url(GOTHA)]))) == 23
+    finally:
+        scraper.close()
+    assert len(threads) == 4 and threading.get_ident() not in threads